@@ -1,23 +1,103 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 from dotenv import load_dotenv
 
+from app.metrics import instrument_engine
+
 load_dotenv()
 
 # 開発環境ではSQLiteを使用し、本番環境ではPostgreSQLを使用する
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ohgiri.db")
 
+# コネクションプールの設定（同期・非同期エンジンで共通）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# 切断されたコネクションを使う前に検出する
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# この秒数より古いコネクションは作り直す（DB側のアイドルタイムアウト対策）
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+
+def to_async_url(url: str) -> str:
+    """同期ドライバのURLを非同期ドライバ（asyncpg / aiosqlite）のURLに変換する"""
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "postgresql" and parsed.get_driver_name() != "asyncpg":
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+    elif backend == "sqlite" and parsed.get_driver_name() != "aiosqlite":
+        parsed = parsed.set(drivername="sqlite+aiosqlite")
+    return parsed.render_as_string(hide_password=False)
+
+
+def pool_options(url: str) -> dict:
+    """インメモリSQLite以外ではプールの大きさと再接続の設定を適用する"""
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith(":")):
+        return options
+    options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+
+# SQLiteで接続ごとに適用するPRAGMA（同時書き込みに強いWALモードとキャッシュ設定）
+SQLITE_PRAGMAS_ENABLED = os.getenv("SQLITE_PRAGMAS_ENABLED", "true").lower() == "true"
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    # 負の値はKiB単位（-64000で約64MB）
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-64000"),
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+    # ロック中の書き込みを失敗させずに待つ時間（ミリ秒）
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT", "5000"),
+}
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+# 非同期エンジンのURL（未指定の場合はDATABASE_URLのドライバを置き換える）
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
 # SQLiteの場合はcheck_same_threadをFalseに設定
 connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
 
+# バックグラウンドのワーカースレッド（AI評価・投票の書き込みなど）で使う同期エンジン
 engine = create_engine(
-    DATABASE_URL, connect_args=connect_args
+    DATABASE_URL, connect_args=connect_args, **pool_options(DATABASE_URL)
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# ルーターで使う非同期エンジン（DBの応答待ちの間もイベントループをブロックしない）
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL)
+)
+
+if SQLITE_PRAGMAS_ENABLED and DATABASE_URL.startswith("sqlite"):
+    event.listen(engine, "connect", apply_sqlite_pragmas)
+if SQLITE_PRAGMAS_ENABLED and ASYNC_DATABASE_URL.startswith("sqlite"):
+    event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+
+# クエリ数と実行時間をメトリクスに記録する
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
+# コミット後に属性を読み直す（遅延ロード）と非同期セッションではエラーになるため、expire_on_commitは無効にする
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 # 依存性注入のためのDBセッション取得関数
@@ -26,4 +106,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+# 依存性注入のための非同期DBセッション取得関数
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
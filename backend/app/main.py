@@ -1,11 +1,30 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from contextlib import asynccontextmanager
+import asyncio
 import os
-from app.database import SessionLocal, engine, Base
-from app.routers import topics, answers, votes
+from app.logging_config import REQUEST_ID_HEADER, RequestIdMiddleware, configure_logging
+from app.database import SessionLocal, engine, async_engine
+from app.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, registry
+from app.migrations import run_migrations
+from app.pagination import NEXT_CURSOR_HEADER
+from app.routers import topics, answers, votes, admin
 from app.models import *
+from app.services.ai_providers import ai_provider
+from app.services.archiver import topic_archiver, ARCHIVER_ENABLED
+from app.services.evaluation_cache import evaluation_cache
+from app.services.evaluation_queue import evaluation_queue
+from app.services.ranking import ranking_index
+from app.services.reevaluation_scheduler import reevaluation_scheduler
+from app.services.vote_ingest import vote_ingestor
+from app.services.topic_scheduler import topic_scheduler, TOPIC_SCHEDULER_ENABLED
+from app.services.realtime import hub, topic_channel, format_sse, encode_event, STREAM_KEEPALIVE_SECONDS
 import uvicorn
 
+# ログの出力は別スレッドで行う（リクエストの処理をログの書き込みで止めない）
+configure_logging()
+
 # 環境変数から許可するオリジンを取得、なければデフォルト値を使用
 FRONTEND_URLS = os.environ.get("ALLOWED_ORIGINS", "http://localhost:3000,https://realtimeohgiri-rev2.vercel.app,https://realtimeohgiri-rev2-git-main-masattv.vercel.app").split(",")
 
@@ -21,10 +40,42 @@ ALLOWED_ORIGINS = [
     "https://*.ngrok.io",        # 旧ngrokドメインパターン
 ]
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 未作成のテーブルの作成と未適用のマイグレーションの適用を行い、期限切れのキャッシュを削除
+    run_migrations(engine)
+    db = SessionLocal()
+    try:
+        evaluation_cache.purge_expired(db)
+        # アクティブなお題のランキングをDBから構築
+        ranking_index.rebuild(db)
+    finally:
+        db.close()
+    
+    # AI評価キューのワーカーを起動
+    await evaluation_queue.start()
+    await vote_ingestor.start()
+    # お題の自動切り替え（アクティブなお題がなければ起動直後に生成）
+    if TOPIC_SCHEDULER_ENABLED:
+        await topic_scheduler.start()
+    # 終了したお題の定期アーカイブ
+    if ARCHIVER_ENABLED:
+        await topic_archiver.start()
+    yield
+    await topic_archiver.stop()
+    await topic_scheduler.stop()
+    # バッファに残った投票を書き込んでから停止
+    await vote_ingestor.stop()
+    await reevaluation_scheduler.stop()
+    await evaluation_queue.stop()
+    await ai_provider.aclose()
+    await async_engine.dispose()
+
 app = FastAPI(
     title="リアルタイム大喜利 API",
     description="リアルタイムに大喜利のお題と回答を管理するAPI",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # CORSミドルウェアを追加
@@ -34,17 +85,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # すべてのHTTPメソッドを許可
     allow_headers=["*"],  # すべてのHTTPヘッダーを許可
+    expose_headers=[NEXT_CURSOR_HEADER, REQUEST_ID_HEADER],  # ページネーションのカーソルとリクエストIDをブラウザから読めるようにする
 )
 
+# ルートごとのレイテンシ・ステータス・DBクエリ数を記録（/metricsで公開）
+app.add_middleware(MetricsMiddleware)
+# リクエストIDをログとレスポンスヘッダーに付ける（最も外側で実行する）
+app.add_middleware(RequestIdMiddleware)
+
+# バックグラウンド処理の状態は出力時に取得する
+registry.gauge("ai_eval_queue_depth", "AI評価キューで待機中のジョブ数", callback=lambda: evaluation_queue.stats()["queue_depth"])
+registry.gauge("ai_eval_in_flight", "実行中のAI評価ジョブ数", callback=lambda: evaluation_queue.stats()["in_flight"])
+registry.gauge("vote_ingest_buffered", "書き込み待ちの投票数", callback=lambda: vote_ingestor.stats()["buffered"])
+registry.gauge("db_pool_checked_out", "使用中のDB接続数（非同期エンジン）", callback=lambda: async_engine.pool.checkedout())
+
 # ルーターの登録
 app.include_router(topics.router, prefix="/api/topics", tags=["topics"])
 app.include_router(answers.router, prefix="/api/answers", tags=["answers"])
 app.include_router(votes.router, prefix="/api/votes", tags=["votes"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 
 @app.get("/api")
 async def root():
     return {"message": "リアルタイム大喜利APIへようこそ！"}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus形式のメトリクス"""
+    return PlainTextResponse(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/health")
 async def health_check():
     """
@@ -52,5 +121,68 @@ async def health_check():
     """
     return {"status": "healthy"}
 
+@app.get("/api/stream/topics/{topic_id}")
+async def stream_topic_events(topic_id: int, request: Request):
+    """
+    お題ごとの差分イベント（新規回答・AI評価・投票数）をServer-Sent Eventsで配信する
+    """
+    channel = topic_channel(topic_id)
+    queue = hub.subscribe(channel)
+
+    async def event_generator():
+        try:
+            yield format_sse({"type": "subscribed", "topic_id": topic_id})
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            hub.unsubscribe(channel, queue)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.websocket("/ws/topics/{topic_id}")
+async def websocket_topic_events(websocket: WebSocket, topic_id: int):
+    """
+    お題ごとの差分イベントをWebSocketで配信する
+    """
+    await websocket.accept()
+    channel = topic_channel(topic_id)
+    queue = hub.subscribe(channel)
+    # クライアントからの切断を検知するため受信も並行して待つ
+    receiver = asyncio.ensure_future(websocket.receive_text())
+    getter = None
+    try:
+        await websocket.send_text(encode_event({"type": "subscribed", "topic_id": topic_id}))
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                if receiver.exception() is not None:
+                    break
+                # クライアントからのメッセージは無視する
+                receiver = asyncio.ensure_future(websocket.receive_text())
+            if getter in done:
+                await websocket.send_text(encode_event(getter.result()))
+                getter = None
+            else:
+                getter.cancel()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        if getter is not None:
+            getter.cancel()
+        hub.unsubscribe(channel, queue)
+
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
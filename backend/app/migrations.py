@@ -0,0 +1,167 @@
+import logging
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from app.database import Base
+from app.models import models  # noqa: F401  テーブル定義をBase.metadataに登録する
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+def _columns(conn: Connection, table: str) -> List[str]:
+    return [column["name"] for column in inspect(conn).get_columns(table)]
+
+
+def _indexes(conn: Connection, table: str) -> List[str]:
+    return [index["name"] for index in inspect(conn).get_indexes(table)]
+
+
+def _create_index(conn: Connection, name: str, table: str, columns: str, unique: bool = False, where: str = "") -> None:
+    """インデックスがなければ作成する（whereを指定すると部分インデックスにする）"""
+    if name in _indexes(conn, table):
+        return
+    conn.execute(text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({columns})" + (f" WHERE {where}" if where else "")
+    ))
+    logger.info("%s index added to %s table", name, table)
+
+
+def repair_vote_counts(conn: Connection) -> int:
+    """votesテーブルから投票数を数え直してanswers.vote_countを修復し、更新した件数を返す
+
+    アーカイブ済みのお題は投票を削除済みのため対象外にする。
+    """
+    result = conn.execute(text(
+        "UPDATE answers SET vote_count = "
+        "(SELECT COUNT(*) FROM votes WHERE votes.answer_id = answers.id) "
+        "WHERE vote_count <> (SELECT COUNT(*) FROM votes WHERE votes.answer_id = answers.id) "
+        "AND topic_id NOT IN (SELECT topic_id FROM topic_archives)"
+    ))
+    return result.rowcount
+
+
+# 0001: answers.user_idカラム追加
+def _add_answer_user_id(conn: Connection) -> None:
+    if "user_id" not in _columns(conn, "answers"):
+        conn.execute(text("ALTER TABLE answers ADD COLUMN user_id VARCHAR(100) NOT NULL DEFAULT 'anonymous'"))
+
+
+# 0002: answers.vote_countカラム追加（既存の投票から投票数を埋める）
+def _add_answer_vote_count(conn: Connection) -> None:
+    if "vote_count" not in _columns(conn, "answers"):
+        conn.execute(text("ALTER TABLE answers ADD COLUMN vote_count INTEGER NOT NULL DEFAULT 0"))
+        repair_vote_counts(conn)
+
+
+# 0003: 重複投票を削除して(answer_id, user_id)のユニークインデックスを追加
+def _add_vote_unique_index(conn: Connection) -> None:
+    if "uq_votes_answer_user" in _indexes(conn, "votes"):
+        return
+    result = conn.execute(text(
+        "DELETE FROM votes WHERE id NOT IN "
+        "(SELECT MIN(id) FROM votes GROUP BY answer_id, user_id)"
+    ))
+    logger.info("duplicate votes removed: %d", result.rowcount)
+    _create_index(conn, "uq_votes_answer_user", "votes", "answer_id, user_id", unique=True)
+    # 削除した重複投票の分だけ投票数を修正する
+    repair_vote_counts(conn)
+
+
+# 0004: よく使う検索条件のインデックスを追加
+def _add_hot_path_indexes(conn: Connection) -> None:
+    _create_index(conn, "ix_answers_topic_id", "answers", "topic_id")
+    _create_index(conn, "ix_answers_user_id_created_at", "answers", "user_id, created_at")
+    _create_index(conn, "ix_votes_user_id_answer_id", "votes", "user_id, answer_id")
+    _create_index(conn, "ix_topics_is_active_expires_at", "topics", "is_active, expires_at")
+
+
+# 0005: 一覧のキーセットページネーション用のインデックスを追加
+def _add_pagination_indexes(conn: Connection) -> None:
+    _create_index(conn, "ix_topics_created_at", "topics", "created_at")
+    _create_index(conn, "ix_answers_topic_id_created_at", "answers", "topic_id, created_at")
+    _create_index(conn, "ix_answers_topic_id_vote_count", "answers", "topic_id, vote_count")
+
+
+# 0006: 未評価の回答を探すための部分インデックスを追加
+def _add_pending_answer_index(conn: Connection) -> None:
+    _create_index(conn, "ix_answers_pending_created_at", "answers", "created_at", where="ai_score IS NULL")
+
+
+# 0007: answers.duplicate_of_idカラム追加
+def _add_answer_duplicate_of_id(conn: Connection) -> None:
+    if "duplicate_of_id" not in _columns(conn, "answers"):
+        conn.execute(text("ALTER TABLE answers ADD COLUMN duplicate_of_id INTEGER REFERENCES answers(id)"))
+
+
+# 0008: answers.eval_claimed_atカラム追加（既存の回答は未確保のまま）
+def _add_answer_eval_claimed_at(conn: Connection) -> None:
+    if "eval_claimed_at" not in _columns(conn, "answers"):
+        conn.execute(text("ALTER TABLE answers ADD COLUMN eval_claimed_at TIMESTAMP"))
+
+
+# 0009: answers.evaluated_atカラム追加
+def _add_answer_evaluated_at(conn: Connection) -> None:
+    if "evaluated_at" not in _columns(conn, "answers"):
+        conn.execute(text("ALTER TABLE answers ADD COLUMN evaluated_at TIMESTAMP"))
+
+
+# 適用順に並べたマイグレーション（一度リリースしたものは変更せず、末尾に追加する）
+MIGRATIONS: List[Migration] = [
+    Migration(1, "add_answer_user_id", _add_answer_user_id),
+    Migration(2, "add_answer_vote_count", _add_answer_vote_count),
+    Migration(3, "add_vote_unique_index", _add_vote_unique_index),
+    Migration(4, "add_hot_path_indexes", _add_hot_path_indexes),
+    Migration(5, "add_pagination_indexes", _add_pagination_indexes),
+    Migration(6, "add_pending_answer_index", _add_pending_answer_index),
+    Migration(7, "add_answer_duplicate_of_id", _add_answer_duplicate_of_id),
+    Migration(8, "add_answer_eval_claimed_at", _add_answer_eval_claimed_at),
+    Migration(9, "add_answer_evaluated_at", _add_answer_evaluated_at),
+]
+
+
+def _ensure_migrations_table(conn: Connection) -> None:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR(100) NOT NULL, "
+        "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    ))
+
+
+def applied_versions(engine: Engine) -> List[int]:
+    with engine.begin() as conn:
+        _ensure_migrations_table(conn)
+        return [version for (version,) in conn.execute(text("SELECT version FROM schema_migrations ORDER BY version"))]
+
+
+def run_migrations(engine: Engine) -> List[int]:
+    """未作成のテーブルを作成し、未適用のマイグレーションを順に適用して、適用したバージョンを返す
+
+    各マイグレーションは既存のスキーマを確認してから変更するため、
+    新規作成したDB（create_allで最新のスキーマになっている）では記録だけが行われる。
+    """
+    Base.metadata.create_all(bind=engine)
+
+    applied = set(applied_versions(engine))
+    newly_applied = []
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            continue
+        # マイグレーションごとに1トランザクションで適用と記録を行う
+        with engine.begin() as conn:
+            migration.upgrade(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                {"version": migration.version, "name": migration.name},
+            )
+        logger.info("マイグレーションを適用しました: %04d_%s", migration.version, migration.name)
+        newly_applied.append(migration.version)
+    return newly_applied
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index, LargeBinary
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from app.database import Base
 import pytz
 from datetime import datetime
@@ -10,13 +11,26 @@ def get_jst_time():
     # SQLiteでは単純にfunc.now()を使い、Pythonでタイムゾーン変換を行う
     return func.now()
 
+# 作成日時の型。SQLiteではCURRENT_TIMESTAMP（server_default）と同じ秒単位の形式でバインドし、
+# キーセットページネーションのカーソル値と保存済みの値を文字列として正しく比較できるようにする
+CreatedAt = DateTime().with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite",
+)
+
 class Topic(Base):
     """大喜利のお題モデル"""
     __tablename__ = "topics"
+    __table_args__ = (
+        # アクティブなお題の検索（is_active = true AND expires_at > now）用
+        Index("ix_topics_is_active_expires_at", "is_active", "expires_at"),
+        # お題一覧のページネーション（created_at, id）用
+        Index("ix_topics_created_at", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     content = Column(Text, nullable=False)
-    created_at = Column(DateTime, server_default=func.now())
+    created_at = Column(CreatedAt, server_default=func.now())
     expires_at = Column(DateTime, nullable=False)
     is_active = Column(Boolean, default=True)
     
@@ -26,17 +40,41 @@ class Topic(Base):
 class Answer(Base):
     """大喜利の回答モデル"""
     __tablename__ = "answers"
+    __table_args__ = (
+        # お題ごとの回答一覧・ランキング構築用
+        Index("ix_answers_topic_id", "topic_id"),
+        # ユーザーごとの直近の回答の検索用
+        Index("ix_answers_user_id_created_at", "user_id", "created_at"),
+        # お題ごとの回答一覧のページネーション（投稿順・投票数順）用
+        Index("ix_answers_topic_id_created_at", "topic_id", "created_at"),
+        Index("ix_answers_topic_id_vote_count", "topic_id", "vote_count"),
+        # 未評価のまま残った回答の再評価用（評価済みの回答は含めない部分インデックス）
+        Index(
+            "ix_answers_pending_created_at", "created_at",
+            sqlite_where=text("ai_score IS NULL"), postgresql_where=text("ai_score IS NULL"),
+        ),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     topic_id = Column(Integer, ForeignKey("topics.id"), nullable=False)
     content = Column(Text, nullable=False)
     user_name = Column(String(100), nullable=False)
     user_id = Column(String(100), nullable=False)  # 同一ユーザー判定用のID - このカラムが必要
-    created_at = Column(DateTime, server_default=func.now())
+    created_at = Column(CreatedAt, server_default=func.now())
     
     # AI評価
     ai_score = Column(Integer, nullable=True)
     ai_comment = Column(Text, nullable=True)
+    # 保存されている評価の依頼日時（これより前に依頼された評価では上書きしない）
+    evaluated_at = Column(DateTime, nullable=True)
+    # ほぼ同じ回答の評価を再利用した場合の元の回答ID
+    duplicate_of_id = Column(Integer, ForeignKey("answers.id"), nullable=True)
+    # 評価を担当するプロセスが回答を確保した日時（投稿時と未評価の回答の積み直し時に記録し、
+    # 一定時間更新されなければ他のプロセスが積み直せる）
+    eval_claimed_at = Column(CreatedAt, nullable=True, default=func.now())
+    
+    # 投票数（投票の追加時に同じトランザクションで更新する非正規化カウンタ）
+    vote_count = Column(Integer, nullable=False, default=0, server_default="0")
     
     # リレーションシップ
     topic = relationship("Topic", back_populates="answers")
@@ -45,11 +83,51 @@ class Answer(Base):
 class Vote(Base):
     """回答への投票モデル"""
     __tablename__ = "votes"
+    __table_args__ = (
+        # 同じユーザーが同じ回答に重複して投票できないようにDB側で保証する（answer_idでの検索にも使われる）
+        Index("uq_votes_answer_user", "answer_id", "user_id", unique=True),
+        # ユーザーごとの投票済み回答の検索用
+        Index("ix_votes_user_id_answer_id", "user_id", "answer_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     answer_id = Column(Integer, ForeignKey("answers.id"), nullable=False)
     user_id = Column(String(100), nullable=False)  # 投票者のID
-    created_at = Column(DateTime, server_default=func.now())
+    created_at = Column(CreatedAt, server_default=func.now())
     
     # リレーションシップ
-    answer = relationship("Answer", back_populates="votes") 
\ No newline at end of file
+    answer = relationship("Answer", back_populates="votes")
+
+class EvaluationCacheEntry(Base):
+    """AI評価結果のキャッシュ（お題・回答・プロンプトバージョンの正規化ハッシュがキー）"""
+    __tablename__ = "evaluation_cache"
+    
+    cache_key = Column(String(64), primary_key=True)
+    prompt_version = Column(String(20), nullable=False)
+    score = Column(Integer, nullable=False)
+    comment = Column(Text, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+class TopicArchive(Base):
+    """終了したお題のスナップショット（回答・AIスコア・最終的な投票数をzlib圧縮したJSON）
+
+    アーカイブ後は個々の投票（votes）を削除し、お題の詳細はこのスナップショットから返す。
+    """
+    __tablename__ = "topic_archives"
+    
+    topic_id = Column(Integer, ForeignKey("topics.id"), primary_key=True)
+    answer_count = Column(Integer, nullable=False, default=0)
+    vote_total = Column(Integer, nullable=False, default=0)
+    snapshot = Column(LargeBinary, nullable=False)
+    archived_at = Column(DateTime, server_default=func.now())
+
+class Lease(Base):
+    """複数のインスタンス（ワーカー）の間で処理を1つに限るためのリース
+
+    holderが有効期限（expires_at）まで処理を独占する。期限切れのリースは他のインスタンスが取得できる。
+    """
+    __tablename__ = "leases"
+    
+    name = Column(String(100), primary_key=True)
+    holder = Column(String(200), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
@@ -0,0 +1,74 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Response
+from sqlalchemy import and_, or_
+
+# 次のページのカーソルを返すレスポンスヘッダー（一覧のレスポンス本文は従来どおり配列のまま）
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# (並び順の式, 降順かどうか) の組。最後の要素は一意なID列にする
+SortKey = Sequence[Tuple[Any, bool]]
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(sort: str, values: Sequence[Any]) -> str:
+    """並び順の名前と最後の行のキー値から不透明なカーソル文字列を作る"""
+    payload = json.dumps({"s": sort, "k": [_encode_value(value) for value in values]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, size: int) -> List[Any]:
+    """カーソル文字列をキー値に戻す。不正なカーソルや並び順が違うカーソルは400を返す"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        values = [_decode_value(value) for value in payload["k"]]
+        valid = payload["s"] == sort and len(values) == size
+    except (ValueError, KeyError, TypeError):
+        valid = False
+    if not valid:
+        raise HTTPException(status_code=400, detail="カーソルが不正です")
+    return values
+
+
+def keyset_filter(sort_key: SortKey, values: Sequence[Any]):
+    """(k1, k2, ...) が指定した値より後ろにある行を選ぶ条件（昇順・降順の混在に対応）"""
+    clauses = []
+    for index, (column, descending) in enumerate(sort_key):
+        equal = [prefix_column == value for (prefix_column, _), value in zip(sort_key[:index], values)]
+        after = column < values[index] if descending else column > values[index]
+        clauses.append(and_(*equal, after))
+    return or_(*clauses)
+
+
+def order_by(sort_key: SortKey) -> list:
+    return [column.desc() if descending else column.asc() for column, descending in sort_key]
+
+
+def paginate(stmt, sort: str, sort_key: SortKey, limit: int, cursor: Optional[str]):
+    """キーセット方式でページを絞り込むSELECTを返す（次ページの有無を判定するため1件多く取得する）"""
+    if cursor:
+        stmt = stmt.where(keyset_filter(sort_key, decode_cursor(cursor, sort, len(sort_key))))
+    return stmt.order_by(*order_by(sort_key)).limit(limit + 1)
+
+
+def finish_page(rows: list, sort: str, key_of, limit: int, response: Response) -> list:
+    """余分に取得した1件を取り除き、続きがあれば次ページのカーソルをヘッダーに設定する"""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(sort, key_of(rows[-1]))
+    return rows
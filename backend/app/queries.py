@@ -0,0 +1,42 @@
+from typing import Any, Dict, List
+
+from sqlalchemy import select
+
+from app.models.models import Answer, Topic, TopicArchive
+
+# AnswerResponseと同じフィールドを列として取得する（ORMオブジェクトを作らない読み取り用）
+ANSWER_COLUMNS = (
+    Answer.id,
+    Answer.topic_id,
+    Answer.content,
+    Answer.user_name,
+    Answer.user_id,
+    Answer.created_at,
+    Answer.ai_score,
+    Answer.ai_comment,
+    Answer.vote_count,
+    Answer.duplicate_of_id,
+)
+
+TOPIC_COLUMNS = (
+    Topic.id,
+    Topic.content,
+    Topic.created_at,
+    Topic.expires_at,
+    Topic.is_active,
+)
+
+
+def select_answers():
+    return select(*ANSWER_COLUMNS)
+
+
+def select_topic_with_snapshot(topic_id: int):
+    """お題の行とアーカイブ済みの場合のスナップショットを1クエリで取得する"""
+    return select(*TOPIC_COLUMNS, TopicArchive.snapshot)\
+        .outerjoin(TopicArchive, TopicArchive.topic_id == Topic.id)\
+        .where(Topic.id == topic_id)
+
+
+def row_dicts(rows) -> List[Dict[str, Any]]:
+    return [dict(row._mapping) for row in rows]
@@ -0,0 +1,20 @@
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+try:
+    import orjson  # noqa: F401
+except ImportError:
+    orjson = None
+
+
+class _EncodedJSONResponse(JSONResponse):
+    """orjsonがない環境向け。datetimeなどを変換してから標準のjsonでシリアライズする"""
+
+    def render(self, content: Any) -> bytes:
+        return super().render(jsonable_encoder(content))
+
+
+# 行データ（dict）をPydanticの検証なしで高速にシリアライズするレスポンスクラス
+FastJSONResponse = ORJSONResponse if orjson is not None else _EncodedJSONResponse
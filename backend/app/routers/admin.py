@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from datetime import datetime, timezone
+from typing import List, Optional
+import os
+import secrets
+
+from app.services.exporter import EXPORT_DATASETS, MEDIA_TYPES, export_rows
+
+router = APIRouter()
+
+# 管理用APIのトークン（未設定の場合は管理用APIを使えない）
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None, alias=ADMIN_TOKEN_HEADER)) -> None:
+    """X-Admin-TokenヘッダーがADMIN_TOKENと一致しない場合は403を返す"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="管理用APIは無効です（ADMIN_TOKENが設定されていません）")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="管理用のトークンが正しくありません")
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """DBの日時（タイムゾーンなしのUTC）と比較できるようにする"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+# お題・回答・投票の集計を一括エクスポート（NDJSON / CSV。行を少しずつ読み出して送るため件数によらずメモリ使用量は一定）
+@router.get("/export/{dataset}", dependencies=[Depends(require_admin)])
+async def export_dataset(
+    dataset: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="出力形式"),
+    gzip: bool = Query(False, description="gzipで圧縮する"),
+    since: Optional[datetime] = Query(None, description="この日時以降（UTC）に作成された行だけを出力する"),
+    until: Optional[datetime] = Query(None, description="この日時より前（UTC）に作成された行だけを出力する"),
+    topic_id: List[int] = Query([], description="お題IDで絞り込む（複数指定可）"),
+):
+    if dataset not in EXPORT_DATASETS:
+        raise HTTPException(status_code=404, detail=f"データセットは {', '.join(EXPORT_DATASETS)} のいずれかを指定してください")
+
+    filename = f"{dataset}.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        # 同期のジェネレーターはスレッドプールで実行されるため、DBの読み出しでイベントループを止めない
+        export_rows(dataset, format, _naive_utc(since), _naive_utc(until), topic_id, gzip),
+        media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
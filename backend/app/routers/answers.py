@@ -1,33 +1,49 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
-from typing import List
-from datetime import datetime, timedelta
-from sqlalchemy import func
-
-from app.database import get_db
-from app.models.models import Answer, Topic, Vote
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+import asyncio
+import logging
+import os
+
+from app.database import get_async_db
+from app.models.models import Answer, Topic
+from app.pagination import paginate, finish_page
+from app.queries import row_dicts, select_answers
+from app.responses import FastJSONResponse
 from app.schemas.schemas import AnswerCreate, AnswerResponse, AnswerWithAIEvaluation, AIEvaluationRequest
+from app.services.ai_governor import AICircuitOpen, ai_governor
+from app.services.ai_providers import AIProviderUnavailable
 from app.services.ai_service import evaluate_answer
+from app.services.evaluation_cache import evaluation_cache
+from app.services.evaluation_queue import evaluate_streaming, evaluation_queue, store_evaluation
+from app.services.ranking import ranking_index
+from app.services.rate_limiter import answer_limiter
+from app.services.realtime import STREAM_KEEPALIVE_SECONDS, answer_channel, format_sse, hub, publish_topic_event, publish_evaluation
+from app.services.similarity import similarity_index
+from app.services.topic_cache import utcnow
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# 回答一覧の1ページの件数（既定値と上限）
+ANSWER_PAGE_SIZE = int(os.getenv("ANSWER_PAGE_SIZE", "50"))
+ANSWER_PAGE_MAX_SIZE = int(os.getenv("ANSWER_PAGE_MAX_SIZE", "200"))
+# 回答の評価ストリームで評価の完了を待つ最大秒数
+ANSWER_EVALUATION_STREAM_TIMEOUT = float(os.getenv("ANSWER_EVALUATION_STREAM_TIMEOUT", "120"))
+
 # 回答を作成
 @router.post("/", response_model=AnswerResponse)
-async def create_answer(answer: AnswerCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def create_answer(answer: AnswerCreate, db: AsyncSession = Depends(get_async_db)):
     # お題が存在するか確認
-    topic = db.query(Topic).filter(Topic.id == answer.topic_id).first()
+    topic = await db.get(Topic, answer.topic_id)
     if not topic:
         raise HTTPException(status_code=404, detail="指定されたお題が見つかりません")
     
-    # 同じユーザーからの1分以内の投稿をチェック
-    one_minute_ago = datetime.now() - timedelta(minutes=1)
-    recent_answer = db.query(Answer).filter(
-        Answer.user_id == answer.user_id,
-        Answer.created_at >= one_minute_ago
-    ).first()
-    
-    if recent_answer:
-        raise HTTPException(status_code=429, detail="1分間に1回しか回答できません。少し待ってからお試しください。")
+    # 同じユーザーからの連続投稿をチェック（DBを参照しないレート制限）
+    await answer_limiter.check(answer.user_id)
     
     # 回答を保存
     db_answer = Answer(
@@ -38,77 +54,175 @@ async def create_answer(answer: AnswerCreate, background_tasks: BackgroundTasks,
     )
     
     db.add(db_answer)
-    db.commit()
-    db.refresh(db_answer)
+    await db.commit()
+    await db.refresh(db_answer)
+    
+    ranking_index.update(db_answer.topic_id, db_answer.id, vote_count=0)
+    
+    # 購読中のクライアントへ新しい回答を通知
+    publish_topic_event(
+        db_answer.topic_id,
+        "answer_created",
+        answer=AnswerResponse.model_validate(db_answer).model_dump(mode="json"),
+    )
     
-    # バックグラウンドでAI評価を実行
-    background_tasks.add_task(_evaluate_answer_with_ai, db_answer.id, db)
+    # AI評価キューに積む（評価結果はリアルタイムイベントで通知される）
+    if not evaluation_queue.enqueue(db_answer.id, db_answer.topic_id):
+        # キューが一杯の場合は確保を外し、次回の未評価の回答の確認ですぐに積み直されるようにする
+        db_answer.eval_claimed_at = None
+        await db.commit()
+        logger.warning("回答ID %d を評価キューに積めなかったため、未評価の回答の確認で積み直します", db_answer.id)
     
     return db_answer
 
-# お題に対する回答を取得
+# 回答一覧の並び順（投稿順・投票数順・AIスコア順。同順位は先に投稿された回答を上位にする）
+ANSWER_SORT_KEYS = {
+    "created_at": ((Answer.created_at, False), (Answer.id, False)),
+    "votes": ((Answer.vote_count, True), (Answer.id, False)),
+    "score": ((func.coalesce(Answer.ai_score, -1), True), (Answer.vote_count, True), (Answer.id, False)),
+}
+ANSWER_SORT_VALUES = {
+    "created_at": lambda answer: (answer.created_at, answer.id),
+    "votes": lambda answer: (answer.vote_count, answer.id),
+    "score": lambda answer: (-1 if answer.ai_score is None else answer.ai_score, answer.vote_count, answer.id),
+}
+
+# お題に対する回答を取得（続きがある場合はX-Next-Cursorヘッダーに次ページのカーソルを返す）
 @router.get("/topic/{topic_id}", response_model=List[AnswerResponse])
-async def get_answers_by_topic(topic_id: int, db: Session = Depends(get_db)):
+async def get_answers_by_topic(
+    topic_id: int,
+    response: Response,
+    sort: str = Query("created_at", pattern="^(created_at|votes|score)$", description="並び順"),
+    limit: int = Query(ANSWER_PAGE_SIZE, ge=1, le=ANSWER_PAGE_MAX_SIZE),
+    cursor: Optional[str] = Query(None, description="前のページのX-Next-Cursorヘッダーの値"),
+    db: AsyncSession = Depends(get_async_db),
+):
     # お題が存在するか確認
-    topic = db.query(Topic).filter(Topic.id == topic_id).first()
+    topic = await db.get(Topic, topic_id)
     if not topic:
         raise HTTPException(status_code=404, detail="指定されたお題が見つかりません")
     
-    # 回答を取得し、各回答の投票数を計算
-    answers = db.query(Answer).filter(Answer.topic_id == topic_id).all()
-    
-    # 各回答に投票数を追加
-    for answer in answers:
-        answer.vote_count = db.query(func.count("*")).select_from(Vote).filter(Vote.answer_id == answer.id).scalar() or 0
+    # 回答を行データとして取得し、Pydanticの検証を経由せずにJSONにする（投票数はAnswer.vote_countに保持されている）
+    cursor_sort = f"answers:{sort}"
+    stmt = paginate(select_answers().where(Answer.topic_id == topic_id), cursor_sort, ANSWER_SORT_KEYS[sort], limit, cursor)
+    answers = (await db.execute(stmt)).all()
     
-    return answers
+    answers = finish_page(answers, cursor_sort, ANSWER_SORT_VALUES[sort], limit, response)
+    return FastJSONResponse(row_dicts(answers), headers=dict(response.headers))
 
 # 特定の回答を取得
 @router.get("/{answer_id}", response_model=AnswerResponse)
-async def get_answer(answer_id: int, db: Session = Depends(get_db)):
-    answer = db.query(Answer).filter(Answer.id == answer_id).first()
+async def get_answer(answer_id: int, db: AsyncSession = Depends(get_async_db)):
+    answer = await db.get(Answer, answer_id)
     if not answer:
         raise HTTPException(status_code=404, detail="指定された回答が見つかりません")
     
-    # 投票数を取得
-    answer.vote_count = db.query(func.count("*")).select_from(Vote).filter(Vote.answer_id == answer.id).scalar() or 0
-    
     return answer
 
+# 回答のAI評価をServer-Sent Eventsで配信（評価が確定したら終了する）
+@router.get("/{answer_id}/evaluation/stream")
+async def stream_answer_evaluation(answer_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    # 評価済みかどうかを確認する前に購読し、その間に確定した評価を取りこぼさないようにする
+    channel = answer_channel(answer_id)
+    queue = hub.subscribe(channel)
+    answer = await db.get(Answer, answer_id)
+    await db.close()
+    if not answer:
+        hub.unsubscribe(channel, queue)
+        raise HTTPException(status_code=404, detail="指定された回答が見つかりません")
+
+    async def event_generator():
+        try:
+            yield format_sse({"type": "subscribed", "answer_id": answer_id})
+            if answer.ai_score is not None:
+                yield format_sse({
+                    "type": "answer_evaluated",
+                    "topic_id": answer.topic_id,
+                    "answer_id": answer_id,
+                    "ai_score": answer.ai_score,
+                    "ai_comment": answer.ai_comment,
+                })
+                return
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + ANSWER_EVALUATION_STREAM_TIMEOUT
+            while not await request.is_disconnected():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=min(STREAM_KEEPALIVE_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event)
+                if event["type"] == "answer_evaluated":
+                    break
+        finally:
+            hub.unsubscribe(channel, queue)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # 手動でAI評価を実行
 @router.post("/evaluate", response_model=AnswerWithAIEvaluation)
-async def request_ai_evaluation(request: AIEvaluationRequest, db: Session = Depends(get_db)):
-    answer = db.query(Answer).filter(Answer.id == request.answer_id).first()
+async def request_ai_evaluation(request: AIEvaluationRequest, db: AsyncSession = Depends(get_async_db)):
+    answer = await db.get(Answer, request.answer_id)
     if not answer:
         raise HTTPException(status_code=404, detail="指定された回答が見つかりません")
     
-    topic = db.query(Topic).filter(Topic.id == answer.topic_id).first()
-    
-    # AI評価を実行
-    evaluation = evaluate_answer(topic.content, answer.content)
-    
-    # 評価を保存
-    answer.ai_score = evaluation["score"]
-    answer.ai_comment = evaluation["comment"]
-    
-    db.commit()
-    db.refresh(answer)
+    topic = await db.get(Topic, answer.topic_id)
+    requested_at = utcnow()
+    
+    # キャッシュを確認し、なければAI評価を実行
+    evaluation = None if request.bypass_cache else await db.run_sync(evaluation_cache.get, topic.content, answer.content)
+    if evaluation is None:
+        # 評価できなかった場合は仮のスコアを保存せず、回答を未評価のまま残す
+        try:
+            if evaluation_queue.streaming:
+                evaluation = await evaluate_streaming(topic.content, answer.id, answer.content, raise_errors=True)
+            else:
+                evaluation = await evaluate_answer(topic.content, answer.content, raise_errors=True)
+        except AICircuitOpen as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(max(1, round(e.retry_after)))})
+        except AIProviderUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"回答の評価中にエラーが発生しました: {e}")
+        await db.run_sync(evaluation_cache.put, topic.content, answer.content, evaluation)
+    
+    # 評価を保存（この回答自身の評価になるため、ほぼ同じ回答へのリンクは外す。
+    # 評価中により新しい評価が保存された場合はそちらを残して返す）
+    stored = await db.run_sync(store_evaluation, answer.id, evaluation, requested_at)
+    await db.commit()
+    await db.refresh(answer)
+    if not stored:
+        return answer
+    
+    ranking_index.update(answer.topic_id, answer.id, ai_score=answer.ai_score)
+    publish_evaluation(answer.topic_id, answer.id, answer.ai_score, answer.ai_comment)
     
     return answer
 
-# バックグラウンドでAI評価を実行する関数
-async def _evaluate_answer_with_ai(answer_id: int, db: Session):
-    answer = db.query(Answer).filter(Answer.id == answer_id).first()
-    if not answer:
-        return
-    
-    topic = db.query(Topic).filter(Topic.id == answer.topic_id).first()
-    
-    # AI評価を実行
-    evaluation = evaluate_answer(topic.content, answer.content)
-    
-    # 評価を保存
-    answer.ai_score = evaluation["score"]
-    answer.ai_comment = evaluation["comment"]
-    
-    db.commit() 
\ No newline at end of file
+# AI評価キャッシュの統計を取得
+@router.get("/evaluation/cache")
+async def get_evaluation_cache_stats():
+    return evaluation_cache.stats()
+
+# ほぼ同じ回答の検出の統計を取得
+@router.get("/evaluation/similarity")
+async def get_similarity_stats():
+    return similarity_index.stats()
+
+# AI評価キューの状態を取得
+@router.get("/evaluation/queue")
+async def get_evaluation_queue_stats():
+    return evaluation_queue.stats()
+
+# AI呼び出しの流量制御（同時実行数・RPM/TPMの残り・サーキットの状態）を取得
+@router.get("/evaluation/governor")
+async def get_ai_governor_stats():
+    return ai_governor.stats()
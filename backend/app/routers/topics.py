@@ -1,142 +1,157 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
-from typing import List
-import pytz
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+import logging
+import os
 
-from app.database import get_db
-from app.models.models import Topic
-from app.schemas.schemas import TopicCreate, TopicResponse, TopicDetail, TopicGenerationResponse
-from app.services.ai_service import generate_topic
+from app.database import get_async_db
+from app.models.models import Topic, Answer
+from app.pagination import paginate, finish_page
+from app.queries import row_dicts, select_answers, select_topic_with_snapshot
+from app.responses import FastJSONResponse
+from app.schemas.schemas import TopicCreate, TopicResponse, TopicDetail, TopicGenerationResponse, LeaderboardResponse
+from app.services.archiver import load_snapshot, topic_archiver
+from app.services.ranking import ranking_index
+from app.services.rate_limiter import topic_generation_limiter, client_ip
+from app.services.topic_cache import active_topic_cache, topic_etag, utcnow
+from app.services.topic_scheduler import TopicRotationBusy, topic_scheduler
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# アクティブなお題をクライアント側でキャッシュしてよい最大秒数
+ACTIVE_TOPIC_MAX_AGE = int(os.getenv("ACTIVE_TOPIC_MAX_AGE", "60"))
+
 # 現在アクティブなお題を取得
 @router.get("/active", response_model=TopicResponse)
-async def get_active_topic(db: Session = Depends(get_db)):
-    now = datetime.now(pytz.UTC)
-    print(f"現在のUTC時刻: {now}")
-    
-    # 全てのアクティブなトピックを取得してログに出力
-    all_active_topics = db.query(Topic).filter(Topic.is_active == True).all()
-    print(f"全てのアクティブなトピック: {len(all_active_topics)}件")
-    for topic in all_active_topics:
-        # タイムゾーン情報を付与して比較
-        topic_expires_at = pytz.UTC.localize(topic.expires_at) if topic.expires_at.tzinfo is None else topic.expires_at
-        print(f"ID: {topic.id}, 内容: {topic.content}, 期限: {topic_expires_at}")
-        print(f"期限切れ？: {topic_expires_at < now}")
-    
-    # 期限内のアクティブなトピックを取得
-    # SQLiteはタイムゾーン情報を持たないため、文字列として比較
-    now_str = now.strftime("%Y-%m-%d %H:%M:%S")
-    topic = db.query(Topic).filter(
-        Topic.is_active == True,
-        Topic.expires_at > now_str
-    ).order_by(Topic.created_at.desc()).first()
+async def get_active_topic(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    # 有効期限を考慮したプロセス内キャッシュから取得（キャッシュが無効な場合のみDBを参照）
+    topic = await db.run_sync(active_topic_cache.get)
     
     if not topic:
         raise HTTPException(status_code=404, detail="現在アクティブなお題はありません")
     
+    # ブラウザやNginxが有効期限まで（最大ACTIVE_TOPIC_MAX_AGE秒）キャッシュできるようにする
+    seconds_left = int((topic["expires_at"] - utcnow()).total_seconds())
+    max_age = max(0, min(seconds_left, ACTIVE_TOPIC_MAX_AGE))
+    headers = {
+        "ETag": topic_etag(topic),
+        "Cache-Control": f"public, max-age={max_age}",
+    }
+    
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    
+    response.headers.update(headers)
     return topic
 
-# お題の詳細を取得（回答を含む）
+# お題の詳細を取得（回答を含む。アーカイブ済みのお題はスナップショットから返す）
 @router.get("/{topic_id}", response_model=TopicDetail)
-async def get_topic_detail(topic_id: int, db: Session = Depends(get_db)):
-    topic = db.query(Topic).filter(Topic.id == topic_id).first()
+async def get_topic_detail(topic_id: int, db: AsyncSession = Depends(get_async_db)):
+    # ORMオブジェクトやPydanticの検証を経由せず、行データをそのままJSONにする
+    topic = (await db.execute(select_topic_with_snapshot(topic_id))).first()
     
     if not topic:
         raise HTTPException(status_code=404, detail="お題が見つかりません")
     
-    return topic
+    if topic.snapshot is not None:
+        return FastJSONResponse(load_snapshot(topic.snapshot))
+    
+    answers = await db.execute(select_answers().where(Answer.topic_id == topic_id).order_by(Answer.id))
+    detail = dict(topic._mapping)
+    del detail["snapshot"]
+    detail.update(message=None, answers=row_dicts(answers), archived=False)
+    
+    return FastJSONResponse(detail)
+
+# お題の回答ランキングを取得
+@router.get("/{topic_id}/leaderboard", response_model=LeaderboardResponse)
+async def get_leaderboard(
+    topic_id: int,
+    k: int = Query(10, ge=1, le=100, description="取得する上位件数"),
+    by: str = Query("votes", pattern="^(votes|score|combined)$", description="並び順"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    topic_exists = await db.scalar(select(Topic.id).where(Topic.id == topic_id))
+    if not topic_exists:
+        raise HTTPException(status_code=404, detail="お題が見つかりません")
+    
+    answer_ids = await db.run_sync(ranking_index.top, topic_id, k, by)
+    answers = {answer.id: answer for answer in (await db.scalars(select(Answer).where(Answer.id.in_(answer_ids)))).all()}
+    
+    return LeaderboardResponse(
+        topic_id=topic_id,
+        by=by,
+        answers=[answers[answer_id] for answer_id in answer_ids if answer_id in answers],
+    )
 
 # 新しいお題を生成（バックグラウンドで実行）
 @router.post("/generate", response_model=TopicGenerationResponse)
-async def create_topic(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def create_topic(request: Request, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
+    await topic_generation_limiter.check(client_ip(request))
+    
     # 既存のアクティブなお題を確認
-    now = datetime.now(pytz.UTC)
-    active_topic = db.query(Topic).filter(
-        Topic.is_active == True,
-        Topic.expires_at > now
-    ).first()
+    active_topic = await db.run_sync(active_topic_cache.get)
     
     if active_topic:
-        return TopicGenerationResponse(message=f"既存のアクティブなお題があります。ID: {active_topic.id}")
+        return TopicGenerationResponse(message=f"既存のアクティブなお題があります。ID: {active_topic['id']}")
     
-    # バックグラウンドでお題を生成して保存
-    background_tasks.add_task(_generate_and_save_topic, db)
+    # バックグラウンドでお題を切り替える（先に生成済みのお題があればそれを使う。
+    # 切り替えが実行中であれば新たに生成せず、その完了を待つ）
+    if not topic_scheduler.rotating:
+        background_tasks.add_task(topic_scheduler.rotate, expired_only=True)
     
     # 処理開始を通知
     return TopicGenerationResponse(message="新しいお題を生成中です。しばらく待ってから再度確認してください。")
 
 # 新しいお題を強制的に生成（既存のアクティブなお題を無視）
 @router.post("/generate/force", response_model=TopicGenerationResponse)
-async def force_create_topic(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    print("強制生成エンドポイントが呼び出されました")
+async def force_create_topic(request: Request):
+    await topic_generation_limiter.check(client_ip(request))
     
     try:
-        # 古いアクティブなお題を非アクティブに設定
-        old_topics = db.query(Topic).filter(Topic.is_active == True).all()
-        print(f"非アクティブ化する古いお題: {len(old_topics)}件")
-        for topic in old_topics:
-            topic.is_active = False
-            print(f"ID: {topic.id}を非アクティブ化")
-        db.commit()
-        
-        # 新しいお題を生成
-        content = generate_topic()
-        print(f"生成されたお題: {content}")
+        # 古いアクティブなお題の非アクティブ化と新しいお題の保存を1つのトランザクションで行う
+        # （同時に届いた強制生成のリクエストや他のインスタンスの切り替えとは1回の生成を共有する）
+        topic_id = await topic_scheduler.rotate()
         
-        # 有効期限は4時間後
-        expires_at = datetime.now(pytz.UTC) + timedelta(hours=4)
-        
-        # お題を保存
-        new_topic = Topic(
-            content=content,
-            expires_at=expires_at,
-            is_active=True
-        )
-        
-        db.add(new_topic)
-        db.commit()
-        db.refresh(new_topic)
-        
-        print(f"新しいお題を保存しました。ID: {new_topic.id}")
-        return TopicGenerationResponse(message=f"新しいお題を生成しました。ID: {new_topic.id}")
+        logger.info("お題を強制的に生成しました（ID: %d）", topic_id)
+        return TopicGenerationResponse(message=f"新しいお題を生成しました。ID: {topic_id}")
+    except TopicRotationBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(max(1, round(e.retry_after)))})
     except Exception as e:
-        print(f"お題の生成中にエラーが発生しました: {str(e)}")
+        logger.error("お題の強制生成に失敗しました: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"お題の生成中にエラーが発生しました: {str(e)}"
         )
 
-# 最新のお題リストを取得
+# お題一覧の並び順（新しい順、同時刻はIDの大きい順）
+TOPIC_SORT_KEY = ((Topic.created_at, True), (Topic.id, True))
+
+# 最新のお題リストを取得（続きがある場合はX-Next-Cursorヘッダーに次ページのカーソルを返す）
 @router.get("/", response_model=List[TopicResponse])
-async def get_topics(limit: int = 10, offset: int = 0, db: Session = Depends(get_db)):
-    topics = db.query(Topic).order_by(Topic.created_at.desc()).offset(offset).limit(limit).all()
-    return topics
+async def get_topics(
+    response: Response,
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="前のページのX-Next-Cursorヘッダーの値"),
+    offset: int = Query(0, ge=0, description="互換性のために残している（深いページはcursorを使う）"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    stmt = select(Topic)
+    if offset and not cursor:
+        stmt = stmt.offset(offset)
+    stmt = paginate(stmt, "topics", TOPIC_SORT_KEY, limit, cursor)
+    topics = (await db.scalars(stmt)).all()
+    return finish_page(topics, "topics", lambda topic: (topic.created_at, topic.id), limit, response)
 
-# バックグラウンドで実行するお題生成関数
-async def _generate_and_save_topic(db: Session):
-    # 古いアクティブなお題を非アクティブに設定
-    old_topics = db.query(Topic).filter(Topic.is_active == True).all()
-    for topic in old_topics:
-        topic.is_active = False
-    
-    # 新しいお題を生成
-    content = generate_topic()
-    
-    # 有効期限は4時間後
-    expires_at = datetime.now(pytz.UTC) + timedelta(hours=4)
-    
-    # お題を保存
-    new_topic = Topic(
-        content=content,
-        expires_at=expires_at,
-        is_active=True
-    )
-    
-    db.add(new_topic)
-    db.commit()
-    db.refresh(new_topic)
-    
-    return new_topic 
\ No newline at end of file
+# お題の自動切り替えスケジューラの状態を取得
+@router.get("/scheduler/stats")
+async def get_topic_scheduler_stats():
+    return topic_scheduler.stats()
+
+# 終了したお題のアーカイブジョブの状態を取得
+@router.get("/archive/stats")
+async def get_topic_archive_stats():
+    return topic_archiver.stats()
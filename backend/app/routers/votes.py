@@ -1,89 +1,105 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-from datetime import datetime
-from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, List
+import asyncio
 
-from app.database import get_db
-from app.models.models import Vote, Answer, Topic
+from app.database import get_async_db, SessionLocal
+from app.models.models import Vote, Answer, TopicArchive
 from app.schemas.schemas import VoteCreate, VoteResponse
-from app.services.ai_service import evaluate_answer, reevaluate_popular_answer
+from app.services.ranking import ranking_index
+from app.services.rate_limiter import vote_limiter
+from app.services.realtime import publish_topic_event
+from app.services.reevaluation_scheduler import reevaluation_scheduler
+from app.services.vote_ingest import vote_ingestor
 
 router = APIRouter(prefix="/votes", tags=["votes"])
 
 # 投票を作成
 @router.post("/", response_model=VoteResponse)
-async def create_vote(vote: VoteCreate, db: Session = Depends(get_db)):
-    # 回答が存在するか確認
-    answer = db.query(Answer).filter(Answer.id == vote.answer_id).first()
-    if not answer:
+async def create_vote(vote: VoteCreate, db: AsyncSession = Depends(get_async_db)):
+    # 同じユーザーからの大量投票を制限
+    await vote_limiter.check(vote.user_id)
+    
+    # 回答が存在するか、お題がアーカイブ済みでないかを確認
+    row = (await db.execute(
+        select(Answer.id, TopicArchive.topic_id)
+        .outerjoin(TopicArchive, TopicArchive.topic_id == Answer.topic_id)
+        .where(Answer.id == vote.answer_id)
+    )).first()
+    if row is None:
         raise HTTPException(status_code=404, detail="指定された回答が見つかりません")
+    if row.topic_id is not None:
+        raise HTTPException(status_code=400, detail="このお題は終了しているため投票できません")
     
-    # 同じユーザーが同じ回答に投票していないか確認
-    existing_vote = db.query(Vote).filter(
-        Vote.user_id == vote.user_id,
-        Vote.answer_id == vote.answer_id
-    ).first()
+    # 書き込み待ちの間にコネクションを占有しないようセッションを返却する
+    await db.close()
     
-    if existing_vote:
+    # 投票はバッファされ、他の投票とまとめて書き込まれる（重複はユニークインデックスで弾かれる）
+    db_vote = await vote_ingestor.submit(vote.answer_id, vote.user_id)
+    if db_vote is None:
         raise HTTPException(status_code=400, detail="すでにこの回答に投票しています")
     
-    # 投票を保存
-    db_vote = Vote(
-        answer_id=vote.answer_id,
-        user_id=vote.user_id
-    )
-    
-    db.add(db_vote)
-    db.commit()
-    db.refresh(db_vote)
-    
-    # 投票数を取得
-    vote_count = db.query(func.count("*")).select_from(Vote).filter(Vote.answer_id == vote.answer_id).scalar()
+    return db_vote
+
+def _load_rankings(topic_ids):
+    """ランキング未ロードのお題をDBから読み込む（ワーカースレッドで実行）"""
+    db = SessionLocal()
+    try:
+        for topic_id in topic_ids:
+            ranking_index.ensure_topic(db, topic_id)
+    finally:
+        db.close()
+
+# 投票の書き込み後に回答ごとの投票数の変化を反映する
+async def _on_votes_flushed(counts: List[Dict[str, Any]]):
+    # ランキング未ロードのお題があればまとめてDBから読み込む（イベントループを止めないようワーカースレッドで）
+    unloaded = {count["topic_id"] for count in counts if not ranking_index.is_loaded(count["topic_id"])}
+    if unloaded:
+        await asyncio.to_thread(_load_rankings, unloaded)
     
-    # 投票数が一定数（例：5票）以上かつ最も投票された回答の場合、AI評価を更新
-    if vote_count >= 5:
-        # そのお題の中で最も投票された回答かチェック
-        topic_id = answer.topic_id
-        most_voted_answer = db.query(Answer)\
-            .join(Vote, Answer.id == Vote.answer_id)\
-            .filter(Answer.topic_id == topic_id)\
-            .group_by(Answer.id)\
-            .order_by(func.count(Vote.id).desc())\
-            .first()
+    for count in counts:
+        topic_id = count["topic_id"]
+        answer_id = count["answer_id"]
+        vote_count = count["vote_count"]
         
-        # この回答が最も投票された回答であれば、AI評価を更新
-        if most_voted_answer and most_voted_answer.id == answer.id:
-            topic = db.query(Topic).filter(Topic.id == topic_id).first()
-            
-            # 人気回答のAI再評価を実行
-            evaluation = reevaluate_popular_answer(topic.content, answer.content, vote_count)
-            
-            # 評価を更新
-            answer.ai_score = evaluation["score"]
-            answer.ai_comment = evaluation["comment"]
-            db.commit()
-    
-    return db_vote
+        became_leader = ranking_index.update_votes(topic_id, answer_id, vote_count)
+        
+        # 購読中のクライアントへ投票数の変化を通知
+        publish_topic_event(topic_id, "vote_count", answer_id=answer_id, vote_count=vote_count)
+        
+        # 投票数が節目を越えた、または1位になった回答だけ再評価を予約する
+        reevaluation_scheduler.notify(answer_id, vote_count - count["added"], vote_count, became_leader)
+
+vote_ingestor.add_listener(_on_votes_flushed)
 
 # 回答に対する投票一覧を取得
 @router.get("/answer/{answer_id}", response_model=List[VoteResponse])
-async def get_votes_by_answer(answer_id: int, db: Session = Depends(get_db)):
+async def get_votes_by_answer(answer_id: int, db: AsyncSession = Depends(get_async_db)):
     # 回答が存在するか確認
-    answer = db.query(Answer).filter(Answer.id == answer_id).first()
+    answer = await db.get(Answer, answer_id)
     if not answer:
         raise HTTPException(status_code=404, detail="指定された回答が見つかりません")
     
-    votes = db.query(Vote).filter(Vote.answer_id == answer_id).all()
+    votes = (await db.scalars(select(Vote).where(Vote.answer_id == answer_id))).all()
     return votes
 
 # 投票数を取得
 @router.get("/count/{answer_id}")
-async def get_vote_count(answer_id: int, db: Session = Depends(get_db)):
-    # 回答が存在するか確認
-    answer = db.query(Answer).filter(Answer.id == answer_id).first()
-    if not answer:
+async def get_vote_count(answer_id: int, db: AsyncSession = Depends(get_async_db)):
+    # 回答の存在確認と投票数の取得を1クエリで行う
+    vote_count = await db.scalar(select(Answer.vote_count).where(Answer.id == answer_id))
+    if vote_count is None:
         raise HTTPException(status_code=404, detail="指定された回答が見つかりません")
     
-    vote_count = db.query(func.count("*")).select_from(Vote).filter(Vote.answer_id == answer_id).scalar() or 0
-    return {"answer_id": answer_id, "vote_count": vote_count} 
\ No newline at end of file
+    return {"answer_id": answer_id, "vote_count": vote_count}
+
+# 投票書き込みバッファの状態を取得
+@router.get("/ingest/stats")
+async def get_vote_ingest_stats():
+    return vote_ingestor.stats()
+
+# 人気回答の再評価スケジューラの状態を取得
+@router.get("/reevaluation/stats")
+async def get_reevaluation_stats():
+    return reevaluation_scheduler.stats()
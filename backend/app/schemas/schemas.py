@@ -44,6 +44,7 @@ class AnswerResponse(AnswerBase):
     ai_score: Optional[int] = None
     ai_comment: Optional[str] = None
     vote_count: Optional[int] = 0
+    duplicate_of_id: Optional[int] = None
     
     class Config:
         from_attributes = True
@@ -58,13 +59,21 @@ class AnswerWithAIEvaluation(AnswerResponse):
 # トピック詳細（回答を含む）スキーマ
 class TopicDetail(TopicResponse):
     answers: List[AnswerResponse] = []
+    archived: bool = Field(False, description="アーカイブ済みのスナップショットから返した場合はtrue")
     
     class Config:
         from_attributes = True
 
+# お題ごとの回答ランキング
+class LeaderboardResponse(BaseModel):
+    topic_id: int
+    by: str = Field(..., description="並び順（votes: 投票数, score: AIスコア, combined: 総合）")
+    answers: List[AnswerResponse] = []
+
 # AI評価リクエストスキーマ
 class AIEvaluationRequest(BaseModel):
     answer_id: int = Field(..., description="評価する回答のID")
+    bypass_cache: bool = Field(False, description="評価キャッシュを使わずにAIで再評価する")
 
 # 投票関連のスキーマ
 class VoteBase(BaseModel):
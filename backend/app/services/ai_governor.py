@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+import openai
+from dotenv import load_dotenv
+
+from app.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 1分あたりのリクエスト数とトークン数の上限（0で無制限。OpenAIのアカウントの上限より少し低めに設定する）
+AI_RPM_LIMIT = float(os.getenv("AI_RPM_LIMIT", "3000"))
+AI_TPM_LIMIT = float(os.getenv("AI_TPM_LIMIT", "80000"))
+# 同時に実行するAI呼び出し数の範囲と初期値（応答時間と429に応じて自動で増減する）
+AI_CONCURRENCY_MIN = int(os.getenv("AI_CONCURRENCY_MIN", "1"))
+AI_CONCURRENCY_MAX = int(os.getenv("AI_CONCURRENCY_MAX", "16"))
+AI_CONCURRENCY_INITIAL = int(os.getenv("AI_CONCURRENCY_INITIAL", "4"))
+# この秒数より遅い応答が返ったら同時実行数を減らす
+AI_LATENCY_TARGET_SECONDS = float(os.getenv("AI_LATENCY_TARGET_SECONDS", "8"))
+# 連続で何回失敗したらサーキットを開くか、開いている秒数
+AI_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("AI_CIRCUIT_FAILURE_THRESHOLD", "5"))
+AI_CIRCUIT_OPEN_SECONDS = float(os.getenv("AI_CIRCUIT_OPEN_SECONDS", "30"))
+
+T = TypeVar("T")
+
+# 上流の障害・過負荷とみなす例外（リクエスト内容の誤りやJSONの解析失敗は含めない）
+UPSTREAM_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    httpx.TransportError,
+    asyncio.TimeoutError,
+)
+
+
+class AICircuitOpen(RuntimeError):
+    """サーキットが開いているため呼び出しを行わなかった"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"AI APIへの呼び出しを一時停止しています（あと{retry_after:.0f}秒）")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """1分あたりの上限を均等に補充するトークンバケット"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float) -> float:
+        """amountだけ消費できるまで待ち、待った秒数を返す（上限0は無制限）"""
+        if self.capacity <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        # 待っている呼び出しの順番を守るため、ロックを持ったまま補充を待つ
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                delay = (amount - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+                self._refill()
+            self.tokens -= amount
+        return waited
+
+
+class AdaptiveLimiter:
+    """AIMDで同時実行数の上限を調整するリミッター
+
+    目標時間内に応答が返る間は上限を少しずつ増やし、遅い応答では1割、429やタイムアウトでは半分に減らす。
+    """
+
+    def __init__(self, minimum: int, maximum: int, initial: int, latency_target: float):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float) -> None:
+        if latency > self.latency_target:
+            self.limit = max(self.minimum, self.limit * 0.9)
+        else:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_overload(self) -> None:
+        self.limit = max(self.minimum, self.limit * 0.5)
+
+
+class CircuitBreaker:
+    """連続した失敗でAI呼び出しを止めるサーキットブレーカー
+
+    closed → （連続失敗）→ open → （一定時間後）→ half_open（1件だけ試す）→ 成功でclosed / 失敗でopen
+    """
+
+    def __init__(self, failure_threshold: int, open_seconds: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.opened_count = 0
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.open_seconds - time.monotonic())
+
+    def before_call(self) -> None:
+        if self.state == "open":
+            if self.retry_after() > 0:
+                raise AICircuitOpen(self.retry_after())
+            self.state = "half_open"
+            logger.info("AI APIの呼び出しを試験的に再開します")
+        if self.state == "half_open":
+            if self._probe_in_flight:
+                raise AICircuitOpen(1.0)
+            self._probe_in_flight = True
+
+    def on_success(self) -> None:
+        if self.state != "closed":
+            logger.info("AI APIの呼び出しを再開しました")
+        self.state = "closed"
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def on_failure(self) -> None:
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened_count += 1
+                logger.warning("AI APIの失敗が続いたため、%d秒間呼び出しを停止します", self.open_seconds)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def on_neutral(self) -> None:
+        """上流の状態と関係のない失敗（解析エラーなど）の後に呼び出す"""
+        self._probe_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == "open" and self.retry_after() > 0
+
+
+class AIGovernor:
+    """AI呼び出しの流量を制御する
+
+    RPM/TPMの予算を消費してから、同時実行数の枠を取得して呼び出す。
+    サーキットが開いている間は呼び出さずにAICircuitOpenを送出し、呼び出し側は処理を後回しにする。
+    """
+
+    def __init__(
+        self,
+        rpm_limit: float = AI_RPM_LIMIT,
+        tpm_limit: float = AI_TPM_LIMIT,
+        concurrency_min: int = AI_CONCURRENCY_MIN,
+        concurrency_max: int = AI_CONCURRENCY_MAX,
+        concurrency_initial: int = AI_CONCURRENCY_INITIAL,
+        latency_target: float = AI_LATENCY_TARGET_SECONDS,
+        failure_threshold: int = AI_CIRCUIT_FAILURE_THRESHOLD,
+        open_seconds: float = AI_CIRCUIT_OPEN_SECONDS,
+    ):
+        self._settings = (rpm_limit, tpm_limit, concurrency_min, concurrency_max, concurrency_initial, latency_target)
+        self.breaker = CircuitBreaker(failure_threshold, open_seconds)
+        # asyncioのプリミティブはイベントループ上で作る
+        self._rpm: Optional[TokenBucket] = None
+        self._tpm: Optional[TokenBucket] = None
+        self._limiter: Optional[AdaptiveLimiter] = None
+        self._stats = {"calls": 0, "rejected": 0, "rate_limited": 0, "failures": 0, "budget_wait_seconds": 0.0}
+
+    def _ensure_started(self) -> None:
+        if self._limiter is None:
+            rpm_limit, tpm_limit, concurrency_min, concurrency_max, concurrency_initial, latency_target = self._settings
+            self._rpm = TokenBucket(rpm_limit)
+            self._tpm = TokenBucket(tpm_limit)
+            self._limiter = AdaptiveLimiter(concurrency_min, concurrency_max, concurrency_initial, latency_target)
+
+    async def run(self, call: Callable[[], Awaitable[T]], estimated_tokens: int) -> T:
+        """予算と同時実行数の範囲内でcallを実行する"""
+        self._ensure_started()
+        try:
+            self.breaker.before_call()
+        except AICircuitOpen:
+            self._stats["rejected"] += 1
+            raise
+
+        try:
+            self._stats["budget_wait_seconds"] += await self._rpm.acquire(1)
+            self._stats["budget_wait_seconds"] += await self._tpm.acquire(estimated_tokens)
+            await self._limiter.acquire()
+        except BaseException:
+            # 予算待ちの間にキャンセルされた場合も試験呼び出しの枠を返す
+            self.breaker.on_neutral()
+            raise
+
+        self._stats["calls"] += 1
+        start = time.monotonic()
+        try:
+            result = await call()
+        except openai.RateLimitError:
+            self._stats["rate_limited"] += 1
+            self._stats["failures"] += 1
+            self._limiter.on_overload()
+            self.breaker.on_failure()
+            raise
+        except UPSTREAM_ERRORS as e:
+            self._stats["failures"] += 1
+            if isinstance(e, (openai.APITimeoutError, asyncio.TimeoutError)):
+                self._limiter.on_overload()
+            self.breaker.on_failure()
+            raise
+        except BaseException:
+            self.breaker.on_neutral()
+            raise
+        finally:
+            await self._limiter.release()
+
+        self._limiter.on_success(time.monotonic() - start)
+        self.breaker.on_success()
+        return result
+
+    @property
+    def is_open(self) -> bool:
+        return self.breaker.is_open
+
+    def retry_after(self) -> float:
+        return self.breaker.retry_after()
+
+    def stats(self) -> Dict[str, Any]:
+        limiter = self._limiter
+        return {
+            "circuit_state": "open" if self.breaker.is_open else self.breaker.state,
+            "circuit_retry_after": round(self.breaker.retry_after(), 1),
+            "consecutive_failures": self.breaker.failures,
+            "circuit_opened": self.breaker.opened_count,
+            "concurrency_limit": round(limiter.limit, 2) if limiter else None,
+            "in_flight": limiter.in_flight if limiter else 0,
+            "rpm_available": round(self._rpm.tokens, 1) if self._rpm else None,
+            "tpm_available": round(self._tpm.tokens, 1) if self._tpm else None,
+            **{key: round(value, 3) if isinstance(value, float) else value for key, value in self._stats.items()},
+        }
+
+
+ai_governor = AIGovernor()
+
+registry.gauge("ai_circuit_open", "AI呼び出しのサーキットが開いているか（1で停止中）", callback=lambda: 1 if ai_governor.is_open else 0)
+registry.gauge(
+    "ai_concurrency_limit", "AI呼び出しの同時実行数の現在の上限",
+    callback=lambda: ai_governor._limiter.limit if ai_governor._limiter else AI_CONCURRENCY_INITIAL,
+)
@@ -0,0 +1,391 @@
+import abc
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+from app.metrics import ai_tokens_total
+
+try:
+    import h2  # noqa: F401
+except ImportError:
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 使用するAIプロバイダー（openai / local）
+AI_PROVIDER = os.getenv("AI_PROVIDER", "openai").lower()
+# OpenAIのモデル
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+# 接続先のAPI（ベンチマークではローカルの擬似サーバーを指定する）
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+# OpenAIクライアント自体のリトライ回数
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# HTTP接続プールの上限と、再利用のために保持する接続数・保持期間（秒）
+AI_HTTP_MAX_CONNECTIONS = int(os.getenv("AI_HTTP_MAX_CONNECTIONS", "20"))
+AI_HTTP_MAX_KEEPALIVE = int(os.getenv("AI_HTTP_MAX_KEEPALIVE", "10"))
+AI_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("AI_HTTP_KEEPALIVE_EXPIRY", "30"))
+# 接続確立のタイムアウト（秒）
+AI_HTTP_CONNECT_TIMEOUT = float(os.getenv("AI_HTTP_CONNECT_TIMEOUT", "5"))
+# HTTP/2を使うかどうか（h2パッケージが必要）
+AI_HTTP2 = os.getenv("AI_HTTP2", "false").lower() in ("1", "true", "yes")
+# 呼び出しごとのタイムアウト（秒）
+AI_TOPIC_TIMEOUT = float(os.getenv("AI_TOPIC_TIMEOUT", "20"))
+AI_EVAL_TIMEOUT = float(os.getenv("AI_EVAL_TIMEOUT", "30"))
+AI_BATCH_EVAL_TIMEOUT = float(os.getenv("AI_BATCH_EVAL_TIMEOUT", "60"))
+# ローカルプロバイダーが応答を返すまでの疑似的な遅延（ミリ秒）
+AI_LOCAL_LATENCY_MS = float(os.getenv("AI_LOCAL_LATENCY_MS", "0"))
+
+# 無効とみなすAPIキー（.envの雛形のまま、テスト用のダミーなど）
+_PLACEHOLDER_API_KEYS = {"", "YOUR_OPENAI_API_KEY_HERE", "your_api_key_here", "sk-dummy-key-for-testing"}
+
+
+class AIProviderUnavailable(RuntimeError):
+    """プロバイダーが利用できない（APIキーが未設定など）"""
+
+
+class AIProvider(abc.ABC):
+    """AIプロバイダーの共通インターフェース
+
+    評価系のメソッドはAIが返したままの辞書（score / comment）を返し、
+    値の補正やエラー時のフォールバックは呼び出し側（ai_service）で行う。
+    抽象メソッドをすべて実装していないプロバイダーは生成時にTypeErrorになる。
+    """
+
+    name = "base"
+
+    @property
+    def available(self) -> bool:
+        """呼び出せる状態か（APIキーが未設定などの場合はFalse）"""
+        return True
+
+    @abc.abstractmethod
+    async def generate_topic(self) -> str:
+        """お題を1つ生成する"""
+
+    @abc.abstractmethod
+    async def evaluate(self, topic: str, answer: str) -> Dict[str, Any]:
+        """回答を評価する"""
+
+    @abc.abstractmethod
+    def evaluate_stream(self, topic: str, answer: str) -> AsyncIterator[str]:
+        """評価のJSON（score / comment）を生成された順に少しずつ返す"""
+
+    @abc.abstractmethod
+    async def evaluate_batch(self, topic: str, answers: List[Tuple[int, str]]) -> List[Dict[str, Any]]:
+        """answersは(回答ID, 回答内容)のリスト。idを含む評価のリストを返す"""
+
+    @abc.abstractmethod
+    async def reevaluate(self, topic: str, answer: str, vote_count: int) -> Dict[str, Any]:
+        """投票数を踏まえて回答を評価し直す"""
+
+    async def aclose(self) -> None:
+        pass
+
+
+TOPIC_PROMPT = """
+    あなたは大喜利のお題を考える専門家です。面白くて、回答が多様に考えられるお題を1つ考えてください。
+    お題は50文字以内で、誰でも理解できる平易な日本語で作成してください。
+
+    お題だけを返してください。説明や前置き、かぎかっこなどは不要です。
+    """
+
+EVALUATION_PROMPT = """
+    あなたは大喜利の回答を評価するユーモア満載の審査員です。以下の大喜利のお題に対する回答を評価してください。
+
+    【お題】
+    {topic}
+
+    【回答】
+    {answer}
+
+    回答を1〜10点で評価してください。評価の基準は「おもしろいかどうか」だけをベースに考えてください。
+    ユーモアあふれる表現やジョークを交えた評価コメントを書いてください。回答が面白ければ高得点を与えてください。
+
+    以下のJSON形式で回答してください:
+    {{
+      "score": [1-10の整数],
+      "comment": "ユーモアあふれる評価コメント（100文字以内）"
+    }}
+    """
+
+BATCH_EVALUATION_PROMPT = """
+    あなたは大喜利の回答を評価するユーモア満載の審査員です。以下の大喜利のお題に対する複数の回答を、それぞれ独立に評価してください。
+
+    【お題】
+    {topic}
+
+    【回答一覧】（[ ]内は回答ID）
+    {answer_lines}
+
+    各回答を1〜10点で評価してください。評価の基準は「おもしろいかどうか」だけをベースに考えてください。
+    ユーモアあふれる表現やジョークを交えた評価コメントを書いてください。回答が面白ければ高得点を与えてください。
+
+    以下のJSON形式で、すべての回答IDについて回答してください:
+    {{
+      "evaluations": [
+        {{"id": [回答ID], "score": [1-10の整数], "comment": "ユーモアあふれる評価コメント（100文字以内）"}}
+      ]
+    }}
+    """
+
+REEVALUATION_PROMPT = """
+    あなたは大喜利の回答を評価するユーモア満載の審査員です。以下の大喜利のお題に対する回答は、多くの人（{vote_count}人）から支持を得た人気回答です。
+
+    【お題】
+    {topic}
+
+    【人気回答】
+    {answer}
+
+    この人気回答を1〜10点で再評価してください。この回答がなぜ多くの人に支持されたのか、その魅力や面白さを深く分析してください。
+    ユーモア、意外性、知性などの観点から、回答の優れた点を詳しく述べてください。
+
+    以下のJSON形式で回答してください:
+    {{
+      "score": [1-10の整数、人気度を加味した評価],
+      "comment": "その回答の魅力を分析したユーモア溢れる評価コメント（100文字以内）"
+    }}
+    """
+
+
+class OpenAIProvider(AIProvider):
+    """OpenAI APIを使うプロバイダー
+
+    プロセス全体で1つのhttpx.AsyncClientを共有し、接続をキープアライブで再利用する。
+    クライアントは最初の呼び出し時に作成する（イベントループ上で作るため）。
+    """
+
+    name = "openai"
+
+    def __init__(self, api_key: Optional[str], base_url: str = OPENAI_BASE_URL, model: str = OPENAI_MODEL):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self._client: Optional[AsyncOpenAI] = None
+        self._http_client: Optional[httpx.AsyncClient] = None
+        if not api_key or api_key in _PLACEHOLDER_API_KEYS:
+            logger.error("有効なOpenAI APIキーが設定されていません。.envファイルを確認してください。")
+
+    @property
+    def available(self) -> bool:
+        return bool(self.api_key) and self.api_key not in _PLACEHOLDER_API_KEYS
+
+    def _get_client(self) -> AsyncOpenAI:
+        if not self.api_key or self.api_key in _PLACEHOLDER_API_KEYS:
+            raise AIProviderUnavailable("有効なOpenAI APIキーが設定されていない")
+        if self._client is None:
+            http2 = AI_HTTP2 and h2 is not None
+            if AI_HTTP2 and not http2:
+                logger.warning("h2パッケージがないため、HTTP/1.1でOpenAI APIに接続します")
+            try:
+                self._http_client = httpx.AsyncClient(
+                    base_url=self.base_url,
+                    follow_redirects=True,
+                    http2=http2,
+                    limits=httpx.Limits(
+                        max_connections=AI_HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=AI_HTTP_MAX_KEEPALIVE,
+                        keepalive_expiry=AI_HTTP_KEEPALIVE_EXPIRY,
+                    ),
+                    timeout=httpx.Timeout(AI_EVAL_TIMEOUT, connect=AI_HTTP_CONNECT_TIMEOUT),
+                )
+                self._client = AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    http_client=self._http_client,
+                    max_retries=OPENAI_MAX_RETRIES,
+                )
+            except Exception as e:
+                logger.exception("OpenAIクライアントの初期化中にエラーが発生しました")
+                raise AIProviderUnavailable("OpenAIクライアントが初期化されていない") from e
+            logger.info("OpenAIクライアントを初期化しました（接続先: %s, HTTP/2: %s）", self.base_url, http2)
+        return self._client
+
+    async def _complete(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int,
+        temperature: float,
+        timeout: float,
+        json_mode: bool = True,
+    ) -> str:
+        options = {"response_format": {"type": "json_object"}} if json_mode else {}
+        response = await self._get_client().chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            max_tokens=max_tokens,
+            temperature=temperature,
+            timeout=httpx.Timeout(timeout, connect=AI_HTTP_CONNECT_TIMEOUT),
+            **options,
+        )
+        if response.usage is not None:
+            ai_tokens_total.inc(response.usage.prompt_tokens, provider=self.name, model=self.model, kind="prompt")
+            ai_tokens_total.inc(response.usage.completion_tokens, provider=self.name, model=self.model, kind="completion")
+        return response.choices[0].message.content
+
+    async def generate_topic(self) -> str:
+        return await self._complete(
+            TOPIC_PROMPT,
+            "大喜利のお題を1つ考えてください。",
+            max_tokens=100,
+            temperature=0.9,
+            timeout=AI_TOPIC_TIMEOUT,
+            json_mode=False,
+        )
+
+    async def evaluate(self, topic: str, answer: str) -> Dict[str, Any]:
+        content = await self._complete(
+            EVALUATION_PROMPT.format(topic=topic, answer=answer),
+            "この回答をJSON形式で評価してください。面白さだけで判断してください。必ずjsonで返してください。",
+            max_tokens=150,
+            temperature=0.7,
+            timeout=AI_EVAL_TIMEOUT,
+        )
+        return json.loads(content)
+
+    async def evaluate_stream(self, topic: str, answer: str) -> AsyncIterator[str]:
+        # スコアを先に出力させると、コメントより前にスコアを通知できる
+        stream = await self._get_client().chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": EVALUATION_PROMPT.format(topic=topic, answer=answer)},
+                {"role": "user", "content": "この回答をJSON形式で評価してください。面白さだけで判断してください。scoreを先に、commentを後に書いて、必ずjsonで返してください。"},
+            ],
+            max_tokens=150,
+            temperature=0.7,
+            response_format={"type": "json_object"},
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=httpx.Timeout(AI_EVAL_TIMEOUT, connect=AI_HTTP_CONNECT_TIMEOUT),
+        )
+        async for chunk in stream:
+            if chunk.usage is not None:
+                ai_tokens_total.inc(chunk.usage.prompt_tokens, provider=self.name, model=self.model, kind="prompt")
+                ai_tokens_total.inc(chunk.usage.completion_tokens, provider=self.name, model=self.model, kind="completion")
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def evaluate_batch(self, topic: str, answers: List[Tuple[int, str]]) -> List[Dict[str, Any]]:
+        answer_lines = "\n".join(f"[{answer_id}] {content}" for answer_id, content in answers)
+        content = await self._complete(
+            BATCH_EVALUATION_PROMPT.format(topic=topic, answer_lines=answer_lines),
+            "すべての回答をJSON形式で評価してください。面白さだけで判断してください。必ずjsonで返してください。",
+            max_tokens=50 + 120 * len(answers),
+            temperature=0.7,
+            timeout=AI_BATCH_EVAL_TIMEOUT,
+        )
+        return json.loads(content).get("evaluations", [])
+
+    async def reevaluate(self, topic: str, answer: str, vote_count: int) -> Dict[str, Any]:
+        content = await self._complete(
+            REEVALUATION_PROMPT.format(topic=topic, answer=answer, vote_count=vote_count),
+            "この人気回答をJSON形式で再評価してください。面白さと人気度を加味して判断してください。必ずjsonで返してください。",
+            max_tokens=200,
+            temperature=0.7,
+            timeout=AI_EVAL_TIMEOUT,
+        )
+        return json.loads(content)
+
+    async def aclose(self) -> None:
+        if self._http_client is not None:
+            await self._http_client.aclose()
+        self._client = None
+        self._http_client = None
+
+
+LOCAL_TOPICS = [
+    "こんなコンビニは嫌だ、どんなコンビニ？",
+    "絶対に流行らない新しいスポーツとは？",
+    "宇宙人が地球に来て最初に言った一言とは？",
+    "ロボットが書いた日記、最初の一文は？",
+    "校長先生の話がいつもより短かった理由とは？",
+    "忍者が現代で就職するならどんな仕事？",
+]
+
+LOCAL_COMMENTS = [
+    "発想の角度が鋭い！審査員席がざわついています。",
+    "じわじわ来るタイプの回答ですね。",
+    "その手があったか、と膝を打ちました。",
+    "もうひとひねりで大化けしそうです。",
+    "安定感のある一撃。会場は温まりました。",
+]
+
+
+class LocalProvider(AIProvider):
+    """外部APIを呼ばない決定的なプロバイダー（開発・ベンチマーク用）
+
+    お題とスコアは入力のハッシュから決まるため、同じ入力には常に同じ結果を返す。
+    """
+
+    name = "local"
+
+    def __init__(self, latency_ms: float = AI_LOCAL_LATENCY_MS):
+        self.latency_ms = latency_ms
+        self._topic_numbers = itertools.count()
+
+    async def _wait(self) -> None:
+        if self.latency_ms > 0:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+    @staticmethod
+    def _evaluation(*parts: Any) -> Dict[str, Any]:
+        digest = hashlib.sha256("\x00".join(str(part) for part in parts).encode("utf-8")).digest()
+        return {
+            "score": digest[0] % 10 + 1,
+            "comment": LOCAL_COMMENTS[digest[1] % len(LOCAL_COMMENTS)],
+        }
+
+    async def generate_topic(self) -> str:
+        await self._wait()
+        return LOCAL_TOPICS[next(self._topic_numbers) % len(LOCAL_TOPICS)]
+
+    async def evaluate(self, topic: str, answer: str) -> Dict[str, Any]:
+        await self._wait()
+        return self._evaluation(topic, answer)
+
+    async def evaluate_stream(self, topic: str, answer: str) -> AsyncIterator[str]:
+        content = json.dumps(self._evaluation(topic, answer), ensure_ascii=False)
+        # 疑似的な遅延を最初のチャンクまでの時間と、残りのチャンクに分けて再現する
+        await self._wait()
+        for start in range(0, len(content), 4):
+            if start and self.latency_ms > 0:
+                await asyncio.sleep(self.latency_ms / 1000 / 50)
+            yield content[start:start + 4]
+
+    async def evaluate_batch(self, topic: str, answers: List[Tuple[int, str]]) -> List[Dict[str, Any]]:
+        await self._wait()
+        return [{"id": answer_id, **self._evaluation(topic, content)} for answer_id, content in answers]
+
+    async def reevaluate(self, topic: str, answer: str, vote_count: int) -> Dict[str, Any]:
+        await self._wait()
+        evaluation = self._evaluation(topic, answer)
+        # 人気度を加味して少しだけ加点する
+        evaluation["score"] = min(10, evaluation["score"] + min(2, vote_count // 10))
+        return evaluation
+
+
+def create_provider(name: str = AI_PROVIDER) -> AIProvider:
+    """設定に応じたプロバイダーを作る"""
+    if name == "local":
+        logger.info("ローカルのAIプロバイダーを使用します（外部APIは呼び出しません）")
+        return LocalProvider()
+    if name != "openai":
+        logger.warning("不明なAI_PROVIDER「%s」のため、OpenAIを使用します", name)
+    return OpenAIProvider(os.getenv("OPENAI_API_KEY"))
+
+
+ai_provider = create_provider()
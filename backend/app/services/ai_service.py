@@ -1,218 +1,184 @@
-import os
-from openai import OpenAI
-from dotenv import load_dotenv
-import httpx
 import logging
-import json
-import traceback
+import time
+
+from app.metrics import ai_call_duration_seconds, ai_calls_total, ai_fallback_evaluations_total, ai_stream_first_token_seconds
+from app.services.ai_governor import AICircuitOpen, ai_governor
+from app.services.ai_providers import AI_PROVIDER, AIProviderUnavailable, ai_provider
+from app.services.evaluation_stream import EvaluationStreamParser
 
-# ロギングを設定
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+# 評価プロンプトのバージョン（プロンプトを変更したら更新し、評価キャッシュを無効化する）
+# ローカルプロバイダーの評価はOpenAIの評価とキャッシュを共有しない
+PROMPT_VERSION = "v1" if AI_PROVIDER != "local" else "v1-local"
+
+def _fallback_evaluation(error_msg):
+    """AIで評価できなかった場合の仮の評価（キャッシュ対象外であることを示すフラグ付き）"""
+    return {
+        "score": 5,
+        "comment": error_msg,
+        "fallback": True
+    }
+
+def _normalize_evaluation(evaluation):
+    return {
+        "score": int(evaluation.get("score", 5)),
+        "comment": evaluation.get("comment", "評価できませんでした。")
+    }
 
-# OpenAI APIキーの確認と記録
-api_key = os.getenv("OPENAI_API_KEY")
-if not api_key or api_key == "YOUR_OPENAI_API_KEY_HERE" or api_key == "sk-dummy-key-for-testing":
-    logger.error("有効なOpenAI APIキーが設定されていません。.envファイルを確認してください。")
-    client = None
-else:
+def _estimate_tokens(base, *texts):
+    """RPM/TPMの予算に使うトークン数の見積もり（プロンプトと出力の分 + 日本語はおおむね1文字1トークン）"""
+    return base + sum(len(text) for text in texts)
+
+async def _call(operation, action, call, fallback, estimated_tokens, raise_errors=False):
+    """プロバイダーを呼び出す（流量制御・エラー処理・メトリクスの記録は全関数で共通）
+
+    OpenAIの呼び出しはai_governorを通し、RPM/TPMの予算と同時実行数の範囲内で実行する。
+    失敗した場合はエラー文をfallbackに渡した結果を返す。raise_errors=Trueでは、
+    API呼び出しの失敗・プロバイダーが使えないこと・サーキットが開いていることを例外として伝える
+    （呼び出し側は仮のスコアを保存せず、後で評価し直す）。
+    """
+    start = time.perf_counter()
     try:
-        # カスタムHTTPXクライアントを作成
-        http_client = httpx.Client(
-            base_url="https://api.openai.com/v1",
-            follow_redirects=True,
-            timeout=60.0
-        )
-
-        # カスタムクライアントを使用してOpenAIインスタンスを初期化
-        client = OpenAI(
-            api_key=api_key,
-            http_client=http_client
-        )
-        logger.info("OpenAIクライアントが正常に初期化されました。")
-    except Exception as e:
-        logger.error(f"OpenAIクライアントの初期化中にエラーが発生しました: {str(e)}")
-        logger.error(f"詳細な例外情報: {traceback.format_exc()}")
-        client = None
-
-def generate_topic():
-    """AIによる大喜利のお題生成"""
-    
-    if not api_key or api_key == "YOUR_OPENAI_API_KEY_HERE" or api_key == "sk-dummy-key-for-testing":
-        error_msg = "有効なOpenAI APIキーが設定されていないため、お題を生成できません。"
-        logger.error(error_msg)
-        return error_msg
-    
-    if client is None:
-        error_msg = "OpenAIクライアントが初期化されていません。APIキーと接続を確認してください。"
+        if ai_provider.name == "local":
+            # ローカルプロバイダーはAPIの上限がないため流量制御しない
+            result = await call()
+        else:
+            result = await ai_governor.run(call, estimated_tokens)
+    except AIProviderUnavailable as e:
+        ai_calls_total.inc(provider=ai_provider.name, operation=operation, outcome="unavailable")
+        error_msg = f"{e}ため、{action}ができません。"
         logger.error(error_msg)
-        return error_msg
-    
-    prompt = """
-    あなたは大喜利のお題を考える専門家です。面白くて、回答が多様に考えられるお題を1つ考えてください。
-    お題は50文字以内で、誰でも理解できる平易な日本語で作成してください。
-    
-    お題だけを返してください。説明や前置き、かぎかっこなどは不要です。
+        if raise_errors:
+            raise AIProviderUnavailable(error_msg) from None
+        return _record_fallback(operation, fallback(error_msg))
+    except AICircuitOpen as e:
+        ai_calls_total.inc(provider=ai_provider.name, operation=operation, outcome="deferred")
+        if raise_errors:
+            raise
+        logger.warning("%s", e)
+        return _record_fallback(operation, fallback(f"{action}を一時停止しています。"))
+    except Exception as e:
+        ai_calls_total.inc(provider=ai_provider.name, operation=operation, outcome="error")
+        ai_call_duration_seconds.observe(time.perf_counter() - start, provider=ai_provider.name, operation=operation)
+        if raise_errors:
+            raise
+        error_msg = f"{action}中にエラーが発生しました: {str(e)}"
+        # トレースバックの書式化はログの出力スレッドで行う
+        logger.error(error_msg, exc_info=True)
+        return _record_fallback(operation, fallback(error_msg))
+
+    ai_calls_total.inc(provider=ai_provider.name, operation=operation, outcome="success")
+    ai_call_duration_seconds.observe(time.perf_counter() - start, provider=ai_provider.name, operation=operation)
+    return result
+
+def _record_fallback(operation, result):
+    """仮のスコアで評価した回答数を記録する"""
+    if isinstance(result, dict):
+        fallbacks = 1 if result.get("fallback") else sum(1 for value in result.values() if isinstance(value, dict) and value.get("fallback"))
+        if fallbacks:
+            ai_fallback_evaluations_total.inc(fallbacks, operation=operation)
+    return result
+
+async def generate_topic(raise_errors=False):
+    """AIによる大喜利のお題生成
+
+    raise_errors=Trueの場合、生成できなかったことを例外として呼び出し元に伝える（エラー文をお題にしないため）
     """
-    
-    try:
-        logger.info("OpenAI APIを使用してお題を生成します...")
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": "大喜利のお題を1つ考えてください。"}
-            ],
-            max_tokens=100,
-            temperature=0.9
-        )
-        
+
+    async def call():
+        logger.info("AIプロバイダー（%s）でお題を生成します...", ai_provider.name)
+        topic = await ai_provider.generate_topic()
         # レスポンスから余分な記号や空白を削除
-        topic = response.choices[0].message.content.strip()
-        topic = topic.replace('"', '').replace('「', '').replace('」', '')
-        
-        logger.info(f"お題が正常に生成されました: {topic}")
+        topic = topic.strip().replace('"', '').replace('「', '').replace('」', '')
+        logger.info("お題が正常に生成されました: %s", topic)
         return topic
-    except Exception as e:
-        error_msg = f"お題生成中にエラーが発生しました: {str(e)}"
-        logger.error(error_msg)
-        logger.error(f"詳細な例外情報: {traceback.format_exc()}")
-        return error_msg
-
-def evaluate_answer(topic, answer):
-    """AIによる大喜利の回答評価"""
-    
-    if not api_key or api_key == "YOUR_OPENAI_API_KEY_HERE" or api_key == "sk-dummy-key-for-testing":
-        error_msg = "有効なOpenAI APIキーが設定されていないため、回答を評価できません。"
-        logger.error(error_msg)
-        return {
-            "score": 5,
-            "comment": error_msg
-        }
-    
-    if client is None:
-        error_msg = "OpenAIクライアントが初期化されていません。APIキーと接続を確認してください。"
-        logger.error(error_msg)
-        return {
-            "score": 5,
-            "comment": error_msg
-        }
-    
-    prompt = f"""
-    あなたは大喜利の回答を評価するユーモア満載の審査員です。以下の大喜利のお題に対する回答を評価してください。
-
-    【お題】
-    {topic}
-    
-    【回答】
-    {answer}
-    
-    回答を1〜10点で評価してください。評価の基準は「おもしろいかどうか」だけをベースに考えてください。
-    ユーモアあふれる表現やジョークを交えた評価コメントを書いてください。回答が面白ければ高得点を与えてください。
-    
-    以下のJSON形式で回答してください:
-    {{
-      "score": [1-10の整数],
-      "comment": "ユーモアあふれる評価コメント（100文字以内）"
-    }}
+
+    return await _call("generate_topic", "お題の生成", call, lambda error_msg: error_msg, _estimate_tokens(300), raise_errors)
+
+async def evaluate_answer(topic, answer, raise_errors=False):
+    """AIによる大喜利の回答評価
+
+    raise_errors=Trueの場合、評価できなかったことを例外として呼び出し元に伝える（リトライ用）
     """
-    
-    try:
-        logger.info("OpenAI APIを使用して回答を評価します...")
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": "この回答をJSON形式で評価してください。面白さだけで判断してください。必ずjsonで返してください。"}
-            ],
-            max_tokens=150,
-            temperature=0.7,
-            response_format={"type": "json_object"}
-        )
-        
-        # JSONレスポンスをパース
-        evaluation = json.loads(response.choices[0].message.content)
-        logger.info(f"回答が正常に評価されました: スコア {evaluation.get('score', 5)}")
-        
-        return {
-            "score": int(evaluation.get("score", 5)),
-            "comment": evaluation.get("comment", "評価できませんでした。")
-        }
-    except Exception as e:
-        error_msg = f"回答評価中にエラーが発生しました: {str(e)}"
-        logger.error(error_msg)
-        logger.error(f"詳細な例外情報: {traceback.format_exc()}")
-        return {
-            "score": 5,
-            "comment": error_msg
-        }
 
-def reevaluate_popular_answer(topic, answer, vote_count):
-    """投票数の多い人気回答を再評価する関数"""
-    
-    if not api_key or api_key == "YOUR_OPENAI_API_KEY_HERE" or api_key == "sk-dummy-key-for-testing":
-        error_msg = "有効なOpenAI APIキーが設定されていないため、回答を再評価できません。"
-        logger.error(error_msg)
-        return {
-            "score": 5,
-            "comment": error_msg
-        }
-    
-    if client is None:
-        error_msg = "OpenAIクライアントが初期化されていません。APIキーと接続を確認してください。"
-        logger.error(error_msg)
-        return {
-            "score": 5,
-            "comment": error_msg
-        }
-    
-    prompt = f"""
-    あなたは大喜利の回答を評価するユーモア満載の審査員です。以下の大喜利のお題に対する回答は、多くの人（{vote_count}人）から支持を得た人気回答です。
-
-    【お題】
-    {topic}
-    
-    【人気回答】
-    {answer}
-    
-    この人気回答を1〜10点で再評価してください。この回答がなぜ多くの人に支持されたのか、その魅力や面白さを深く分析してください。
-    ユーモア、意外性、知性などの観点から、回答の優れた点を詳しく述べてください。
-    
-    以下のJSON形式で回答してください:
-    {{
-      "score": [1-10の整数、人気度を加味した評価],
-      "comment": "その回答の魅力を分析したユーモア溢れる評価コメント（100文字以内）"
-    }}
+    async def call():
+        evaluation = _normalize_evaluation(await ai_provider.evaluate(topic, answer))
+        logger.debug("回答が正常に評価されました: スコア %d", evaluation["score"])
+        return evaluation
+
+    return await _call("evaluate", "回答の評価", call, _fallback_evaluation, _estimate_tokens(500, topic, answer), raise_errors)
+
+async def evaluate_answer_stream(topic, answer, on_score=None, on_delta=None, raise_errors=False, on_start=None):
+    """AIによる大喜利の回答評価（ストリーミング）
+
+    API呼び出しの開始時にon_start()を、スコアが確定した時点でon_score(score)を、
+    コメントが届くたびにon_delta(差分の文字列)を呼び出す。
+    戻り値はevaluate_answerと同じ形の最終的な評価。
     """
-    
-    try:
-        logger.info("OpenAI APIを使用して人気回答を再評価します...")
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": "この人気回答をJSON形式で再評価してください。面白さと人気度を加味して判断してください。必ずjsonで返してください。"}
-            ],
-            max_tokens=200,
-            temperature=0.7,
-            response_format={"type": "json_object"}
-        )
-        
-        # JSONレスポンスをパース
-        evaluation = json.loads(response.choices[0].message.content)
-        logger.info(f"人気回答が再評価されました: スコア {evaluation.get('score', 5)}")
-        
-        return {
-            "score": int(evaluation.get("score", 5)),
-            "comment": evaluation.get("comment", "評価できませんでした。")
-        }
-    except Exception as e:
-        error_msg = f"人気回答の再評価中にエラーが発生しました: {str(e)}"
-        logger.error(error_msg)
-        logger.error(f"詳細な例外情報: {traceback.format_exc()}")
-        return {
-            "score": 5,
-            "comment": error_msg
-        } 
\ No newline at end of file
+
+    async def call():
+        if on_start is not None:
+            on_start()
+        parser = EvaluationStreamParser()
+        start = time.perf_counter()
+        first_chunk = True
+        async for chunk in ai_provider.evaluate_stream(topic, answer):
+            if first_chunk:
+                ai_stream_first_token_seconds.observe(time.perf_counter() - start, provider=ai_provider.name)
+                first_chunk = False
+            score, delta = parser.feed(chunk)
+            if score is not None and on_score is not None:
+                on_score(score)
+            if delta and on_delta is not None:
+                on_delta(delta)
+        evaluation = _normalize_evaluation(parser.result())
+        logger.debug("回答が正常に評価されました（ストリーミング）: スコア %d", evaluation["score"])
+        return evaluation
+
+    return await _call("evaluate_stream", "回答の評価", call, _fallback_evaluation, _estimate_tokens(500, topic, answer), raise_errors)
+
+async def evaluate_answers_batch(topic, answers, raise_errors=False):
+    """同じお題に対する複数の回答を1回のAPI呼び出しでまとめて評価する
+
+    answersは(回答ID, 回答内容)のリスト。戻り値は回答IDをキーとした評価の辞書で、
+    AIが評価を返さなかった回答IDは含まれない。
+    """
+
+    if not answers:
+        return {}
+
+    async def call():
+        logger.debug("%d件の回答をまとめて評価します...", len(answers))
+        requested_ids = {answer_id for answer_id, _ in answers}
+        evaluations = {}
+        for item in await ai_provider.evaluate_batch(topic, answers):
+            try:
+                answer_id = int(item.get("id"))
+            except (TypeError, ValueError):
+                continue
+            if answer_id not in requested_ids:
+                continue
+            evaluations[answer_id] = _normalize_evaluation(item)
+
+        logger.debug("%d/%d件の回答がまとめて評価されました", len(evaluations), len(answers))
+        return evaluations
+
+    return await _call(
+        "evaluate_batch",
+        "回答の評価",
+        call,
+        lambda error_msg: {answer_id: _fallback_evaluation(error_msg) for answer_id, _ in answers},
+        _estimate_tokens(400 + 150 * len(answers), topic, *(content for _, content in answers)),
+        raise_errors,
+    )
+
+async def reevaluate_popular_answer(topic, answer, vote_count, raise_errors=False):
+    """投票数の多い人気回答を再評価する関数"""
+
+    async def call():
+        evaluation = _normalize_evaluation(await ai_provider.reevaluate(topic, answer, vote_count))
+        logger.info("人気回答が再評価されました: スコア %d", evaluation["score"])
+        return evaluation
+
+    return await _call("reevaluate", "人気回答の再評価", call, _fallback_evaluation, _estimate_tokens(600, topic, answer), raise_errors)
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import logging
+import os
+import zlib
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session, selectinload
+
+from app.database import SessionLocal
+from app.models.models import Answer, Topic, TopicArchive, Vote
+from app.schemas.schemas import TopicDetail
+from app.services.ranking import ranking_index
+from app.services.topic_cache import utcnow
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# お題の有効期限から何時間後にアーカイブするか
+ARCHIVE_AFTER_HOURS = float(os.getenv("ARCHIVE_AFTER_HOURS", "24"))
+# アーカイブ対象を確認する間隔（秒）
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+# 1回の確認でアーカイブするお題の最大数
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "10"))
+# アーカイブジョブを起動するかどうか
+ARCHIVER_ENABLED = os.getenv("ARCHIVER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+def compress_snapshot(detail: Dict[str, Any]) -> bytes:
+    return zlib.compress(json.dumps(detail, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def load_snapshot(snapshot: bytes) -> Dict[str, Any]:
+    """スナップショットをTopicDetailと同じ形の辞書に戻す"""
+    detail = json.loads(zlib.decompress(snapshot).decode("utf-8"))
+    detail["archived"] = True
+    return detail
+
+
+def archivable_topic_ids(db: Session, after_hours: float = ARCHIVE_AFTER_HOURS, limit: int = ARCHIVE_BATCH_SIZE) -> List[int]:
+    """有効期限からafter_hours時間以上経った、未アーカイブで非アクティブなお題のID"""
+    archived = select(TopicArchive.topic_id)
+    rows = db.query(Topic.id)\
+        .filter(
+            Topic.is_active == False,
+            Topic.expires_at < utcnow() - timedelta(hours=after_hours),
+            Topic.id.not_in(archived),
+        )\
+        .order_by(Topic.expires_at)\
+        .limit(limit)\
+        .all()
+    return [topic_id for (topic_id,) in rows]
+
+
+def archive_topic(db: Session, topic_id: int) -> Optional[TopicArchive]:
+    """お題のスナップショットを保存し、個々の投票を削除する（1トランザクション）
+
+    投票数はanswers.vote_countに残るため、ランキングやお題の詳細には影響しない。
+    """
+    topic = db.query(Topic).options(selectinload(Topic.answers)).filter(Topic.id == topic_id).first()
+    if topic is None or db.get(TopicArchive, topic_id) is not None:
+        return None
+
+    detail = TopicDetail.model_validate(topic).model_dump(mode="json")
+    detail["answers"].sort(key=lambda answer: answer["id"])
+    archive = TopicArchive(
+        topic_id=topic_id,
+        answer_count=len(detail["answers"]),
+        vote_total=sum(answer["vote_count"] or 0 for answer in detail["answers"]),
+        snapshot=compress_snapshot(detail),
+    )
+    try:
+        db.add(archive)
+        result = db.execute(
+            delete(Vote).where(Vote.answer_id.in_(select(Answer.id).where(Answer.topic_id == topic_id)))
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    ranking_index.drop_topic(topic_id)
+    logger.info(
+        "お題をアーカイブしました（ID: %d, 回答 %d件, 削除した投票 %d件, %dバイト）",
+        topic_id, archive.answer_count, result.rowcount, len(archive.snapshot),
+    )
+    return archive
+
+
+def archive_expired_topics(after_hours: float = ARCHIVE_AFTER_HOURS, limit: int = ARCHIVE_BATCH_SIZE) -> List[int]:
+    """アーカイブ対象のお題をまとめてアーカイブし、アーカイブしたIDを返す（ワーカースレッドで実行）"""
+    db = SessionLocal()
+    try:
+        archived = []
+        for topic_id in archivable_topic_ids(db, after_hours, limit):
+            if archive_topic(db, topic_id) is not None:
+                archived.append(topic_id)
+        return archived
+    finally:
+        db.close()
+
+
+class TopicArchiver:
+    """終了したお題を定期的にアーカイブするジョブ"""
+
+    def __init__(self, interval_seconds: float = ARCHIVE_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"runs": 0, "archived": 0, "errors": 0}
+
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="topic-archiver")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def run_once(self) -> List[int]:
+        self._stats["runs"] += 1
+        archived = await asyncio.to_thread(archive_expired_topics)
+        self._stats["archived"] += len(archived)
+        return archived
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                # 対象が多い場合は間隔を空けずに続けて処理する
+                while len(await self.run_once()) >= ARCHIVE_BATCH_SIZE:
+                    pass
+            except Exception:
+                self._stats["errors"] += 1
+                logger.exception("お題のアーカイブに失敗しました")
+            await asyncio.sleep(self.interval_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": self._task is not None and not self._task.done(), **self._stats}
+
+
+topic_archiver = TopicArchiver()
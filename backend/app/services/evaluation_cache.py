@@ -0,0 +1,145 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+from app.models.models import EvaluationCacheEntry
+from app.services.ai_service import PROMPT_VERSION
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# キャッシュを使うかどうか
+EVAL_CACHE_ENABLED = os.getenv("EVAL_CACHE_ENABLED", "true").lower() == "true"
+# メモリ上に保持する最大件数
+EVAL_CACHE_MAX_ENTRIES = int(os.getenv("EVAL_CACHE_MAX_ENTRIES", "10000"))
+# キャッシュの有効期間（秒）
+EVAL_CACHE_TTL_SECONDS = int(os.getenv("EVAL_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+def normalize_text(text: str) -> str:
+    """全角・半角や空白の違いを吸収した比較用の文字列にする"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.lower().split())
+
+
+def make_cache_key(topic: str, answer: str, prompt_version: str = PROMPT_VERSION) -> str:
+    """お題・回答・プロンプトバージョンからキャッシュキーを作る"""
+    payload = "\x00".join([prompt_version, normalize_text(topic), normalize_text(answer)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EvaluationCache:
+    """AI評価結果の2段キャッシュ
+
+    TTL付きのLRU（メモリ）の後ろにevaluation_cacheテーブルを置き、
+    再起動後もヒットするようにする。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = EVAL_CACHE_MAX_ENTRIES,
+        ttl_seconds: int = EVAL_CACHE_TTL_SECONDS,
+        enabled: bool = EVAL_CACHE_ENABLED,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._memory: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+
+    def get(self, db: Session, topic: str, answer: str) -> Optional[Dict[str, Any]]:
+        """キャッシュ済みの評価を返す。なければNone"""
+        if not self.enabled:
+            return None
+
+        key = make_cache_key(topic, answer)
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                evaluation, expires_at = cached
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return dict(evaluation)
+                del self._memory[key]
+
+        entry = db.query(EvaluationCacheEntry).filter(EvaluationCacheEntry.cache_key == key).first()
+        if entry is not None and entry.created_at is not None:
+            age = (datetime.utcnow() - entry.created_at).total_seconds()
+            if age < self.ttl_seconds:
+                evaluation = {"score": entry.score, "comment": entry.comment}
+                self._remember(key, evaluation, now + self.ttl_seconds - age)
+                with self._lock:
+                    self._stats["db_hits"] += 1
+                return dict(evaluation)
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, db: Session, topic: str, answer: str, evaluation: Dict[str, Any]) -> None:
+        """評価をキャッシュに保存する（DBへの反映は呼び出し元のコミットで行われる）"""
+        if not self.enabled or evaluation.get("fallback"):
+            return
+
+        key = make_cache_key(topic, answer)
+        self._remember(key, {"score": evaluation["score"], "comment": evaluation["comment"]}, time.time() + self.ttl_seconds)
+        db.merge(EvaluationCacheEntry(
+            cache_key=key,
+            prompt_version=PROMPT_VERSION,
+            score=evaluation["score"],
+            comment=evaluation["comment"],
+            created_at=datetime.utcnow(),
+        ))
+        with self._lock:
+            self._stats["stores"] += 1
+
+    def _remember(self, key: str, evaluation: Dict[str, Any], expires_at: float) -> None:
+        with self._lock:
+            self._memory[key] = (evaluation, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def purge_expired(self, db: Session) -> int:
+        """期限切れのDBエントリを削除する"""
+        threshold = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        deleted = db.query(EvaluationCacheEntry).filter(EvaluationCacheEntry.created_at < threshold).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self._stats["memory_hits"] + self._stats["db_hits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                "enabled": self.enabled,
+                "prompt_version": PROMPT_VERSION,
+                "memory_entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                **self._stats,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+evaluation_cache = EvaluationCache()
@@ -0,0 +1,527 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.metrics import ai_evaluations_reused_total
+from app.models.models import Answer, Topic
+from app.services.ai_governor import AI_CONCURRENCY_MAX, AICircuitOpen, ai_governor
+from app.services.ai_providers import AIProviderUnavailable, ai_provider
+from app.services.ai_service import evaluate_answer, evaluate_answer_stream, evaluate_answers_batch
+from app.services.evaluation_cache import evaluation_cache
+from app.services.ranking import ranking_index
+from app.services.realtime import publish_answer_event, publish_evaluation
+from app.services.similarity import similarity_index
+from app.services.topic_cache import utcnow
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 待ち行列に積める評価ジョブの上限
+AI_EVAL_QUEUE_SIZE = int(os.getenv("AI_EVAL_QUEUE_SIZE", "1000"))
+# 失敗時の最大リトライ回数
+AI_EVAL_MAX_RETRIES = int(os.getenv("AI_EVAL_MAX_RETRIES", "3"))
+# リトライ間隔の基準秒数（指数バックオフ）
+AI_EVAL_RETRY_BASE_DELAY = float(os.getenv("AI_EVAL_RETRY_BASE_DELAY", "1.0"))
+# 同じお題の回答を1回のAPI呼び出しでまとめて評価する最大件数（1でまとめない）
+AI_EVAL_BATCH_SIZE = int(os.getenv("AI_EVAL_BATCH_SIZE", "8"))
+# バッチに回答を集める最大待ち時間（秒）
+AI_EVAL_BATCH_WINDOW = float(os.getenv("AI_EVAL_BATCH_WINDOW", "0.5"))
+# 評価をストリーミングで受け取り、スコアとコメントを回答チャンネルに逐次配信する（回答は1件ずつ評価する）
+AI_EVAL_STREAMING = os.getenv("AI_EVAL_STREAMING", "false").lower() == "true"
+# 未評価のまま残った回答を探して積み直す間隔（秒、0で無効）
+AI_PENDING_SWEEP_INTERVAL = float(os.getenv("AI_PENDING_SWEEP_INTERVAL", "60"))
+# 評価を担当するプロセスの確保がこの秒数更新されていない未評価の回答だけを積み直す
+# （確保は積み直しの間隔ごとに更新するため、AI_PENDING_SWEEP_INTERVALより長くする）
+AI_PENDING_CLAIM_SECONDS = float(os.getenv("AI_PENDING_CLAIM_SECONDS", "180"))
+# この時間より前に投稿された回答は積み直さない
+AI_PENDING_MAX_AGE_HOURS = float(os.getenv("AI_PENDING_MAX_AGE_HOURS", "24"))
+# 1回の確認で積み直す回答の上限
+AI_PENDING_SWEEP_BATCH = int(os.getenv("AI_PENDING_SWEEP_BATCH", "100"))
+
+
+@dataclass
+class EvaluationJob:
+    """AI評価ジョブ"""
+    answer_id: int
+    topic_id: int
+    attempt: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+def _load_batch(answer_ids: List[int]) -> Tuple[Optional[str], List[Tuple[int, str]], Dict[int, Dict[str, Any]], Dict[int, int]]:
+    """回答とお題を読み込み、キャッシュやほぼ同じ回答から得られる評価を取り出す（ワーカースレッドで実行）
+
+    お題の内容、AIで評価が必要な(回答ID, 回答内容)のリスト、AIを呼ばずに得た評価、
+    バッチ内のほぼ同じ回答の{回答ID: 代表の回答ID}を返す。
+    """
+    db = SessionLocal()
+    try:
+        answers = db.query(Answer).filter(Answer.id.in_(answer_ids)).all()
+        if not answers:
+            return None, [], {}, {}
+
+        topic = db.query(Topic).filter(Topic.id == answers[0].topic_id).first()
+
+        # キャッシュにある回答はAIを呼ばずに評価を再利用する
+        cached_evaluations = {}
+        uncached = []
+        for answer in answers:
+            cached = evaluation_cache.get(db, topic.content, answer.content)
+            if cached is not None:
+                cached_evaluations[answer.id] = cached
+            else:
+                uncached.append((answer.id, answer.content))
+
+        # 同じお題の評価済みの回答やバッチ内の他の回答とほぼ同じ回答は、AIで評価せずに評価を使い回す
+        duplicates, same_as = similarity_index.find_duplicates(db, topic.id, uncached)
+        if cached_evaluations:
+            ai_evaluations_reused_total.inc(len(cached_evaluations), source="cache")
+        if duplicates or same_as:
+            ai_evaluations_reused_total.inc(len(duplicates) + len(same_as), source="duplicate")
+            cached_evaluations.update(duplicates)
+            uncached = [(answer_id, content) for answer_id, content in uncached if answer_id not in duplicates and answer_id not in same_as]
+        return topic.content, uncached, cached_evaluations, same_as
+    finally:
+        db.close()
+
+
+def _claim_pending(claim_seconds: float, max_age_hours: float, limit: int) -> List[Tuple[int, int]]:
+    """未評価のまま残っていて誰も確保していない回答を古い順に確保し、その(回答ID, お題ID)を返す（ワーカースレッドで実行）
+
+    確保は1回のUPDATEで行うため、複数のプロセスが同時に呼んでも同じ回答を確保できるのは1つだけになる。
+    """
+    now = utcnow()
+    claimable = or_(Answer.eval_claimed_at.is_(None), Answer.eval_claimed_at < now - timedelta(seconds=claim_seconds))
+    db = SessionLocal()
+    try:
+        candidates = [
+            answer_id for (answer_id,) in db.query(Answer.id)
+            .filter(
+                Answer.ai_score.is_(None),
+                Answer.created_at >= now - timedelta(hours=max_age_hours),
+                claimable,
+            )
+            .order_by(Answer.created_at)
+            .limit(limit)
+            .all()
+        ]
+        if not candidates:
+            return []
+        rows = db.execute(
+            update(Answer)
+            .where(Answer.id.in_(candidates), Answer.ai_score.is_(None), claimable)
+            .values(eval_claimed_at=now)
+            .returning(Answer.id, Answer.topic_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.commit()
+        topic_ids = dict(rows)
+        return [(answer_id, topic_ids[answer_id]) for answer_id in candidates if answer_id in topic_ids]
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _renew_claims(answer_ids: List[int]) -> None:
+    """このプロセスのキューにある回答の確保を延長する（ワーカースレッドで実行）"""
+    now = utcnow()
+    db = SessionLocal()
+    try:
+        for i in range(0, len(answer_ids), 500):
+            db.query(Answer)\
+                .filter(Answer.id.in_(answer_ids[i:i + 500]), Answer.ai_score.is_(None))\
+                .update({Answer.eval_claimed_at: now}, synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def store_evaluation(db: Session, answer_id: int, evaluation: Dict[str, Any], requested_at: datetime, duplicate_of: Optional[int] = None) -> bool:
+    """回答に評価を書き込み、書き込めたかどうかを返す（コミットは呼び出し側で行う）
+
+    requested_atより後に依頼された評価（人気回答の再評価など）がすでに保存されている場合は上書きしない。
+    """
+    updated = db.query(Answer)\
+        .filter(
+            Answer.id == answer_id,
+            or_(Answer.evaluated_at.is_(None), Answer.evaluated_at < requested_at),
+        )\
+        .update({
+            Answer.ai_score: evaluation["score"],
+            Answer.ai_comment: evaluation["comment"],
+            Answer.duplicate_of_id: duplicate_of,
+            Answer.evaluated_at: requested_at,
+        }, synchronize_session=False)
+    return updated == 1
+
+
+def _save_evaluations(
+    answer_ids: List[int],
+    topic_content: str,
+    uncached: List[Tuple[int, str]],
+    evaluations: Dict[int, Dict[str, Any]],
+    requested_at: datetime,
+) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """評価をキャッシュと回答に保存する（ワーカースレッドで実行）
+
+    保存した評価結果と、評価が返らず未評価のまま残った回答IDを返す（仮のスコアは保存しない）。
+    評価中に新しい評価が保存された回答は上書きせず、結果にも含めない。
+    """
+    db = SessionLocal()
+    try:
+        for answer_id, content in uncached:
+            if answer_id in evaluations:
+                evaluation_cache.put(db, topic_content, content, evaluations[answer_id])
+
+        results = []
+        pending_ids = []
+        originals = []
+        rows = db.query(Answer.id, Answer.topic_id, Answer.content).filter(Answer.id.in_(answer_ids)).all()
+        for answer_id, topic_id, content in rows:
+            evaluation = evaluations.get(answer_id)
+            if evaluation is None or evaluation.get("fallback"):
+                pending_ids.append(answer_id)
+                continue
+            duplicate_of = evaluation.get("duplicate_of")
+            if not store_evaluation(db, answer_id, evaluation, requested_at, duplicate_of):
+                logger.info("回答ID %d には新しい評価が保存済みのため、評価を上書きしませんでした", answer_id)
+                continue
+            if duplicate_of is None:
+                originals.append((topic_id, answer_id, content, evaluation))
+            results.append({
+                "topic_id": topic_id,
+                "answer_id": answer_id,
+                "ai_score": evaluation["score"],
+                "ai_comment": evaluation["comment"],
+            })
+        db.commit()
+
+        for topic_id, answer_id, content, evaluation in originals:
+            similarity_index.add(topic_id, answer_id, content, evaluation)
+        return results, pending_ids
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def evaluate_streaming(
+    topic_content: str, answer_id: int, content: str, raise_errors: bool = False, attempt: int = 0
+) -> Dict[str, Any]:
+    """回答をストリーミングで評価し、スコアとコメントの差分を回答チャンネルに配信する
+
+    API呼び出しのたびに最初にevaluation_started（attempt付き）を配信する。失敗してやり直した場合、
+    購読側はこのイベントで前の試行で届いたスコアとコメントを破棄する。
+    """
+    return await evaluate_answer_stream(
+        topic_content,
+        content,
+        on_start=lambda: publish_answer_event(answer_id, "evaluation_started", attempt=attempt),
+        on_score=lambda score: publish_answer_event(answer_id, "evaluation_score", ai_score=score),
+        on_delta=lambda delta: publish_answer_event(answer_id, "evaluation_delta", delta=delta),
+        raise_errors=raise_errors,
+    )
+
+
+async def _evaluate_and_save(
+    answer_ids: List[int], streaming: bool = False, attempt: int = 0
+) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """回答を評価して保存する
+
+    DBアクセスはワーカースレッドで、AIの呼び出しはイベントループ上で非同期に行う。
+    複数の回答IDが渡された場合は1回のAPI呼び出しでまとめて評価する。
+    評価できなかった場合は例外を送出し、回答は未評価のまま残す。
+    """
+    requested_at = utcnow()
+    topic_content, uncached, evaluations, same_as = await asyncio.to_thread(_load_batch, answer_ids)
+    if topic_content is None:
+        return [], []
+
+    if len(uncached) == 1 and streaming:
+        answer_id, content = uncached[0]
+        evaluations[answer_id] = await evaluate_streaming(topic_content, answer_id, content, raise_errors=True, attempt=attempt)
+    elif len(uncached) == 1:
+        answer_id, content = uncached[0]
+        evaluations[answer_id] = await evaluate_answer(topic_content, content, raise_errors=True)
+    elif uncached:
+        evaluations.update(await evaluate_answers_batch(topic_content, uncached, raise_errors=True))
+
+    # バッチ内のほぼ同じ回答には代表の回答の評価を使う（代表が評価できなかった場合は未評価のまま残す）
+    for answer_id, representative_id in same_as.items():
+        if representative_id in evaluations:
+            evaluations[answer_id] = {**evaluations[representative_id], "duplicate_of": representative_id}
+
+    return await asyncio.to_thread(_save_evaluations, answer_ids, topic_content, uncached, evaluations, requested_at)
+
+
+class EvaluationQueue:
+    """AI評価の待ち行列
+
+    AIの呼び出しは非同期で行い、DBアクセスはワーカースレッドで実行して
+    イベントループを止めないようにする。ディスパッチャーは短い時間窓で回答を集め、
+    同じお題の回答をまとめて1回のAPI呼び出しで評価する。同時に実行する評価の数は
+    AIGovernorが応答時間と429に応じて調整するため、キュー側の実行枠はその上限（AI_CONCURRENCY_MAX）に合わせる。
+    失敗したジョブは指数バックオフでリトライし、AI呼び出しのサーキットが開いている間は
+    試行回数を消費せずに後回しにする。評価できなかった回答に仮のスコアは付けず、
+    未評価のまま残った回答は定期的な確認でDB上で確保してから積み直す（複数のプロセスで同じ回答を評価しない）。
+    """
+
+    def __init__(
+        self,
+        concurrency: int = AI_CONCURRENCY_MAX,
+        max_size: int = AI_EVAL_QUEUE_SIZE,
+        max_retries: int = AI_EVAL_MAX_RETRIES,
+        retry_base_delay: float = AI_EVAL_RETRY_BASE_DELAY,
+        batch_size: int = AI_EVAL_BATCH_SIZE,
+        batch_window: float = AI_EVAL_BATCH_WINDOW,
+        streaming: bool = AI_EVAL_STREAMING,
+        sweep_interval: float = AI_PENDING_SWEEP_INTERVAL,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.max_size = max_size
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.streaming = streaming
+        # ストリーミングでは回答ごとに配信するため、まとめて評価しない
+        self.batch_size = 1 if streaming else max(1, batch_size)
+        self.batch_window = batch_window
+        self.sweep_interval = sweep_interval
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._sweeper: Optional[asyncio.Task] = None
+        self._batch_tasks = set()
+        self._retry_tasks = set()
+        # 待ち行列・実行中・リトライ待ちの回答ID（同じ回答を二重に積まないため）
+        self._active_ids: Set[int] = set()
+        self._in_flight = 0
+        self._counters = {
+            "enqueued": 0,
+            "processed": 0,
+            "failed": 0,
+            "retried": 0,
+            "deferred": 0,
+            "swept": 0,
+            "dropped": 0,
+            "batches": 0,
+        }
+        self._attempts = 0
+        self._total_wait_seconds = 0.0
+        self._total_run_seconds = 0.0
+
+    async def start(self) -> None:
+        if self._dispatcher:
+            return
+        self._dispatcher = asyncio.create_task(self._dispatch(), name="ai-eval-dispatcher")
+        if self.sweep_interval > 0:
+            self._sweeper = asyncio.create_task(self._sweep_loop(), name="ai-eval-sweeper")
+        logger.info(
+            "AI評価キューを開始しました（同時実行数: %d, バッチサイズ: %d）",
+            self.concurrency,
+            self.batch_size,
+        )
+
+    async def stop(self) -> None:
+        tasks = [*self._batch_tasks, *self._retry_tasks]
+        for task in (self._dispatcher, self._sweeper):
+            if task:
+                tasks.append(task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._dispatcher = None
+        self._sweeper = None
+        self._batch_tasks.clear()
+        self._retry_tasks.clear()
+        self._active_ids.clear()
+
+    def enqueue(self, answer_id: int, topic_id: int) -> bool:
+        """評価ジョブを積む。キューが一杯の場合はFalseを返す（すでに積まれている回答は積まずにTrueを返す）"""
+        if answer_id in self._active_ids:
+            return True
+        return self._put(EvaluationJob(answer_id=answer_id, topic_id=topic_id))
+
+    def _put(self, job: EvaluationJob) -> bool:
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._counters["dropped"] += 1
+            self._active_ids.discard(job.answer_id)
+            # 未評価のまま残り、キューが空いてから積み直される
+            logger.warning("AI評価キューが一杯のため回答ID %d の評価を後回しにしました", job.answer_id)
+            return False
+        self._active_ids.add(job.answer_id)
+        self._counters["enqueued"] += 1
+        return True
+
+    async def _collect(self) -> List[EvaluationJob]:
+        """最初のジョブを待ち、時間窓の間に届いたジョブをまとめて取り出す"""
+        jobs = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_window
+        while len(jobs) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                jobs.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return jobs
+
+    async def _dispatch(self) -> None:
+        while True:
+            jobs = await self._collect()
+
+            groups: Dict[int, List[EvaluationJob]] = {}
+            for job in jobs:
+                groups.setdefault(job.topic_id, []).append(job)
+
+            for group in groups.values():
+                # 実行枠が空くまで待つ（その間に届いたジョブは次のバッチにまとまる）
+                await self._slots.acquire()
+                task = asyncio.create_task(self._run(group))
+                self._batch_tasks.add(task)
+                task.add_done_callback(self._batch_tasks.discard)
+
+            for _ in jobs:
+                self._queue.task_done()
+
+    async def _run(self, jobs: List[EvaluationJob]) -> None:
+        try:
+            await self._process(jobs)
+        except Exception:
+            logger.exception("AI評価ジョブの処理中に予期しないエラーが発生しました")
+        finally:
+            self._slots.release()
+
+    async def _process(self, jobs: List[EvaluationJob]) -> None:
+        now = time.monotonic()
+        self._attempts += len(jobs)
+        self._total_wait_seconds += sum(now - job.enqueued_at for job in jobs)
+        self._counters["batches"] += 1
+        self._in_flight += len(jobs)
+        try:
+            results, pending_ids = await _evaluate_and_save(
+                [job.answer_id for job in jobs], self.streaming, max(job.attempt for job in jobs)
+            )
+        except AICircuitOpen as e:
+            # 上流が回復するまで試行回数を消費せずに待つ
+            self._counters["deferred"] += len(jobs)
+            for job in jobs:
+                self._schedule(job, e.retry_after * (1 + random.random() * 0.5) + random.random(), job.attempt)
+            return
+        except AIProviderUnavailable:
+            # APIキーの設定などが直るまでは未評価のまま残す
+            self._release(jobs)
+            return
+        except Exception as e:
+            logger.warning("%d件の回答の評価に失敗しました: %s", len(jobs), e)
+            for job in jobs:
+                self._schedule_retry(job)
+            return
+        finally:
+            self._in_flight -= len(jobs)
+            self._total_run_seconds += (time.monotonic() - now) * len(jobs)
+
+        for result in results:
+            self._counters["processed"] += 1
+            ranking_index.update(result["topic_id"], result["answer_id"], ai_score=result["ai_score"])
+            publish_evaluation(**result)
+
+        # まとめて評価した際に結果が返らなかった回答はリトライする
+        for job in jobs:
+            if job.answer_id in pending_ids:
+                self._schedule_retry(job)
+            else:
+                self._active_ids.discard(job.answer_id)
+
+    def _release(self, jobs: List[EvaluationJob]) -> None:
+        for job in jobs:
+            self._active_ids.discard(job.answer_id)
+
+    def _schedule_retry(self, job: EvaluationJob) -> None:
+        if job.attempt >= self.max_retries:
+            # 未評価のまま残し、定期的な確認で改めて積み直す
+            self._counters["failed"] += 1
+            self._active_ids.discard(job.answer_id)
+            return
+        delay = self.retry_base_delay * (2 ** job.attempt) * (1 + random.random() * 0.1)
+        self._counters["retried"] += 1
+        self._schedule(job, delay, job.attempt + 1)
+
+    def _schedule(self, job: EvaluationJob, delay: float, attempt: int) -> None:
+        task = asyncio.create_task(self._retry_later(job, delay, attempt))
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    async def _retry_later(self, job: EvaluationJob, delay: float, attempt: int) -> None:
+        await asyncio.sleep(delay)
+        self._put(EvaluationJob(answer_id=job.answer_id, topic_id=job.topic_id, attempt=attempt))
+
+    async def sweep(self) -> int:
+        """未評価のまま残っている回答をDB上で確保してから積み直し、積んだ件数を返す
+
+        このプロセスで評価待ちの回答の確保は毎回延長する。AIを呼び出せない間やキューに空きがない間は積み直さない。
+        """
+        # このプロセスで評価待ちの回答を他のプロセスに積み直されないよう、確保を延長しておく
+        if self._active_ids:
+            await asyncio.to_thread(_renew_claims, list(self._active_ids))
+        if not ai_provider.available or ai_governor.is_open:
+            return 0
+        room = min(AI_PENDING_SWEEP_BATCH, self.max_size - self._queue.qsize() - len(self._retry_tasks))
+        if room <= 0:
+            return 0
+        pending = await asyncio.to_thread(_claim_pending, AI_PENDING_CLAIM_SECONDS, AI_PENDING_MAX_AGE_HOURS, room)
+        swept = sum(1 for answer_id, topic_id in pending if self.enqueue(answer_id, topic_id))
+        if swept:
+            self._counters["swept"] += swept
+            logger.info("未評価の回答を%d件キューに積み直しました", swept)
+        return swept
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("未評価の回答の確認中にエラーが発生しました")
+
+    def stats(self) -> Dict[str, Any]:
+        """キューの状態とメトリクス"""
+        attempts = self._attempts or 1
+        batches = self._counters["batches"] or 1
+        return {
+            "queue_depth": self._queue.qsize(),
+            "in_flight": self._in_flight,
+            "retry_scheduled": len(self._retry_tasks),
+            "active_answers": len(self._active_ids),
+            "concurrency": self.concurrency,
+            "max_size": self.max_size,
+            "batch_size": self.batch_size,
+            "streaming": self.streaming,
+            **self._counters,
+            "avg_wait_seconds": round(self._total_wait_seconds / attempts, 3),
+            "avg_run_seconds": round(self._total_run_seconds / attempts, 3),
+            "avg_batch_size": round(attempts / batches, 2),
+        }
+
+
+evaluation_queue = EvaluationQueue()
@@ -0,0 +1,99 @@
+import json
+import re
+from typing import Any, Dict, Optional, Tuple
+
+# スコアの値（後ろに数字以外の文字が来た時点で確定する）
+_SCORE = re.compile(r'"score"\s*:\s*"?(\d+)(?=[^\d])')
+# コメントの文字列の開始位置
+_COMMENT_START = re.compile(r'"comment"\s*:\s*"')
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class EvaluationStreamParser:
+    """ストリーミングで届く評価のJSON（{"score": 7, "comment": "..."}）を少しずつ解析する
+
+    feedにチャンクを渡すと、スコアが確定した時点でそのスコアを、
+    コメントについては新たに読めた部分の文字列を返す。キーの順番はどちらでもよい。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.score: Optional[int] = None
+        self.comment = ""
+        self._comment_pos: Optional[int] = None
+        self._comment_done = False
+
+    def feed(self, chunk: str) -> Tuple[Optional[int], str]:
+        """新しく確定したスコア（なければNone）とコメントの差分を返す"""
+        self.buffer += chunk
+
+        new_score = None
+        if self.score is None:
+            match = _SCORE.search(self.buffer)
+            if match:
+                self.score = new_score = int(match.group(1))
+
+        delta = ""
+        if self._comment_pos is None:
+            match = _COMMENT_START.search(self.buffer)
+            if match:
+                self._comment_pos = match.end()
+        if self._comment_pos is not None and not self._comment_done:
+            delta = self._decode_comment()
+            self.comment += delta
+        return new_score, delta
+
+    def _decode_comment(self) -> str:
+        """JSON文字列のエスケープを解きながら、読めるところまでコメントを読み進める"""
+        buffer = self.buffer
+        i = self._comment_pos
+        decoded = []
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self._comment_done = True
+                i += 1
+                break
+            if char != "\\":
+                decoded.append(char)
+                i += 1
+                continue
+            # エスケープシーケンスが途中で切れている場合は次のチャンクを待つ
+            if i + 1 >= len(buffer):
+                break
+            escape = buffer[i + 1]
+            if escape != "u":
+                decoded.append(_ESCAPES.get(escape, escape))
+                i += 2
+                continue
+            if i + 6 > len(buffer):
+                break
+            code = int(buffer[i + 2:i + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                # サロゲートペアは後半がそろってから1文字にする
+                if i + 12 > len(buffer):
+                    break
+                low = int(buffer[i + 8:i + 12], 16)
+                decoded.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                i += 12
+            else:
+                decoded.append(chr(code))
+                i += 6
+        self._comment_pos = i
+        return "".join(decoded)
+
+    def result(self) -> Dict[str, Any]:
+        """ストリームの終了後に評価全体を返す（JSONとして読めない場合は途中まで解析できた値を使う）"""
+        try:
+            evaluation = json.loads(self.buffer)
+            if isinstance(evaluation, dict):
+                return evaluation
+        except ValueError:
+            pass
+        if self.score is None:
+            match = re.search(r'"score"\s*:\s*"?(\d+)', self.buffer)
+            if match is None:
+                raise ValueError(f"評価を解析できませんでした: {self.buffer[:200]}")
+            self.score = int(match.group(1))
+        return {"score": self.score, "comment": self.comment or "評価できませんでした。"}
@@ -0,0 +1,213 @@
+"""分析用のデータの一括エクスポート
+
+お題・回答・投票の集計を1行ずつNDJSONまたはCSVに変換して返す。行はyield_per（PostgreSQLではサーバーサイドカーソル）で
+少しずつ読み出すため、件数によらずメモリ使用量は一定になる。APIのエンドポイントとexport_data.pyの両方から使う。
+"""
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from dotenv import load_dotenv
+from sqlalchemy import and_, func, select
+
+from app.database import SessionLocal
+from app.models.models import Answer, Topic, Vote
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+load_dotenv()
+
+# DBから一度に読み出す行数
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", "1000"))
+# 書き出す前にまとめるバイト数
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", "65536"))
+
+EXPORT_FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+def _answer_stats():
+    """お題ごとの回答数・投票数の合計"""
+    return select(
+        Answer.topic_id,
+        func.count(Answer.id).label("answer_count"),
+        func.coalesce(func.sum(Answer.vote_count), 0).label("vote_total"),
+    ).group_by(Answer.topic_id).subquery()
+
+
+def _topics_query(since: Optional[datetime], until: Optional[datetime], topic_ids: Sequence[int]):
+    stats = _answer_stats()
+    stmt = select(
+        Topic.id,
+        Topic.content,
+        Topic.created_at,
+        Topic.expires_at,
+        Topic.is_active,
+        func.coalesce(stats.c.answer_count, 0).label("answer_count"),
+        func.coalesce(stats.c.vote_total, 0).label("vote_total"),
+    ).outerjoin(stats, stats.c.topic_id == Topic.id).order_by(Topic.id)
+    if since is not None:
+        stmt = stmt.where(Topic.created_at >= since)
+    if until is not None:
+        stmt = stmt.where(Topic.created_at < until)
+    if topic_ids:
+        stmt = stmt.where(Topic.id.in_(topic_ids))
+    return stmt
+
+
+def _answers_query(since: Optional[datetime], until: Optional[datetime], topic_ids: Sequence[int]):
+    stmt = select(
+        Answer.id,
+        Answer.topic_id,
+        Answer.content,
+        Answer.user_name,
+        Answer.user_id,
+        Answer.created_at,
+        Answer.ai_score,
+        Answer.ai_comment,
+        Answer.duplicate_of_id,
+        Answer.vote_count,
+    ).order_by(Answer.id)
+    if since is not None:
+        stmt = stmt.where(Answer.created_at >= since)
+    if until is not None:
+        stmt = stmt.where(Answer.created_at < until)
+    if topic_ids:
+        stmt = stmt.where(Answer.topic_id.in_(topic_ids))
+    return stmt
+
+
+def _votes_query(since: Optional[datetime], until: Optional[datetime], topic_ids: Sequence[int]):
+    """回答ごとの投票の集計
+
+    vote_countはanswers.vote_count（アーカイブで個々の投票を削除した後も残る合計）、
+    recorded_votes以降はvotesテーブルに残っている投票の集計。期間を指定した場合はその期間の投票だけを数え、
+    期間内に投票のなかった回答は含めない。
+    """
+    vote_filter = [Vote.answer_id == Answer.id]
+    if since is not None:
+        vote_filter.append(Vote.created_at >= since)
+    if until is not None:
+        vote_filter.append(Vote.created_at < until)
+
+    recorded_votes = func.count(Vote.id)
+    stmt = select(
+        Answer.id.label("answer_id"),
+        Answer.topic_id,
+        Answer.vote_count,
+        recorded_votes.label("recorded_votes"),
+        func.count(func.distinct(Vote.user_id)).label("unique_voters"),
+        func.min(Vote.created_at).label("first_vote_at"),
+        func.max(Vote.created_at).label("last_vote_at"),
+    ).outerjoin(Vote, and_(*vote_filter))\
+        .group_by(Answer.id, Answer.topic_id, Answer.vote_count)\
+        .order_by(Answer.id)
+    if since is not None or until is not None:
+        stmt = stmt.having(recorded_votes > 0)
+    if topic_ids:
+        stmt = stmt.where(Answer.topic_id.in_(topic_ids))
+    return stmt
+
+
+EXPORT_DATASETS = {
+    "topics": _topics_query,
+    "answers": _answers_query,
+    "votes": _votes_query,
+}
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _ndjson_lines(rows: Iterator[Dict[str, Any]]) -> Iterator[bytes]:
+    for row in rows:
+        if orjson is not None:
+            yield orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE)
+        else:
+            yield (json.dumps(row, ensure_ascii=False, default=_json_default) + "\n").encode("utf-8")
+
+
+def _csv_lines(rows: Iterator[Dict[str, Any]], columns: List[str]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush() -> bytes:
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.writerow(columns)
+    yield flush()
+    for row in rows:
+        writer.writerow(["" if value is None else value.isoformat() if isinstance(value, datetime) else value for value in row.values()])
+        yield flush()
+
+
+def _chunked(lines: Iterator[bytes], chunk_bytes: int) -> Iterator[bytes]:
+    """小さな行をまとめて書き出す"""
+    parts = []
+    size = 0
+    for line in lines:
+        parts.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b"".join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield b"".join(parts)
+
+
+def _gzipped(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_rows(
+    dataset: str,
+    export_format: str = "ndjson",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    topic_ids: Sequence[int] = (),
+    gzip: bool = False,
+    yield_per: int = EXPORT_YIELD_PER,
+) -> Iterator[bytes]:
+    """データセットをNDJSONまたはCSVのバイト列として少しずつ返す（同期のジェネレーター）
+
+    ジェネレーターが閉じられるか最後まで読まれるとDBセッションを閉じる。
+    """
+    if dataset not in EXPORT_DATASETS:
+        raise ValueError(f"不明なデータセットです: {dataset}")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"不明な形式です: {export_format}")
+
+    stmt = EXPORT_DATASETS[dataset](since, until, list(topic_ids))
+    columns = [column.name for column in stmt.selected_columns]
+
+    def rows() -> Iterator[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            result = db.execute(stmt.execution_options(yield_per=yield_per))
+            for row in result:
+                yield dict(zip(columns, row))
+        finally:
+            db.close()
+
+    lines = _ndjson_lines(rows()) if export_format == "ndjson" else _csv_lines(rows(), columns)
+    chunks = _chunked(lines, EXPORT_CHUNK_BYTES)
+    return _gzipped(chunks) if gzip else chunks
@@ -0,0 +1,78 @@
+import os
+import socket
+import uuid
+from datetime import timedelta
+from typing import Optional
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models.models import Lease
+from app.services.topic_cache import utcnow
+
+# このプロセスを表すリースの保持者名
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaseLost(RuntimeError):
+    """処理の途中でリースを他のインスタンスに取られた"""
+
+
+def acquire_lease(name: str, ttl_seconds: float, holder: str = INSTANCE_ID) -> bool:
+    """リースを取得（自分が保持している場合は延長）できたらTrueを返す（ワーカースレッドで実行）
+
+    行がなければ挿入し、期限切れか自分の行であれば上書きする。取得の判定は1回のUPSERTで行うため、
+    複数のインスタンスが同時に呼んでも取得できるのは1つだけになる。
+    """
+    now = utcnow()
+    db = SessionLocal()
+    try:
+        insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+        stmt = insert(Lease).values(name=name, holder=holder, expires_at=now + timedelta(seconds=ttl_seconds))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Lease.name],
+            set_={"holder": stmt.excluded.holder, "expires_at": stmt.excluded.expires_at},
+            where=(Lease.expires_at < now) | (Lease.holder == holder),
+        )
+        acquired = db.execute(stmt).rowcount == 1
+        db.commit()
+        return acquired
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def hold_lease(db: Session, name: str, ttl_seconds: float, holder: str = INSTANCE_ID) -> None:
+    """呼び出し元のトランザクションの中で、リースを保持していることを確かめて延長する
+
+    保持していなければLeaseLostを送出する。UPDATEで行をロックするため、コミットするまで
+    他のインスタンスはリースを取得できない（SQLiteでは書き込みのトランザクション自体が直列になる）。
+    """
+    updated = db.query(Lease)\
+        .filter(Lease.name == name, Lease.holder == holder)\
+        .update({Lease.expires_at: utcnow() + timedelta(seconds=ttl_seconds)}, synchronize_session=False)
+    if updated != 1:
+        raise LeaseLost(f"リース {name} を他のインスタンスに取られました")
+
+
+def release_lease(name: str, holder: str = INSTANCE_ID) -> None:
+    """自分が保持しているリースを解放する（ワーカースレッドで実行）"""
+    db = SessionLocal()
+    try:
+        db.query(Lease).filter(Lease.name == name, Lease.holder == holder).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def lease_holder(name: str) -> Optional[str]:
+    """有効なリースの保持者を返す（なければNone。ワーカースレッドで実行）"""
+    db = SessionLocal()
+    try:
+        row = db.query(Lease.holder).filter(Lease.name == name, Lease.expires_at >= utcnow()).first()
+        return row.holder if row else None
+    finally:
+        db.close()
@@ -0,0 +1,181 @@
+import bisect
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+from app.models.models import Answer, Topic
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 総合ランキングでAIスコア1点を何票分として扱うか
+RANKING_AI_SCORE_WEIGHT = float(os.getenv("RANKING_AI_SCORE_WEIGHT", "1.0"))
+# 終了したお題のランキングをメモリに残す最大件数（超えたら最後に参照された時刻が古いものから破棄する）
+RANKING_MAX_INACTIVE_TOPICS = int(os.getenv("RANKING_MAX_INACTIVE_TOPICS", "16"))
+
+# ランキングの種類（投票数順・AIスコア順・総合）
+RANKING_ORDERS = ("votes", "score", "combined")
+
+
+class TopicRanking:
+    """1つのお題の回答ランキング
+
+    並び順ごとにソート済みのキー配列を保持し、更新時はbisectで該当位置だけを入れ替える。
+    1位の判定はO(1)、位置の探索はO(log n)で行える。
+    """
+
+    def __init__(self, ai_score_weight: float = RANKING_AI_SCORE_WEIGHT):
+        self.ai_score_weight = ai_score_weight
+        self._entries: Dict[int, Tuple[int, Optional[int]]] = {}
+        self._sorted: Dict[str, List[tuple]] = {order: [] for order in RANKING_ORDERS}
+
+    def _keys(self, answer_id: int, votes: int, score: Optional[int]) -> Dict[str, tuple]:
+        # 同点の場合は先に投稿された回答（IDが小さい方）を上位にする
+        score_value = score or 0
+        return {
+            "votes": (-votes, answer_id),
+            "score": (-score_value, -votes, answer_id),
+            "combined": (-(votes + score_value * self.ai_score_weight), answer_id),
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, answer_id: int) -> Optional[Tuple[int, Optional[int]]]:
+        return self._entries.get(answer_id)
+
+    def upsert(self, answer_id: int, votes: int, score: Optional[int]) -> None:
+        self.remove(answer_id)
+        self._entries[answer_id] = (votes, score)
+        for order, key in self._keys(answer_id, votes, score).items():
+            bisect.insort(self._sorted[order], key)
+
+    def remove(self, answer_id: int) -> None:
+        entry = self._entries.pop(answer_id, None)
+        if entry is None:
+            return
+        for order, key in self._keys(answer_id, *entry).items():
+            keys = self._sorted[order]
+            index = bisect.bisect_left(keys, key)
+            if index < len(keys) and keys[index] == key:
+                keys.pop(index)
+
+    def top(self, order: str, k: int) -> List[int]:
+        return [key[-1] for key in self._sorted[order][:k]]
+
+    def leader(self, order: str = "votes") -> Optional[int]:
+        keys = self._sorted[order]
+        return keys[0][-1] if keys else None
+
+
+class RankingIndex:
+    """お題ごとのランキングをプロセス内に保持するインデックス
+
+    投票・AI評価のたびに差分更新し、未ロードのお題は初回アクセス時にDBから構築する。
+    アクティブなお題（起動時と切り替え時に読み込んだもの）は常に保持し、過去のお題の一覧を
+    参照して読み込んだランキングはLRUでRANKING_MAX_INACTIVE_TOPICS件までに抑える。
+    """
+
+    def __init__(self, max_inactive_topics: int = RANKING_MAX_INACTIVE_TOPICS):
+        self.max_inactive_topics = max(0, max_inactive_topics)
+        # 参照の古い順に並べたランキング
+        self._topics: "OrderedDict[int, TopicRanking]" = OrderedDict()
+        # LRUで破棄しないアクティブなお題
+        self._pinned: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def load_topic(self, db: Session, topic_id: int, pin: bool = False) -> TopicRanking:
+        """DBからお題のランキングを構築し直す（pin=Trueの場合はdrop_topicまで破棄しない）"""
+        rows = db.query(Answer.id, Answer.vote_count, Answer.ai_score)\
+            .filter(Answer.topic_id == topic_id)\
+            .all()
+        ranking = TopicRanking()
+        for answer_id, vote_count, ai_score in rows:
+            ranking.upsert(answer_id, vote_count or 0, ai_score)
+        with self._lock:
+            self._topics[topic_id] = ranking
+            self._topics.move_to_end(topic_id)
+            if pin:
+                self._pinned.add(topic_id)
+            self._evict()
+        return ranking
+
+    def _evict(self) -> None:
+        """アクティブでないお題のランキングを上限まで古いものから破棄する（ロックを持って呼ぶ）"""
+        inactive = [topic_id for topic_id in self._topics if topic_id not in self._pinned]
+        for topic_id in inactive[:max(0, len(inactive) - self.max_inactive_topics)]:
+            del self._topics[topic_id]
+
+    def _ranking(self, db: Session, topic_id: int) -> TopicRanking:
+        """お題のランキングを返す（未ロードならDBから読み込む）"""
+        with self._lock:
+            ranking = self._topics.get(topic_id)
+            if ranking is not None:
+                self._topics.move_to_end(topic_id)
+                return ranking
+        return self.load_topic(db, topic_id)
+
+    def is_loaded(self, topic_id: int) -> bool:
+        with self._lock:
+            return topic_id in self._topics
+
+    def ensure_topic(self, db: Session, topic_id: int) -> None:
+        self._ranking(db, topic_id)
+
+    def rebuild(self, db: Session) -> None:
+        """起動時にアクティブなお題のランキングを構築する"""
+        topic_ids = [topic_id for (topic_id,) in db.query(Topic.id).filter(Topic.is_active == True).all()]
+        for topic_id in topic_ids:
+            self.load_topic(db, topic_id, pin=True)
+        logger.info("ランキングを構築しました（お題 %d件）", len(topic_ids))
+
+    def drop_topic(self, topic_id: int) -> None:
+        with self._lock:
+            self._topics.pop(topic_id, None)
+            self._pinned.discard(topic_id)
+
+    def update(self, topic_id: int, answer_id: int, vote_count: Optional[int] = None, ai_score: Optional[int] = None) -> None:
+        """回答の投票数・AIスコアを反映する（未ロードのお題は次回アクセス時にDBから読む）"""
+        with self._lock:
+            ranking = self._topics.get(topic_id)
+            if ranking is None:
+                return
+            votes, score = ranking.get(answer_id) or (0, None)
+            ranking.upsert(
+                answer_id,
+                votes if vote_count is None else vote_count,
+                score if ai_score is None else ai_score,
+            )
+
+    def update_votes(self, topic_id: int, answer_id: int, vote_count: int) -> bool:
+        """投票数を反映し、この更新で投票数1位になったかどうかを返す"""
+        with self._lock:
+            ranking = self._topics.get(topic_id)
+            if ranking is None:
+                return False
+            previous_leader = ranking.leader("votes")
+            _, score = ranking.get(answer_id) or (0, None)
+            ranking.upsert(answer_id, vote_count, score)
+            return previous_leader != answer_id and ranking.leader("votes") == answer_id
+
+    def top(self, db: Session, topic_id: int, k: int, order: str = "votes") -> List[int]:
+        ranking = self._ranking(db, topic_id)
+        with self._lock:
+            return ranking.top(order, k)
+
+    def leader(self, db: Session, topic_id: int, order: str = "votes") -> Optional[int]:
+        ranking = self._ranking(db, topic_id)
+        with self._lock:
+            return ranking.leader(order)
+
+    def is_leader(self, db: Session, topic_id: int, answer_id: int, order: str = "votes") -> bool:
+        return self.leader(db, topic_id, order) == answer_id
+
+
+ranking_index = RankingIndex()
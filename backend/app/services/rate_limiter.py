@@ -0,0 +1,208 @@
+import heapq
+import ipaddress
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# レート制限のバックエンド（memory: プロセス内, redis: 複数ワーカーで共有）
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# 「回数/秒数」形式の制限ルール
+RATE_LIMIT_ANSWERS = os.getenv("RATE_LIMIT_ANSWERS", "1/60")
+RATE_LIMIT_VOTES = os.getenv("RATE_LIMIT_VOTES", "30/60")
+RATE_LIMIT_TOPIC_GENERATION = os.getenv("RATE_LIMIT_TOPIC_GENERATION", "3/60")
+
+# X-Real-IP / X-Forwarded-Forを信頼するプロキシのIPアドレス・ネットワーク（カンマ区切り）
+TRUSTED_PROXIES = os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1")
+
+# プロセス内バックエンドで期限切れのキーを掃除する間隔（秒）
+RATE_LIMIT_SWEEP_SECONDS = float(os.getenv("RATE_LIMIT_SWEEP_SECONDS", "5"))
+
+
+def parse_rule(rule: str) -> Tuple[int, float]:
+    """「回数/秒数」形式のルールを(回数, 秒数)に変換する"""
+    limit, window = rule.split("/", 1)
+    return int(limit), float(window)
+
+
+class InMemorySlidingWindowBackend:
+    """プロセス内のスライディングウィンドウ（キーごとに受け付けた時刻とウィンドウの秒数を保持）
+
+    期限切れのキーは、期限の早い順に並べたヒープを使ってsweep_seconds秒ごとにまとめて削除する。
+    各キーは自身のウィンドウで期限を判定するため、ウィンドウの違う制限の記録を消すことはない。
+    """
+
+    def __init__(self, sweep_seconds: float = RATE_LIMIT_SWEEP_SECONDS):
+        self.sweep_seconds = sweep_seconds
+        self._hits: Dict[str, Tuple[Deque[float], float]] = {}
+        # (期限, キー)のヒープ。受け付けるたびに追加し、古い要素は掃除の際に読み飛ばす
+        self._expiry: List[Tuple[float, str]] = []
+        self._next_sweep = time.monotonic() + sweep_seconds
+        self._lock = threading.Lock()
+
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        """受け付けた場合は0、制限中の場合は再試行までの秒数を返す"""
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            entry = self._hits.get(key)
+            if entry is None:
+                entry = self._hits[key] = (deque(), window)
+            hits = entry[0]
+            while hits and hits[0] <= now - window:
+                hits.popleft()
+            if len(hits) >= limit:
+                return hits[0] + window - now
+            hits.append(now)
+            heapq.heappush(self._expiry, (now + window, key))
+            return 0.0
+
+    def _sweep(self, now: float) -> None:
+        """期限を過ぎたキーを削除する（ロックを持って呼ぶ）"""
+        self._next_sweep = now + self.sweep_seconds
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            _, key = heapq.heappop(expiry)
+            entry = self._hits.get(key)
+            if entry is not None and (not entry[0] or entry[0][-1] + entry[1] <= now):
+                del self._hits[key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._hits)
+
+
+class RedisSlidingWindowBackend:
+    """Redisのソート済みセットを使ったスライディングウィンドウ（複数ワーカーで共有）"""
+
+    # 期限切れの記録を消し、上限未満なら記録して0、上限なら再試行までのミリ秒を返す
+    SCRIPT = """
+    local key = KEYS[1]
+    local now = tonumber(ARGV[1])
+    local window = tonumber(ARGV[2])
+    local limit = tonumber(ARGV[3])
+    redis.call('ZREMRANGEBYSCORE', key, 0, now - window)
+    if redis.call('ZCARD', key) >= limit then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        return tonumber(oldest[2]) + window - now
+    end
+    redis.call('ZADD', key, now, ARGV[4])
+    redis.call('PEXPIRE', key, window)
+    return 0
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(self.SCRIPT)
+
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        now_ms = int(time.time() * 1000)
+        retry_after_ms = await self._script(
+            keys=[f"ratelimit:{key}"],
+            args=[now_ms, int(window * 1000), limit, f"{now_ms}-{uuid.uuid4().hex}"],
+        )
+        return max(0.0, int(retry_after_ms) / 1000)
+
+
+def create_backend(name: str = RATE_LIMIT_BACKEND):
+    if name == "redis":
+        try:
+            return RedisSlidingWindowBackend(REDIS_URL)
+        except ImportError:
+            logger.error("redisパッケージがインストールされていないため、プロセス内のレート制限を使用します。")
+    return InMemorySlidingWindowBackend()
+
+
+backend = create_backend()
+
+
+class RateLimiter:
+    """名前付きのレート制限（例: 回答は1分に1回）"""
+
+    def __init__(self, name: str, rule: str, detail: Optional[str] = None):
+        self.name = name
+        self.limit, self.window = parse_rule(rule)
+        self.detail = detail or "リクエストが多すぎます。少し待ってからお試しください。"
+
+    async def hit(self, identifier: str) -> float:
+        """受け付けた場合は0、制限中の場合は再試行までの秒数を返す"""
+        return await backend.hit(f"{self.name}:{identifier}", self.limit, self.window)
+
+    async def check(self, identifier: str) -> None:
+        """制限を超えていれば429を返す"""
+        retry_after = await self.hit(identifier)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=429,
+                detail=self.detail,
+                headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+            )
+
+
+def parse_networks(value: str) -> List[Union[ipaddress.IPv4Network, ipaddress.IPv6Network]]:
+    """カンマ区切りのIPアドレス・ネットワークを変換する"""
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in value.split(",") if item.strip()]
+
+
+_trusted_proxies = parse_networks(TRUSTED_PROXIES)
+
+
+def _is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in _trusted_proxies)
+
+
+def client_ip(request: Request) -> str:
+    """プロキシ経由の場合も考慮したクライアントIP
+
+    転送ヘッダーは接続元が信頼するプロキシ（TRUSTED_PROXIES）の場合だけ使う。X-Forwarded-Forの先頭は
+    クライアントが自由に書き換えられるため、プロキシが設定するX-Real-IPを優先し、なければX-Forwarded-Forを
+    右（プロキシが追加した側）からたどって最初の信頼しないアドレスを使う。
+    """
+    host = request.client.host if request.client else "unknown"
+    if not _is_trusted_proxy(host):
+        return host
+
+    real_ip = request.headers.get("x-real-ip", "").strip()
+    if real_ip:
+        return real_ip
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else host
+
+
+answer_limiter = RateLimiter(
+    "answers",
+    RATE_LIMIT_ANSWERS,
+    "1分間に1回しか回答できません。少し待ってからお試しください。",
+)
+vote_limiter = RateLimiter(
+    "votes",
+    RATE_LIMIT_VOTES,
+    "投票が多すぎます。少し待ってからお試しください。",
+)
+topic_generation_limiter = RateLimiter(
+    "topic_generation",
+    RATE_LIMIT_TOPIC_GENERATION,
+    "お題の生成リクエストが多すぎます。少し待ってからお試しください。",
+)
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import logging
+import threading
+from typing import Any, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 購読者ごとのキューの上限（遅いクライアントでメモリを使い切らないようにする）
+SUBSCRIBER_QUEUE_SIZE = 100
+# SSEのキープアライブ間隔（秒）
+STREAM_KEEPALIVE_SECONDS = 15
+
+
+def topic_channel(topic_id: int) -> str:
+    """お題ごとのチャンネル名"""
+    return f"topic:{topic_id}"
+
+
+def answer_channel(answer_id: int) -> str:
+    """回答ごとのチャンネル名（AI評価のストリーミング用）"""
+    return f"answer:{answer_id}"
+
+
+def encode_event(event: Dict[str, Any]) -> str:
+    """イベントをJSON文字列に変換する"""
+    return json.dumps(event, ensure_ascii=False, default=str)
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """イベントをServer-Sent Events形式の文字列に変換する"""
+    return f"event: {event.get('type', 'message')}\ndata: {encode_event(event)}\n\n"
+
+
+class BroadcastHub:
+    """プロセス内のPub/Subハブ
+
+    チャンネルごとに購読者のasyncio.Queueを保持し、publishされたイベントを
+    全購読者へ配信する。キューが溢れた購読者のイベントは捨てる（クライアントは再取得で追いつく）。
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._subscribers.setdefault(channel, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, channel: str, queue: asyncio.Queue) -> None:
+        with self._lock:
+            queues = self._subscribers.get(channel)
+            if not queues:
+                return
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[channel]
+
+    def subscriber_count(self, channel: str) -> int:
+        with self._lock:
+            return len(self._subscribers.get(channel, ()))
+
+    def publish(self, channel: str, event: Dict[str, Any]) -> None:
+        """イベントを配信する（スレッドからも呼び出し可能）"""
+        with self._lock:
+            queues = list(self._subscribers.get(channel, ()))
+            loop = self._loop
+        if not queues or loop is None:
+            return
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is loop:
+            self._deliver(queues, event)
+        elif not loop.is_closed():
+            loop.call_soon_threadsafe(self._deliver, queues, event)
+
+    @staticmethod
+    def _deliver(queues, event: Dict[str, Any]) -> None:
+        for queue in queues:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.warning("購読者のキューが一杯のためイベントを破棄しました: %s", event.get("type"))
+
+
+hub = BroadcastHub()
+
+
+def publish_topic_event(topic_id: int, event_type: str, **payload: Any) -> None:
+    """お題チャンネルに差分イベントを配信する"""
+    hub.publish(topic_channel(topic_id), {"type": event_type, "topic_id": topic_id, **payload})
+
+
+def publish_answer_event(answer_id: int, event_type: str, **payload: Any) -> None:
+    """回答チャンネルにイベントを配信する"""
+    hub.publish(answer_channel(answer_id), {"type": event_type, "answer_id": answer_id, **payload})
+
+
+def publish_evaluation(topic_id: int, answer_id: int, ai_score: Optional[int], ai_comment: Optional[str]) -> None:
+    """AI評価の結果をお題チャンネルと回答チャンネルに配信する"""
+    event = {
+        "type": "answer_evaluated",
+        "topic_id": topic_id,
+        "answer_id": answer_id,
+        "ai_score": ai_score,
+        "ai_comment": ai_comment,
+    }
+    hub.publish(topic_channel(topic_id), event)
+    hub.publish(answer_channel(answer_id), event)
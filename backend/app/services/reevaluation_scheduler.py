@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.database import SessionLocal
+from app.models.models import Answer, Topic
+from app.services.ai_governor import AICircuitOpen
+from app.services.ai_service import reevaluate_popular_answer
+from app.services.evaluation_queue import store_evaluation
+from app.services.ranking import ranking_index
+from app.services.realtime import publish_evaluation
+from app.services.topic_cache import utcnow
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 人気回答を再評価する投票数の節目（カンマ区切り）
+REEVALUATION_MILESTONES = sorted(
+    int(value) for value in os.getenv("REEVALUATION_MILESTONES", "5,10,25,50").split(",") if value.strip()
+)
+# 再評価のトリガーをまとめる待ち時間（秒）
+REEVALUATION_DEBOUNCE_SECONDS = float(os.getenv("REEVALUATION_DEBOUNCE_SECONDS", "10"))
+# 同時に実行する再評価の数
+REEVALUATION_CONCURRENCY = int(os.getenv("REEVALUATION_CONCURRENCY", "2"))
+
+
+def _load_answer(answer_id: int) -> Optional[Tuple[str, str]]:
+    """再評価するお題と回答の内容を読み込む（ワーカースレッドで実行）"""
+    db = SessionLocal()
+    try:
+        answer = db.query(Answer).filter(Answer.id == answer_id).first()
+        if not answer:
+            return None
+        topic = db.query(Topic).filter(Topic.id == answer.topic_id).first()
+        return topic.content, answer.content
+    finally:
+        db.close()
+
+
+def _save_evaluation(answer_id: int, evaluation: Dict[str, Any], requested_at: datetime) -> Optional[Tuple[int, int, str]]:
+    """再評価の結果を保存する（ワーカースレッドで実行）
+
+    再評価中により新しい評価が保存された場合は上書きせずにNoneを返す。
+    """
+    db = SessionLocal()
+    try:
+        topic_id = db.query(Answer.topic_id).filter(Answer.id == answer_id).scalar()
+        if topic_id is None or not store_evaluation(db, answer_id, evaluation, requested_at):
+            return None
+        db.commit()
+
+        return topic_id, evaluation["score"], evaluation["comment"]
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def _reevaluate_and_save(answer_id: int, vote_count: int) -> Optional[Tuple[int, int, str]]:
+    """人気回答のAI再評価を実行して保存する（再評価できなかった場合は例外を送出し、元の評価を残す）"""
+    requested_at = utcnow()
+    loaded = await asyncio.to_thread(_load_answer, answer_id)
+    if loaded is None:
+        return None
+    topic_content, answer_content = loaded
+    evaluation = await reevaluate_popular_answer(topic_content, answer_content, vote_count, raise_errors=True)
+    return await asyncio.to_thread(_save_evaluation, answer_id, evaluation, requested_at)
+
+
+class ReevaluationScheduler:
+    """人気回答の再評価スケジューラ
+
+    投票数が節目を越えたとき、または回答が新たに1位になったときだけ再評価を予約する。
+    同じ回答へのトリガーはデバウンス期間の間まとめられ、リクエストとは別のタスクで1回だけ実行される。
+    """
+
+    def __init__(
+        self,
+        milestones: List[int] = REEVALUATION_MILESTONES,
+        debounce_seconds: float = REEVALUATION_DEBOUNCE_SECONDS,
+        concurrency: int = REEVALUATION_CONCURRENCY,
+    ):
+        self.milestones = milestones
+        self.debounce_seconds = debounce_seconds
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        # 回答ID -> 予約時点の最新の投票数
+        self._pending: Dict[int, int] = {}
+        self._tasks = set()
+        self._stats = {"triggers": 0, "coalesced": 0, "runs": 0, "failures": 0, "skipped": 0}
+
+    def should_reevaluate(self, previous_count: int, vote_count: int, became_leader: bool) -> bool:
+        if any(previous_count < milestone <= vote_count for milestone in self.milestones):
+            return True
+        return became_leader and bool(self.milestones) and vote_count >= self.milestones[0]
+
+    def notify(self, answer_id: int, previous_count: int, vote_count: int, became_leader: bool) -> None:
+        """投票数の変化を受け取り、必要なら再評価を予約する"""
+        if not self.should_reevaluate(previous_count, vote_count, became_leader):
+            return
+
+        self._stats["triggers"] += 1
+        if answer_id in self._pending:
+            # デバウンス中のトリガーは最新の投票数だけを残してまとめる
+            self._stats["coalesced"] += 1
+            self._pending[answer_id] = max(self._pending[answer_id], vote_count)
+            return
+
+        self._pending[answer_id] = vote_count
+        task = asyncio.create_task(self._run_after_debounce(answer_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_after_debounce(self, answer_id: int) -> None:
+        await asyncio.sleep(self.debounce_seconds)
+        vote_count = self._pending.pop(answer_id)
+
+        async with self._slots:
+            self._stats["runs"] += 1
+            try:
+                result = await _reevaluate_and_save(answer_id, vote_count)
+            except AICircuitOpen:
+                # 再評価は必須ではないため、AI呼び出しが止まっている間は見送る
+                self._stats["skipped"] += 1
+                logger.info("AI呼び出しが停止中のため回答ID %d の再評価を見送りました", answer_id)
+                return
+            except Exception:
+                self._stats["failures"] += 1
+                logger.exception("回答ID %d の再評価に失敗しました", answer_id)
+                return
+
+        if result is None:
+            return
+        topic_id, ai_score, ai_comment = result
+        ranking_index.update(topic_id, answer_id, ai_score=ai_score)
+        publish_evaluation(topic_id, answer_id, ai_score, ai_comment)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._pending.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "milestones": self.milestones,
+            "debounce_seconds": self.debounce_seconds,
+            "pending": len(self._pending),
+            **self._stats,
+        }
+
+
+reevaluation_scheduler = ReevaluationScheduler()
@@ -0,0 +1,199 @@
+import logging
+import os
+import random
+import threading
+import unicodedata
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+from app.models.models import Answer
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# ほぼ同じ回答の評価を再利用するかどうか
+SIMILARITY_ENABLED = os.getenv("SIMILARITY_ENABLED", "true").lower() == "true"
+# ほぼ同じとみなす類似度（文字n-gramの集合のJaccard係数）
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.85"))
+# 比較に使う文字n-gramの長さ
+SIMILARITY_NGRAM = int(os.getenv("SIMILARITY_NGRAM", "3"))
+
+# MinHashの署名の長さと、LSHのバンド数（1バンドあたりの行数 = 署名の長さ / バンド数）
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+_ROWS_PER_BAND = MINHASH_PERMUTATIONS // LSH_BANDS
+
+# 各ハッシュ関数はn-gramのハッシュ値と乱数のマスクの排他的論理和で表す（プロセス内で固定）
+_MASKS = [random.Random(seed).getrandbits(63) for seed in range(MINHASH_PERMUTATIONS)]
+
+# カタカナ → ひらがな（ァ〜ヶ）
+_KANA_FOLD = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+def normalize_for_similarity(text: str) -> str:
+    """表記ゆれを吸収した比較用の文字列にする
+
+    NFKCで全角・半角をそろえ、カタカナをひらがなに寄せ、空白・句読点・記号を取り除く。
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower().translate(_KANA_FOLD)
+    return "".join(char for char in text if unicodedata.category(char)[0] not in ("P", "S", "Z", "C"))
+
+
+def shingles(text: str, n: int = SIMILARITY_NGRAM) -> FrozenSet[str]:
+    """正規化した文字列の文字n-gramの集合（n文字未満の場合は文字列全体を1要素とする）"""
+    normalized = normalize_for_similarity(text)
+    if len(normalized) <= n:
+        return frozenset([normalized]) if normalized else frozenset()
+    return frozenset(normalized[i:i + n] for i in range(len(normalized) - n + 1))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def minhash(grams: FrozenSet[str]) -> Tuple[int, ...]:
+    hashes = [hash(gram) for gram in grams]
+    return tuple(min(value ^ mask for value in hashes) for mask in _MASKS)
+
+
+def _bands(signature: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+    return [signature[i:i + _ROWS_PER_BAND] for i in range(0, MINHASH_PERMUTATIONS, _ROWS_PER_BAND)]
+
+
+class TopicSimilarityIndex:
+    """1つのお題の評価済みの回答をMinHash/LSHで引けるようにしたインデックス
+
+    LSHのバケットで候補を絞り込み、候補だけn-gram集合のJaccard係数で確かめる。
+    """
+
+    def __init__(self):
+        # 回答ID -> (n-gram集合, 評価)
+        self._entries: Dict[int, Tuple[FrozenSet[str], Dict[str, Any]]] = {}
+        # バンドごとのバケット（バンドの値 -> 回答IDのリスト）
+        self._buckets: List[Dict[Tuple[int, ...], List[int]]] = [{} for _ in range(LSH_BANDS)]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, answer_id: int, grams: FrozenSet[str], evaluation: Dict[str, Any]) -> None:
+        if not grams or answer_id in self._entries:
+            return
+        self._entries[answer_id] = (grams, evaluation)
+        for buckets, band in zip(self._buckets, _bands(minhash(grams))):
+            buckets.setdefault(band, []).append(answer_id)
+
+    def find(self, grams: FrozenSet[str], threshold: float) -> Optional[Tuple[int, float]]:
+        """類似度がthreshold以上で最も近い回答の(回答ID, 類似度)を返す"""
+        if not grams:
+            return None
+        candidates = set()
+        for buckets, band in zip(self._buckets, _bands(minhash(grams))):
+            candidates.update(buckets.get(band, ()))
+
+        best = None
+        for answer_id in candidates:
+            similarity = jaccard(grams, self._entries[answer_id][0])
+            if similarity >= threshold and (best is None or (similarity, -answer_id) > (best[1], -best[0])):
+                best = (answer_id, similarity)
+        return best
+
+    def evaluation(self, answer_id: int) -> Dict[str, Any]:
+        return dict(self._entries[answer_id][1])
+
+
+class SimilarityIndex:
+    """お題ごとのほぼ同じ回答のインデックスをプロセス内に保持する
+
+    AIで評価した回答（他の回答の評価を再利用していないもの）だけを登録し、
+    新しい回答の評価前に、登録済みの回答とほぼ同じかを調べる。未ロードのお題は初回の検索時にDBから構築する。
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, enabled: bool = SIMILARITY_ENABLED):
+        self.threshold = threshold
+        self.enabled = enabled
+        self._topics: Dict[int, TopicSimilarityIndex] = {}
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "matches": 0, "batch_matches": 0}
+
+    def load_topic(self, db: Session, topic_id: int) -> TopicSimilarityIndex:
+        """DBからお題のインデックスを構築し直す"""
+        rows = db.query(Answer.id, Answer.content, Answer.ai_score, Answer.ai_comment)\
+            .filter(Answer.topic_id == topic_id, Answer.ai_score.isnot(None), Answer.duplicate_of_id.is_(None))\
+            .all()
+        index = TopicSimilarityIndex()
+        for answer_id, content, ai_score, ai_comment in rows:
+            index.add(answer_id, shingles(content), {"score": ai_score, "comment": ai_comment})
+        with self._lock:
+            self._topics[topic_id] = index
+        return index
+
+    def _topic(self, db: Session, topic_id: int) -> TopicSimilarityIndex:
+        with self._lock:
+            index = self._topics.get(topic_id)
+        return index if index is not None else self.load_topic(db, topic_id)
+
+    def drop_topic(self, topic_id: int) -> None:
+        with self._lock:
+            self._topics.pop(topic_id, None)
+
+    def find_duplicates(self, db: Session, topic_id: int, answers: List[Tuple[int, str]]) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, int]]:
+        """評価前の(回答ID, 回答内容)のリストから、ほぼ同じ回答を探す
+
+        登録済みの回答とほぼ同じ回答については、その評価に元の回答ID（duplicate_of）を付けて返す。
+        残りの回答どうしでほぼ同じものは、先の回答を代表にした{回答ID: 代表の回答ID}として返す
+        （代表だけをAIで評価し、その評価を使い回す）。
+        """
+        if not self.enabled or not answers:
+            return {}, {}
+
+        index = self._topic(db, topic_id)
+        duplicates: Dict[int, Dict[str, Any]] = {}
+        representatives: List[Tuple[int, FrozenSet[str]]] = []
+        same_as: Dict[int, int] = {}
+        with self._lock:
+            for answer_id, content in answers:
+                self._stats["lookups"] += 1
+                grams = shingles(content)
+                match = index.find(grams, self.threshold)
+                if match is not None:
+                    original_id, similarity = match
+                    duplicates[answer_id] = {**index.evaluation(original_id), "duplicate_of": original_id}
+                    self._stats["matches"] += 1
+                    logger.debug("回答ID %d は回答ID %d とほぼ同じです（類似度 %.2f）", answer_id, original_id, similarity)
+                    continue
+                representative = next(
+                    (rep_id for rep_id, rep_grams in representatives if jaccard(grams, rep_grams) >= self.threshold), None
+                )
+                if representative is not None:
+                    same_as[answer_id] = representative
+                    self._stats["batch_matches"] += 1
+                elif grams:
+                    representatives.append((answer_id, grams))
+        return duplicates, same_as
+
+    def add(self, topic_id: int, answer_id: int, content: str, evaluation: Dict[str, Any]) -> None:
+        """AIで評価した回答を登録する（未ロードのお題は次回の検索時にDBから読む）"""
+        if not self.enabled:
+            return
+        with self._lock:
+            index = self._topics.get(topic_id)
+            if index is not None:
+                index.add(answer_id, shingles(content), {"score": evaluation["score"], "comment": evaluation["comment"]})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "topics": len(self._topics),
+                "indexed_answers": sum(len(index) for index in self._topics.values()),
+                **self._stats,
+            }
+
+
+similarity_index = SimilarityIndex()
@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+from app.models.models import Topic
+from app.schemas.schemas import TopicResponse
+
+load_dotenv()
+
+# 他のワーカーでお題が切り替わった場合に備えて、キャッシュを再確認する間隔（秒）
+ACTIVE_TOPIC_CACHE_TTL = float(os.getenv("ACTIVE_TOPIC_CACHE_TTL", "30"))
+# アクティブなお題がない場合に、DBを再確認するまでの間隔（秒）
+ACTIVE_TOPIC_NEGATIVE_TTL = float(os.getenv("ACTIVE_TOPIC_NEGATIVE_TTL", "5"))
+
+
+def utcnow() -> datetime:
+    """DBのexpires_atと比較するためのタイムゾーンなしUTC時刻"""
+    return datetime.utcnow()
+
+
+class ActiveTopicCache:
+    """現在アクティブなお題のプロセス内キャッシュ
+
+    お題の有効期限（expires_at）を過ぎると自動的に無効になり、
+    お題の生成時にはinvalidate()で即座に破棄される。
+    """
+
+    def __init__(self, ttl: float = ACTIVE_TOPIC_CACHE_TTL, negative_ttl: float = ACTIVE_TOPIC_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._topic: Optional[Dict[str, Any]] = None
+        self._expires_at: Optional[datetime] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, db: Session) -> Optional[Dict[str, Any]]:
+        """アクティブなお題を返す。キャッシュが無効な場合だけDBを1回参照する"""
+        now = utcnow()
+        with self._lock:
+            age = time.monotonic() - self._checked_at
+            if self._topic is not None:
+                if self._expires_at > now and age < self.ttl:
+                    return self._topic
+            elif age < self.negative_ttl:
+                return None
+
+        topic = db.query(Topic).filter(
+            Topic.is_active == True,
+            Topic.expires_at > now
+        ).order_by(Topic.created_at.desc()).first()
+
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if topic is None:
+                self._topic = None
+                self._expires_at = None
+            else:
+                self._topic = TopicResponse.model_validate(topic).model_dump()
+                self._expires_at = topic.expires_at
+            return self._topic
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._topic = None
+            self._expires_at = None
+            self._checked_at = 0.0
+
+
+def topic_etag(topic: Dict[str, Any]) -> str:
+    """お題のIDと有効期限から作るETag"""
+    expires_at = topic["expires_at"]
+    return f'"topic-{topic["id"]}-{int(expires_at.timestamp()) if expires_at else 0}"'
+
+
+active_topic_cache = ActiveTopicCache()
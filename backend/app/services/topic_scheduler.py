@@ -0,0 +1,310 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.database import SessionLocal
+from app.models.models import Topic
+from app.services.ai_service import generate_topic
+from app.services.leases import acquire_lease, hold_lease, lease_holder, release_lease
+from app.services.ranking import ranking_index
+from app.services.realtime import publish_topic_event
+from app.services.similarity import similarity_index
+from app.services.topic_cache import active_topic_cache, utcnow
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# お題を切り替える間隔（時間）
+TOPIC_ROTATION_HOURS = float(os.getenv("TOPIC_ROTATION_HOURS", "4"))
+# 有効期限の何分前から次のお題を先に生成しておくか
+TOPIC_PREGENERATE_MINUTES = float(os.getenv("TOPIC_PREGENERATE_MINUTES", "10"))
+# 先に生成しておくお題の数（0の場合は切り替え時に生成する）
+TOPIC_BUFFER_SIZE = int(os.getenv("TOPIC_BUFFER_SIZE", "1"))
+# 生成や切り替えに失敗したときに再試行するまでの秒数
+TOPIC_SCHEDULER_RETRY_SECONDS = float(os.getenv("TOPIC_SCHEDULER_RETRY_SECONDS", "30"))
+# スケジューラを起動するかどうか（複数ワーカーで動かす場合は1つだけ有効にする）
+TOPIC_SCHEDULER_ENABLED = os.getenv("TOPIC_SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+# お題の切り替え中に保持するリースの秒数（切り替え中のインスタンスが落ちた場合はこの秒数で解放される）
+TOPIC_LEASE_SECONDS = float(os.getenv("TOPIC_LEASE_SECONDS", "60"))
+# 他のインスタンスの切り替えが終わるのを待つ間、リースを確認する間隔（秒）
+TOPIC_LEASE_POLL_SECONDS = float(os.getenv("TOPIC_LEASE_POLL_SECONDS", "0.5"))
+# 他のインスタンスの切り替えを待つ最大秒数（過ぎたらリースの取得を1度だけ試し、取れなければTopicRotationBusyを送出する）
+TOPIC_LEASE_WAIT_SECONDS = float(os.getenv("TOPIC_LEASE_WAIT_SECONDS", str(TOPIC_LEASE_SECONDS)))
+
+# お題の切り替えのリース名
+TOPIC_LEASE_NAME = "topic_rotation"
+
+
+class TopicRotationBusy(RuntimeError):
+    """他のインスタンスの切り替えが待ち時間内に終わらなかった"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("他のインスタンスがお題を切り替え中です。しばらく待ってから再度お試しください")
+        self.retry_after = retry_after
+
+
+def _current_topic() -> Optional[Tuple[int, datetime]]:
+    """アクティブなお題の(ID, 有効期限)を返す（ワーカースレッドで実行）"""
+    db = SessionLocal()
+    try:
+        row = db.query(Topic.id, Topic.expires_at)\
+            .filter(Topic.is_active == True)\
+            .order_by(Topic.created_at.desc())\
+            .first()
+        return (row.id, row.expires_at) if row else None
+    finally:
+        db.close()
+
+
+def _swap_topic(content: str, rotation_hours: float) -> Tuple[int, List[int]]:
+    """古いお題の非アクティブ化と新しいお題の保存を1つのトランザクションで行う（ワーカースレッドで実行）
+
+    リースを保持していることを同じトランザクションの中で確かめ、取られていればLeaseLostを送出して何も変更しない。
+    """
+    db = SessionLocal()
+    try:
+        hold_lease(db, TOPIC_LEASE_NAME, TOPIC_LEASE_SECONDS)
+        old_ids = [topic_id for (topic_id,) in db.query(Topic.id).filter(Topic.is_active == True).all()]
+        if old_ids:
+            db.query(Topic).filter(Topic.id.in_(old_ids)).update({Topic.is_active: False}, synchronize_session=False)
+
+        new_topic = Topic(
+            content=content,
+            expires_at=utcnow() + timedelta(hours=rotation_hours),
+            is_active=True
+        )
+        db.add(new_topic)
+        db.commit()
+
+        # 新しいお題のランキングを用意し、終了したお題のランキングは破棄する
+        ranking_index.load_topic(db, new_topic.id, pin=True)
+        for old_id in old_ids:
+            ranking_index.drop_topic(old_id)
+            similarity_index.drop_topic(old_id)
+        return new_topic.id, old_ids
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class TopicRotationScheduler:
+    """お題の自動切り替えスケジューラ
+
+    有効期限のTOPIC_PREGENERATE_MINUTES分前に次のお題を生成してバッファに置き、
+    期限になったらバッファのお題に切り替える。切り替えはリクエストとは別のタスクで行うため、
+    ユーザーがお題の生成を待つことはなく、アクティブなお題が途切れることもない。
+
+    切り替えは同時に1つだけ実行する。プロセス内では実行中の切り替えに後から来た呼び出しを相乗りさせ、
+    インスタンス間ではDBのリースで排他して、リースを取れなかったインスタンスは相手の切り替えの結果を使う。
+    """
+
+    def __init__(
+        self,
+        rotation_hours: float = TOPIC_ROTATION_HOURS,
+        pregenerate_minutes: float = TOPIC_PREGENERATE_MINUTES,
+        buffer_size: int = TOPIC_BUFFER_SIZE,
+        retry_seconds: float = TOPIC_SCHEDULER_RETRY_SECONDS,
+    ):
+        self.rotation_hours = rotation_hours
+        self.pregenerate_seconds = pregenerate_minutes * 60
+        self.buffer_size = max(0, buffer_size)
+        self.retry_seconds = retry_seconds
+        self._buffer: List[str] = []
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        # 実行中の切り替え（expired_onlyの値 -> 結果のお題IDを受け取るFuture）
+        self._flights: Dict[bool, asyncio.Future] = {}
+        self._stats = {
+            "rotations": 0, "pregenerated": 0, "buffer_hits": 0, "errors": 0,
+            "coalesced": 0, "lease_waits": 0, "lease_timeouts": 0, "lease_lost": 0,
+        }
+
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="topic-rotation")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    @property
+    def rotating(self) -> bool:
+        """このプロセスで切り替えを実行中かどうか"""
+        return bool(self._flights)
+
+    async def rotate(self, expired_only: bool = False) -> int:
+        """次のお題に切り替えて新しいお題のIDを返す
+
+        expired_only=Trueの場合、有効なお題が残っていれば切り替えずにそのIDを返す。
+        同じ種類の切り替えが実行中であれば、新たに生成せずその結果を返す
+        （強制的な切り替えの実行中は、expired_only=Trueの呼び出しもその結果を待つ）。
+        """
+        flight = self._flights.get(expired_only) or (self._flights.get(False) if expired_only else None)
+        if flight is not None:
+            self._stats["coalesced"] += 1
+            return await asyncio.shield(flight)
+
+        flight = asyncio.get_running_loop().create_future()
+        # 待っている呼び出しがない場合に例外が未取得のまま破棄されないようにする
+        flight.add_done_callback(lambda future: future.cancelled() or future.exception())
+        self._flights[expired_only] = flight
+        try:
+            topic_id = await self._rotate(expired_only)
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(topic_id)
+            return topic_id
+        finally:
+            del self._flights[expired_only]
+
+    async def _rotate(self, expired_only: bool) -> int:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if expired_only:
+                current = await asyncio.to_thread(_current_topic)
+                if current is not None and current[1] > utcnow():
+                    return current[0]
+
+            if not await asyncio.to_thread(acquire_lease, TOPIC_LEASE_NAME, TOPIC_LEASE_SECONDS):
+                topic_id = await self._wait_for_other_instance()
+                if topic_id is not None:
+                    return topic_id
+            # 生成に時間がかかってもリースが切れないよう、解放するまで定期的に延長する
+            heartbeat = asyncio.create_task(self._heartbeat(), name="topic-lease-heartbeat")
+            try:
+                # リースを待つ間に他のインスタンスが切り替えた場合は生成しない
+                if expired_only:
+                    current = await asyncio.to_thread(_current_topic)
+                    if current is not None and current[1] > utcnow():
+                        active_topic_cache.invalidate()
+                        return current[0]
+                topic_id, old_ids = await self._generate_and_swap()
+            finally:
+                heartbeat.cancel()
+                await asyncio.gather(heartbeat, return_exceptions=True)
+                await asyncio.to_thread(release_lease, TOPIC_LEASE_NAME)
+
+        self._stats["rotations"] += 1
+        active_topic_cache.invalidate()
+        for old_id in old_ids:
+            publish_topic_event(old_id, "topic_closed", next_topic_id=topic_id)
+        logger.info("お題を切り替えました（ID: %d）", topic_id)
+        return topic_id
+
+    async def _generate_and_swap(self) -> Tuple[int, List[int]]:
+        if self._buffer:
+            content = self._buffer.pop(0)
+            self._stats["buffer_hits"] += 1
+        else:
+            content = await generate_topic(raise_errors=True)
+
+        try:
+            return await asyncio.to_thread(_swap_topic, content, self.rotation_hours)
+        except Exception:
+            # 保存できなかったお題は次の切り替えで使う
+            self._buffer.insert(0, content)
+            raise
+
+    async def _heartbeat(self) -> None:
+        """リースの有効期限の1/3ごとにリースを延長する"""
+        while True:
+            await asyncio.sleep(TOPIC_LEASE_SECONDS / 3)
+            try:
+                if not await asyncio.to_thread(acquire_lease, TOPIC_LEASE_NAME, TOPIC_LEASE_SECONDS):
+                    # 切り替えの保存時にも確かめるため、ここでは記録するだけにする
+                    self._stats["lease_lost"] += 1
+                    logger.warning("お題の切り替えのリースを他のインスタンスに取られました")
+                    return
+            except Exception as e:
+                logger.warning("お題の切り替えのリースを延長できませんでした: %s", e)
+
+    async def _wait_for_other_instance(self) -> Optional[int]:
+        """他のインスタンスの切り替えが終わるのを待ち、その結果のアクティブなお題のIDを返す
+
+        TOPIC_LEASE_WAIT_SECONDSを過ぎても終わらない場合はリースの取得を1度だけ試し、
+        取れればNoneを返して呼び出し元に切り替えを任せ、取れなければTopicRotationBusyを送出する。
+        """
+        self._stats["lease_waits"] += 1
+        logger.info("他のインスタンスがお題を切り替え中のため、完了を待ちます")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + TOPIC_LEASE_WAIT_SECONDS
+        while await asyncio.to_thread(lease_holder, TOPIC_LEASE_NAME) is not None:
+            if loop.time() >= deadline:
+                if await asyncio.to_thread(acquire_lease, TOPIC_LEASE_NAME, TOPIC_LEASE_SECONDS):
+                    logger.warning("他のインスタンスの切り替えが終わらないため、このインスタンスで切り替えます")
+                    return None
+                self._stats["lease_timeouts"] += 1
+                raise TopicRotationBusy(TOPIC_LEASE_SECONDS / 3)
+            await asyncio.sleep(TOPIC_LEASE_POLL_SECONDS)
+
+        active_topic_cache.invalidate()
+        current = await asyncio.to_thread(_current_topic)
+        if current is None or current[1] <= utcnow():
+            raise RuntimeError("他のインスタンスでのお題の切り替えに失敗しました")
+        return current[0]
+
+    async def _pregenerate(self) -> bool:
+        """次のお題を1つ生成してバッファに追加する"""
+        try:
+            content = await generate_topic(raise_errors=True)
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error("次のお題の事前生成に失敗しました: %s", e)
+            return False
+        self._buffer.append(content)
+        self._stats["pregenerated"] += 1
+        return True
+
+    async def _tick(self) -> float:
+        """必要な処理（事前生成・切り替え）を行い、次に確認するまでの秒数を返す"""
+        current = await asyncio.to_thread(_current_topic)
+        if current is None or current[1] <= utcnow():
+            await self.rotate(expired_only=True)
+            return 0
+
+        seconds_left = (current[1] - utcnow()).total_seconds()
+        if seconds_left > self.pregenerate_seconds:
+            return seconds_left - self.pregenerate_seconds
+        if len(self._buffer) < self.buffer_size:
+            if await self._pregenerate():
+                return 0
+            return min(self.retry_seconds, seconds_left)
+        return seconds_left
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                delay = await self._tick()
+            except Exception:
+                self._stats["errors"] += 1
+                logger.exception("お題の切り替えに失敗しました")
+                delay = self.retry_seconds
+            await asyncio.sleep(max(0.0, delay))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "buffered": len(self._buffer),
+            "rotating": self.rotating,
+            **self._stats,
+        }
+
+
+topic_scheduler = TopicRotationScheduler()
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import insert, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+
+from app.database import SessionLocal
+from app.models.models import Answer, Vote
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 投票をバッファしてからDBに書き込むまでの最大待ち時間（秒）
+VOTE_FLUSH_INTERVAL = float(os.getenv("VOTE_FLUSH_INTERVAL", "0.05"))
+# 1回の書き込みでまとめる最大件数（超えたら待たずに書き込む）
+VOTE_FLUSH_MAX_BATCH = int(os.getenv("VOTE_FLUSH_MAX_BATCH", "500"))
+
+VoteKey = Tuple[int, str]
+FlushListener = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+
+@dataclass
+class PendingVote:
+    answer_id: int
+    user_id: str
+    future: asyncio.Future
+
+
+def _insert_votes(db, pairs: List[VoteKey]) -> List[Any]:
+    """(answer_id, user_id)の組をまとめて挿入し、実際に挿入された行を返す"""
+    values = [{"answer_id": answer_id, "user_id": user_id} for answer_id, user_id in pairs]
+    returning = (Vote.id, Vote.answer_id, Vote.user_id, Vote.created_at)
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("sqlite", "postgresql"):
+        insert_fn = sqlite_insert if dialect == "sqlite" else postgresql_insert
+        stmt = insert_fn(Vote).values(values)\
+            .on_conflict_do_nothing(index_elements=["answer_id", "user_id"])\
+            .returning(*returning)
+        return db.execute(stmt).all()
+
+    # ON CONFLICTに対応していないDBでは1件ずつ挿入して重複を判定する
+    rows = []
+    for value in values:
+        try:
+            with db.begin_nested():
+                rows.append(db.execute(insert(Vote).values(value).returning(*returning)).one())
+        except IntegrityError:
+            pass
+    return rows
+
+
+def _write_votes(pairs: List[VoteKey]) -> Tuple[Dict[VoteKey, Dict[str, Any]], List[Dict[str, Any]]]:
+    """投票をまとめて書き込み、回答ごとの投票数カウンタを加算する（ワーカースレッドで実行）"""
+    db = SessionLocal()
+    try:
+        rows = _insert_votes(db, pairs)
+
+        inserted = {}
+        added: Dict[int, int] = {}
+        for row in rows:
+            inserted[(row.answer_id, row.user_id)] = {
+                "id": row.id,
+                "answer_id": row.answer_id,
+                "user_id": row.user_id,
+                "created_at": row.created_at,
+            }
+            added[row.answer_id] = added.get(row.answer_id, 0) + 1
+
+        counts = []
+        for answer_id, count in added.items():
+            result = db.execute(
+                update(Answer)
+                .where(Answer.id == answer_id)
+                .values(vote_count=Answer.vote_count + count)
+                .returning(Answer.topic_id, Answer.vote_count)
+            ).one()
+            counts.append({
+                "topic_id": result.topic_id,
+                "answer_id": answer_id,
+                "vote_count": result.vote_count,
+                "added": count,
+            })
+
+        db.commit()
+        return inserted, counts
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class VoteIngestor:
+    """投票の書き込みをまとめるライトビハインドバッファ
+
+    短い間隔で届いた投票をメモリ上で重複排除し、1回の一括INSERT
+    （ON CONFLICT DO NOTHING）と回答ごとのカウンタ更新で書き込む。
+    各リクエストは自分の投票が書き込まれるまで待ち、挿入された行（重複ならNone）を受け取る。
+    """
+
+    def __init__(self, flush_interval: float = VOTE_FLUSH_INTERVAL, max_batch: int = VOTE_FLUSH_MAX_BATCH):
+        self.flush_interval = flush_interval
+        self.max_batch = max(1, max_batch)
+        self._buffer: Dict[VoteKey, PendingVote] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._listeners: List[FlushListener] = []
+        self._stats = {"submitted": 0, "inserted": 0, "duplicates": 0, "flushes": 0}
+
+    def add_listener(self, listener: FlushListener) -> None:
+        """書き込み後に回答ごとの投票数の変化を受け取るコールバックを登録する"""
+        self._listeners.append(listener)
+
+    async def start(self) -> None:
+        if self._flusher is None or self._flusher.done():
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.create_task(self._run(), name="vote-ingestor")
+
+    async def stop(self) -> None:
+        """バッファに残った投票を書き込んでから停止する"""
+        if self._flusher is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.gather(self._flusher, return_exceptions=True)
+        self._flusher = None
+        self._stopping = False
+
+    async def submit(self, answer_id: int, user_id: str) -> Optional[Dict[str, Any]]:
+        """投票を登録する。すでに投票済みの場合はNoneを返す"""
+        await self.start()
+        self._stats["submitted"] += 1
+
+        key = (answer_id, user_id)
+        if key in self._buffer:
+            # 同じバッファ内の重複はDBに送らずに弾く
+            self._stats["duplicates"] += 1
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        self._buffer[key] = PendingVote(answer_id=answer_id, user_id=user_id, future=future)
+        if len(self._buffer) >= self.max_batch:
+            self._wakeup.set()
+        return await future
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._buffer:
+                await self._flush()
+        if self._buffer:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        pending, self._buffer = self._buffer, {}
+        self._stats["flushes"] += 1
+        try:
+            inserted, counts = await asyncio.to_thread(_write_votes, list(pending.keys()))
+        except Exception as e:
+            logger.error("投票の一括書き込みに失敗しました: %s", e)
+            for vote in pending.values():
+                if not vote.future.done():
+                    vote.future.set_exception(e)
+            return
+
+        for key, vote in pending.items():
+            row = inserted.get(key)
+            if row is None:
+                self._stats["duplicates"] += 1
+            else:
+                self._stats["inserted"] += 1
+            if not vote.future.done():
+                vote.future.set_result(row)
+
+        if counts:
+            for listener in self._listeners:
+                try:
+                    await listener(counts)
+                except Exception:
+                    logger.exception("投票書き込み後の処理でエラーが発生しました")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"buffered": len(self._buffer), **self._stats}
+
+
+vote_ingestor = VoteIngestor()
@@ -0,0 +1,35 @@
+import argparse
+import logging
+from app.database import SessionLocal
+from app.services.archiver import ARCHIVE_AFTER_HOURS, archivable_topic_ids, archive_expired_topics, archive_topic
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="終了したお題のアーカイブ")
+    parser.add_argument("--topic-id", type=int, help="指定したお題だけをアーカイブする")
+    parser.add_argument("--after-hours", type=float, default=ARCHIVE_AFTER_HOURS, help="有効期限から何時間経ったお題を対象にするか")
+    parser.add_argument("--dry-run", action="store_true", help="対象のお題を表示するだけでアーカイブしない")
+    args = parser.parse_args()
+
+    if args.topic_id is not None:
+        db = SessionLocal()
+        try:
+            archived = [args.topic_id] if archive_topic(db, args.topic_id) is not None else []
+        finally:
+            db.close()
+    elif args.dry_run:
+        db = SessionLocal()
+        try:
+            print(f"アーカイブ対象のお題: {archivable_topic_ids(db, args.after_hours, limit=None)}")
+        finally:
+            db.close()
+        archived = []
+    else:
+        archived = []
+        while True:
+            batch = archive_expired_topics(args.after_hours)
+            archived.extend(batch)
+            if not batch:
+                break
+
+    print(f"アーカイブしたお題: {len(archived)}件")
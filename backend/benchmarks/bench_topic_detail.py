@@ -0,0 +1,125 @@
+"""お題詳細（GET /api/topics/{id}）のシリアライズ方式の比較ベンチマーク
+
+従来の方式（ORMで回答を読み込み、TopicDetailでPydantic検証してJSON化）と、
+行データをそのままorjsonでJSON化する方式を、同じDB・同じお題で比較する。
+
+    python -m benchmarks.bench_topic_detail --answers 5000 --repeat 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# 計測用の一時DBを使う（app.databaseを読み込む前に設定する）
+_db_dir = tempfile.mkdtemp(prefix="ohgiri-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_db_dir, 'bench.db')}")
+# 計測中にお題の切り替えやアーカイブが走らないようにする
+os.environ.setdefault("TOPIC_SCHEDULER_ENABLED", "false")
+os.environ.setdefault("ARCHIVER_ENABLED", "false")
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy.orm import selectinload  # noqa: E402
+
+from app.database import SessionLocal, engine  # noqa: E402
+from app.migrations import run_migrations  # noqa: E402
+from app.models.models import Answer, Topic  # noqa: E402
+from app.queries import row_dicts, select_answers, select_topic_with_snapshot  # noqa: E402
+from app.responses import FastJSONResponse  # noqa: E402
+from app.schemas.schemas import TopicDetail  # noqa: E402
+
+
+def seed(answer_count: int) -> int:
+    run_migrations(engine)
+    db = SessionLocal()
+    try:
+        topic = Topic(content="ベンチマーク用のお題", expires_at=datetime.utcnow() + timedelta(hours=4), is_active=True)
+        db.add(topic)
+        db.flush()
+        db.bulk_insert_mappings(Answer, [
+            {
+                "topic_id": topic.id,
+                "content": f"回答{i} " + "あ" * 40,
+                "user_name": f"user{i % 500}",
+                "user_id": f"u{i}",
+                "ai_score": i % 10 + 1,
+                "ai_comment": "ベンチマーク用のコメントです。" * 2,
+                "vote_count": i % 37,
+            }
+            for i in range(answer_count)
+        ])
+        db.commit()
+        return topic.id
+    finally:
+        db.close()
+
+
+def orm_pydantic(topic_id: int) -> bytes:
+    """従来の方式: ORMオブジェクト → TopicDetail（from_attributes） → JSON"""
+    db = SessionLocal()
+    try:
+        topic = db.query(Topic).options(selectinload(Topic.answers)).filter(Topic.id == topic_id).first()
+        return TopicDetail.model_validate(topic).model_dump_json().encode("utf-8")
+    finally:
+        db.close()
+
+
+def rows_orjson(topic_id: int) -> bytes:
+    """高速な方式: 必要な列だけを取得した行データ → dict → orjson"""
+    db = SessionLocal()
+    try:
+        topic = db.execute(select_topic_with_snapshot(topic_id)).first()
+        answers = db.execute(select_answers().where(Answer.topic_id == topic_id).order_by(Answer.id))
+        detail = dict(topic._mapping)
+        del detail["snapshot"]
+        detail.update(message=None, answers=row_dicts(answers), archived=False)
+        return FastJSONResponse(detail).body
+    finally:
+        db.close()
+
+
+def measure(fn, repeat: int) -> dict:
+    fn()  # ウォームアップ
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "mean_ms": statistics.mean(timings),
+        "p50_ms": timings[len(timings) // 2],
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="お題詳細のシリアライズ方式の比較")
+    parser.add_argument("--answers", type=int, default=5000, help="お題に登録する回答数")
+    parser.add_argument("--repeat", type=int, default=20, help="計測回数")
+    args = parser.parse_args()
+
+    topic_id = seed(args.answers)
+    print(f"DB: {os.environ['DATABASE_URL']}  回答数: {args.answers}  計測回数: {args.repeat}")
+
+    from app.main import app
+
+    with TestClient(app) as client:
+        results = {
+            "orm+pydantic": measure(lambda: orm_pydantic(topic_id), args.repeat),
+            "rows+orjson": measure(lambda: rows_orjson(topic_id), args.repeat),
+            "GET /api/topics/{id}": measure(lambda: client.get(f"/api/topics/{topic_id}").raise_for_status(), args.repeat),
+        }
+
+    baseline = results["orm+pydantic"]["mean_ms"]
+    for name, result in results.items():
+        print(
+            f"{name:<24} mean {result['mean_ms']:8.2f} ms  p50 {result['p50_ms']:8.2f} ms  "
+            f"p95 {result['p95_ms']:8.2f} ms  ({baseline / result['mean_ms']:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""負荷試験用のOpenAI互換の擬似サーバー
+
+/v1/chat/completions だけを実装し、遅延とエラー率を指定できる（stream=Trueにも対応）。
+プロンプトの内容からお題生成・単体評価・一括評価を判別して、それらしいJSONを返す。
+
+    python -m benchmarks.fake_openai --port 8900 --latency-ms 400 --error-rate 0.02
+
+POST /settings に {"error_rate": 1.0} などを送ると、実行中に遅延やエラー率を変更できる。
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 一括評価のプロンプトに含まれる「[回答ID] 回答」の行
+ANSWER_LINE = re.compile(r"^\s*\[(\d+)\]", re.M)
+
+TOPICS = [
+    "こんなコンビニは嫌だ、どんなコンビニ？",
+    "絶対に流行らない新しいスポーツとは？",
+    "宇宙人が地球に来て最初に言った一言とは？",
+    "ロボットが書いた日記、最初の一文は？",
+]
+
+
+class FakeSettings:
+    latency_ms = 300.0
+    jitter_ms = 100.0
+    error_rate = 0.0
+    rate_limit_rate = 0.0
+    # ストリーミング時のチャンクごとの間隔
+    token_ms = 20.0
+
+
+settings = FakeSettings()
+app = FastAPI(title="fake-openai")
+stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+
+
+def _content_for(messages) -> str:
+    system_prompt = messages[0]["content"] if messages else ""
+    ids = ANSWER_LINE.findall(system_prompt)
+    if ids:
+        return json.dumps({
+            "evaluations": [
+                {"id": int(answer_id), "score": random.randint(1, 10), "comment": f"擬似評価コメント{answer_id}"}
+                for answer_id in ids
+            ]
+        }, ensure_ascii=False)
+    if "JSON" in system_prompt or "json" in system_prompt:
+        return json.dumps({"score": random.randint(1, 10), "comment": "擬似評価コメント"}, ensure_ascii=False)
+    return random.choice(TOPICS)
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+
+    delay = max(0.0, settings.latency_ms + random.uniform(-settings.jitter_ms, settings.jitter_ms)) / 1000
+    await asyncio.sleep(delay)
+
+    roll = random.random()
+    if roll < settings.rate_limit_rate:
+        stats["rate_limited"] += 1
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+            status_code=429,
+            headers={"retry-after": "1"},
+        )
+    if roll < settings.rate_limit_rate + settings.error_rate:
+        stats["errors"] += 1
+        return JSONResponse({"error": {"message": "The server had an error", "type": "server_error"}}, status_code=500)
+
+    content = _content_for(body.get("messages", []))
+    if body.get("stream"):
+        return StreamingResponse(_stream_chunks(body, content), media_type="text/event-stream")
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-3.5-turbo"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 200, "completion_tokens": len(content), "total_tokens": 200 + len(content)},
+    }
+
+
+async def _stream_chunks(body, content: str):
+    """chat.completion.chunkをServer-Sent Eventsで少しずつ返す"""
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    model = body.get("model", "gpt-3.5-turbo")
+
+    def chunk(delta, finish_reason=None, usage=None):
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+        }
+        if usage is not None:
+            data["usage"] = usage
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    yield chunk({"role": "assistant", "content": ""})
+    for start in range(0, len(content), 4):
+        if start:
+            await asyncio.sleep(settings.token_ms / 1000)
+        yield chunk({"content": content[start:start + 4]})
+    yield chunk({}, finish_reason="stop")
+    if (body.get("stream_options") or {}).get("include_usage"):
+        yield chunk(None, usage={"prompt_tokens": 200, "completion_tokens": len(content), "total_tokens": 200 + len(content)})
+    yield "data: [DONE]\n\n"
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+@app.post("/settings")
+async def update_settings(request: Request):
+    """遅延やエラー率を実行中に変更する（障害と回復の再現用）"""
+    for key, value in (await request.json()).items():
+        if hasattr(FakeSettings, key):
+            setattr(settings, key, float(value))
+    return {key: getattr(settings, key) for key in vars(FakeSettings) if not key.startswith("_")}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenAI互換の擬似サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=settings.latency_ms, help="1リクエストあたりの平均遅延")
+    parser.add_argument("--jitter-ms", type=float, default=settings.jitter_ms, help="遅延のばらつき（±）")
+    parser.add_argument("--token-ms", type=float, default=settings.token_ms, help="ストリーミング時のチャンクの間隔")
+    parser.add_argument("--error-rate", type=float, default=settings.error_rate, help="500エラーを返す割合")
+    parser.add_argument("--rate-limit-rate", type=float, default=settings.rate_limit_rate, help="429を返す割合")
+    args = parser.parse_args()
+
+    settings.latency_ms = args.latency_ms
+    settings.jitter_ms = args.jitter_ms
+    settings.token_ms = args.token_ms
+    settings.error_rate = args.error_rate
+    settings.rate_limit_rate = args.rate_limit_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""バックエンドの負荷試験
+
+一時DBにデータを投入し、擬似OpenAIサーバーとAPIサーバーを起動してから、
+お題の参照・回答の投稿・投票の集中などを混ぜたリクエストを一定時間送り続け、
+エンドポイントごとのスループットとp50/p95/p99レイテンシを出力する。
+結果はJSONに保存され、--compareで過去の結果と比較できる（悪化していれば終了コード1）。
+
+    python -m benchmarks.loadtest --duration 30 --concurrency 50
+    python -m benchmarks.loadtest --compare benchmarks/results/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+# 既定のリクエストの比率
+DEFAULT_MIX = "active=40,detail=15,answers=15,post_answer=10,vote=20"
+
+OPERATIONS = {
+    "active": "GET /api/topics/active",
+    "detail": "GET /api/topics/{id}",
+    "answers": "GET /api/answers/topic/{id}",
+    "post_answer": "POST /api/answers",
+    "vote": "POST /api/votes/votes",
+}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        name, weight = item.split("=")
+        if name not in OPERATIONS:
+            raise SystemExit(f"不明な操作です: {name}（{', '.join(OPERATIONS)}）")
+        weights[name] = float(weight)
+    return weights
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise SystemExit(f"サーバーが起動できませんでした: {' '.join(process.args)}")
+            try:
+                await client.get(url, timeout=1.0)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise SystemExit(f"サーバーの起動がタイムアウトしました: {url}")
+
+
+class LoadTest:
+    """一定時間、重み付きでランダムに選んだリクエストを並行して送り続ける"""
+
+    def __init__(self, base_url: str, weights: Dict[str, float], concurrency: int, duration: float, hot_answers: int, rng: random.Random):
+        self.base_url = base_url
+        self.operations = list(weights)
+        self.weights = [weights[name] for name in self.operations]
+        self.concurrency = concurrency
+        self.duration = duration
+        self.hot_answers = hot_answers
+        self.rng = rng
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.transport_errors: Dict[str, int] = defaultdict(int)
+        self.topic_id: Optional[int] = None
+        self.answer_ids: List[int] = []
+        self._counter = 0
+
+    def _next_id(self) -> int:
+        self._counter += 1
+        return self._counter
+
+    async def prepare(self, client: httpx.AsyncClient) -> None:
+        topic = (await client.get("/api/topics/active")).raise_for_status().json()
+        self.topic_id = topic["id"]
+        answers = (await client.get(f"/api/answers/topic/{self.topic_id}", params={"sort": "votes", "limit": self.hot_answers})).json()
+        self.answer_ids = [answer["id"] for answer in answers]
+
+    async def _request(self, client: httpx.AsyncClient, name: str) -> None:
+        run_id = self._next_id()
+        if name == "active":
+            request = client.get("/api/topics/active")
+        elif name == "detail":
+            request = client.get(f"/api/topics/{self.topic_id}")
+        elif name == "answers":
+            request = client.get(f"/api/answers/topic/{self.topic_id}", params={"sort": self.rng.choice(["created_at", "votes", "score"])})
+        elif name == "post_answer":
+            request = client.post("/api/answers", json={
+                "topic_id": self.topic_id,
+                "content": f"負荷試験の回答{run_id}",
+                "user_name": "loadtest",
+                "user_id": f"load-{os.getpid()}-{run_id}",
+            })
+        else:
+            # 上位の少数の回答に投票が集中する状況を再現する
+            request = client.post("/api/votes/votes", json={
+                "answer_id": self.rng.choice(self.answer_ids),
+                "user_id": f"voter-{os.getpid()}-{run_id}",
+            })
+
+        start = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            self.transport_errors[name] += 1
+            return
+        self.samples[name].append((time.perf_counter() - start) * 1000)
+        self.statuses[name][response.status_code] += 1
+
+    async def _worker(self, client: httpx.AsyncClient, deadline: float) -> None:
+        while time.monotonic() < deadline:
+            name = self.rng.choices(self.operations, weights=self.weights)[0]
+            await self._request(client, name)
+
+    async def run(self) -> Dict[str, Any]:
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=30.0, follow_redirects=True) as client:
+            await self.prepare(client)
+            started = time.monotonic()
+            deadline = started + self.duration
+            await asyncio.gather(*[self._worker(client, deadline) for _ in range(self.concurrency)])
+            elapsed = time.monotonic() - started
+
+            server_stats = {}
+            for name, path in (("evaluation_queue", "/api/answers/evaluation/queue"), ("vote_ingest", "/api/votes/votes/ingest/stats")):
+                try:
+                    server_stats[name] = (await client.get(path)).json()
+                except (httpx.HTTPError, ValueError):
+                    pass
+
+        results = {}
+        for name in self.operations:
+            timings = sorted(self.samples[name])
+            statuses = dict(self.statuses[name])
+            errors = sum(count for status, count in statuses.items() if status >= 500) + self.transport_errors[name]
+            results[OPERATIONS[name]] = {
+                "requests": len(timings),
+                "throughput_rps": round(len(timings) / elapsed, 2),
+                "errors": errors,
+                "statuses": {str(status): count for status, count in sorted(statuses.items())},
+                "mean_ms": round(sum(timings) / len(timings), 2) if timings else 0.0,
+                "p50_ms": round(percentile(timings, 50), 2),
+                "p95_ms": round(percentile(timings, 95), 2),
+                "p99_ms": round(percentile(timings, 99), 2),
+            }
+        total = sum(result["requests"] for result in results.values())
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "total_requests": total,
+            "total_throughput_rps": round(total / elapsed, 2),
+            "endpoints": results,
+            "server_stats": server_stats,
+        }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n合計 {report['total_requests']}件 / {report['elapsed_seconds']}秒 = {report['total_throughput_rps']} req/s")
+    print(f"{'endpoint':<30}{'req':>8}{'rps':>10}{'err':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, result in report["endpoints"].items():
+        print(
+            f"{name:<30}{result['requests']:>8}{result['throughput_rps']:>10.1f}{result['errors']:>6}"
+            f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+        )
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> bool:
+    """ベースラインと比べてp95がthreshold以上悪化、またはスループットがthreshold以上低下したエンドポイントがあればTrue"""
+    regressed = False
+    print(f"\nベースライン（{baseline['meta'].get('commit')}）との比較（しきい値 {threshold:.0%}）")
+    print(f"{'endpoint':<30}{'p95 base':>10}{'p95 now':>10}{'Δp95':>9}{'rps base':>10}{'rps now':>10}{'Δrps':>9}")
+    for name, result in current["report"]["endpoints"].items():
+        base = baseline["report"]["endpoints"].get(name)
+        if not base or not base["requests"] or not result["requests"]:
+            continue
+        p95_change = (result["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        rps_change = (result["throughput_rps"] - base["throughput_rps"]) / base["throughput_rps"] if base["throughput_rps"] else 0.0
+        worse = p95_change > threshold or rps_change < -threshold
+        regressed = regressed or worse
+        print(
+            f"{name:<30}{base['p95_ms']:>10.1f}{result['p95_ms']:>10.1f}{p95_change:>+9.0%}"
+            f"{base['throughput_rps']:>10.1f}{result['throughput_rps']:>10.1f}{rps_change:>+9.0%}"
+            f"{'  ← 悪化' if worse else ''}"
+        )
+    return regressed
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="ohgiri-loadtest-")
+    base_url = args.base_url
+    try:
+        if base_url is None:
+            fake_port, app_port = free_port(), free_port()
+            env = {
+                **os.environ,
+                "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+                "AI_PROVIDER": args.ai_provider,
+                "OPENAI_API_KEY": "sk-loadtest-fake",
+                "OPENAI_BASE_URL": f"http://127.0.0.1:{fake_port}/v1",
+                "AI_LOCAL_LATENCY_MS": str(args.ai_latency_ms),
+                "TOPIC_SCHEDULER_ENABLED": "false",
+                "ARCHIVER_ENABLED": "false",
+            }
+
+            print("データを投入しています...")
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.seed",
+                 "--topics", str(args.topics),
+                 "--answers-per-topic", str(args.answers_per_topic),
+                 "--votes-per-answer", str(args.votes_per_answer),
+                 "--random-seed", str(args.random_seed)],
+                cwd=BACKEND_DIR, env=env, check=True,
+            )
+
+            if args.ai_provider == "openai":
+                fake = subprocess.Popen(
+                    [sys.executable, "-m", "benchmarks.fake_openai", "--port", str(fake_port),
+                     "--latency-ms", str(args.ai_latency_ms), "--error-rate", str(args.ai_error_rate),
+                     "--rate-limit-rate", str(args.ai_rate_limit_rate)],
+                    cwd=BACKEND_DIR, env=env,
+                )
+                processes.append(fake)
+                await wait_until_ready(f"http://127.0.0.1:{fake_port}/stats", fake)
+
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(app_port),
+                 "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+                cwd=BACKEND_DIR, env=env,
+            )
+            processes.append(server)
+            base_url = f"http://127.0.0.1:{app_port}"
+            await wait_until_ready(f"{base_url}/health", server)
+
+        print(f"{args.duration}秒間、同時{args.concurrency}接続でリクエストを送信しています...")
+        load = LoadTest(
+            base_url, parse_mix(args.mix), args.concurrency, args.duration, args.hot_answers,
+            random.Random(args.random_seed),
+        )
+        return await load.run()
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="バックエンドの負荷試験")
+    parser.add_argument("--duration", type=float, default=30, help="計測時間（秒）")
+    parser.add_argument("--concurrency", type=int, default=50, help="同時接続数")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"リクエストの比率（{', '.join(OPERATIONS)}）")
+    parser.add_argument("--hot-answers", type=int, default=10, help="投票が集中する上位の回答数")
+    parser.add_argument("--workers", type=int, default=1, help="APIサーバーのワーカー数")
+    parser.add_argument("--topics", type=int, default=20)
+    parser.add_argument("--answers-per-topic", type=int, default=500)
+    parser.add_argument("--votes-per-answer", type=int, default=3)
+    parser.add_argument("--ai-provider", choices=["openai", "local"], default="openai", help="openaiは擬似OpenAIサーバー経由、localは外部通信なしの決定的な評価")
+    parser.add_argument("--ai-latency-ms", type=float, default=400, help="擬似OpenAIサーバー（またはローカルプロバイダー）の遅延")
+    parser.add_argument("--ai-error-rate", type=float, default=0.0, help="擬似OpenAIサーバーが500を返す割合")
+    parser.add_argument("--ai-rate-limit-rate", type=float, default=0.0, help="擬似OpenAIサーバーが429を返す割合")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--base-url", help="起動済みのサーバーに対して実行する場合のURL（データ投入と起動を省略）")
+    parser.add_argument("--output", help="結果のJSONの保存先（既定: benchmarks/results/<commit>-<日時>.json）")
+    parser.add_argument("--compare", help="比較するベースラインの結果JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="悪化とみなす変化の割合")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    commit = git_commit()
+    result = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        },
+        "report": report,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{commit or 'unknown'}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\n結果を保存しました: {output}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        if compare(result, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
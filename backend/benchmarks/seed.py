@@ -0,0 +1,85 @@
+"""負荷試験用のデータ投入
+
+DATABASE_URLのDBに、終了済みのお題と現在アクティブなお題を作り、回答と投票を登録する。
+
+    DATABASE_URL=sqlite:///./bench.db python -m benchmarks.seed --topics 50 --answers-per-topic 200 --votes-per-answer 5
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from app.database import SessionLocal, engine
+from app.migrations import run_migrations
+from app.models.models import Answer, Topic, Vote
+
+# 一度にまとめて登録する行数
+CHUNK_SIZE = 5000
+
+
+def _insert_chunks(db, model, rows) -> None:
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.bulk_insert_mappings(model, rows[start:start + CHUNK_SIZE])
+
+
+def seed(topics: int, answers_per_topic: int, votes_per_answer: int, rng: random.Random) -> int:
+    """データを投入し、アクティブなお題のIDを返す"""
+    run_migrations(engine)
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        topic_rows = []
+        for i in range(topics):
+            active = i == topics - 1
+            topic_rows.append({
+                "content": f"ベンチマーク用のお題{i}",
+                "expires_at": now + timedelta(hours=4) if active else now - timedelta(hours=4 * (topics - i)),
+                "is_active": active,
+            })
+        _insert_chunks(db, Topic, topic_rows)
+        db.flush()
+        topic_ids = [topic_id for (topic_id,) in db.query(Topic.id).order_by(Topic.id.desc()).limit(topics).all()]
+
+        answer_rows = []
+        for topic_id in topic_ids:
+            for i in range(answers_per_topic):
+                answer_rows.append({
+                    "topic_id": topic_id,
+                    "content": f"回答{i} " + "あ" * rng.randint(5, 40),
+                    "user_name": f"user{i % 500}",
+                    "user_id": f"seed-{topic_id}-{i}",
+                    "ai_score": rng.randint(1, 10),
+                    "ai_comment": "ベンチマーク用のコメントです。",
+                    "vote_count": votes_per_answer,
+                })
+        _insert_chunks(db, Answer, answer_rows)
+        db.flush()
+
+        if votes_per_answer:
+            answer_ids = [answer_id for (answer_id,) in db.query(Answer.id).filter(Answer.topic_id.in_(topic_ids)).all()]
+            vote_rows = [
+                {"answer_id": answer_id, "user_id": f"seed-voter-{v}"}
+                for answer_id in answer_ids
+                for v in range(votes_per_answer)
+            ]
+            _insert_chunks(db, Vote, vote_rows)
+
+        db.commit()
+        return max(topic_ids)
+    finally:
+        db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="負荷試験用のデータ投入")
+    parser.add_argument("--topics", type=int, default=20)
+    parser.add_argument("--answers-per-topic", type=int, default=200)
+    parser.add_argument("--votes-per-answer", type=int, default=3)
+    parser.add_argument("--random-seed", type=int, default=42)
+    args = parser.parse_args()
+
+    active_topic_id = seed(args.topics, args.answers_per_topic, args.votes_per_answer, random.Random(args.random_seed))
+    print(f"アクティブなお題: {active_topic_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,21 @@
-import os
-from app.database import engine, Base
-from app.models.models import Topic, Answer, Vote
+import argparse
 from sqlalchemy import text
+from app.database import engine, Base
+from app.migrations import run_migrations
 
-# データベースのテーブルを初期化
-print("データベースを初期化しています...")
-Base.metadata.drop_all(bind=engine)
-
-# データベーススキーマの作成
-def create_schema():
-    Base.metadata.create_all(bind=engine)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="データベースの初期化")
+    parser.add_argument("--reset", action="store_true", help="すべてのテーブルを削除してから作り直す（データは失われます）")
+    args = parser.parse_args()
 
-# データベースマイグレーション
-def migrate_db():
-    with engine.connect() as conn:
-        # answersテーブルにuser_idカラムがなければ追加
-        try:
-            conn.execute(text("ALTER TABLE answers ADD COLUMN user_id VARCHAR(100) NOT NULL DEFAULT 'anonymous'"))
-            print("user_id column added to answers table")
-            conn.commit()
-        except Exception as e:
-            print(f"Migration error or column already exists: {e}")
-            conn.rollback()
+    # --resetを指定した場合だけテーブルを削除する
+    if args.reset:
+        print("データベースを初期化しています...")
+        Base.metadata.drop_all(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS schema_migrations"))
 
-if __name__ == "__main__":
-    # データベースファイルが存在するかチェック
-    db_exists = os.path.exists("app.db")
-    
-    # スキーマ作成
-    create_schema()
-    
-    # 既存のDBの場合はマイグレーションを実行
-    if db_exists:
-        migrate_db()
+    # スキーマ作成と未適用のマイグレーションの適用
+    run_migrations(engine)
 
-    print("データベース初期化が完了しました。") 
\ No newline at end of file
+    print("データベース初期化が完了しました。")
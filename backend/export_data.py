@@ -0,0 +1,23 @@
+import argparse
+import sys
+from datetime import datetime
+from app.services.exporter import EXPORT_DATASETS, EXPORT_FORMATS, export_rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="お題・回答・投票の集計をNDJSON / CSVで一括エクスポート")
+    parser.add_argument("dataset", choices=list(EXPORT_DATASETS), help="出力するデータ")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson", help="出力形式")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="この日時以降（UTC）に作成された行だけを出力する")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="この日時より前（UTC）に作成された行だけを出力する")
+    parser.add_argument("--topic-id", type=int, action="append", default=[], help="お題IDで絞り込む（複数指定可）")
+    parser.add_argument("--gzip", action="store_true", help="gzipで圧縮する")
+    parser.add_argument("--output", "-o", help="出力先のファイル（省略すると標準出力）")
+    args = parser.parse_args()
+
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in export_rows(args.dataset, args.format, args.since, args.until, args.topic_id, args.gzip):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
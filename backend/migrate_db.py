@@ -1,17 +1,33 @@
+import argparse
+import logging
 from app.database import engine
-from sqlalchemy import text
+from app.migrations import MIGRATIONS, applied_versions, repair_vote_counts, run_migrations
 
-# データベースマイグレーション - user_idカラム追加
-def migrate_db():
-    with engine.connect() as conn:
-        # answersテーブルにuser_idカラムがなければ追加
-        try:
-            conn.execute(text("ALTER TABLE answers ADD COLUMN user_id VARCHAR(100) NOT NULL DEFAULT 'anonymous'"))
-            print("user_id column added to answers table")
-            conn.commit()
-        except Exception as e:
-            print(f"Migration error or column already exists: {e}")
+# votesテーブルから投票数を数え直してanswers.vote_countを修復
+def repair():
+    with engine.begin() as conn:
+        updated = repair_vote_counts(conn)
+    print(f"vote_count repaired: {updated} answers updated")
+
+# 適用済み・未適用のマイグレーションを表示
+def show_status():
+    applied = set(applied_versions(engine))
+    for migration in MIGRATIONS:
+        mark = "applied" if migration.version in applied else "pending"
+        print(f"{migration.version:04d}_{migration.name}: {mark}")
 
 if __name__ == "__main__":
-    migrate_db()
-    print("マイグレーション完了") 
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="データベースマイグレーション")
+    parser.add_argument("--repair-vote-counts", action="store_true", help="answers.vote_countをvotesテーブルから再計算する")
+    parser.add_argument("--status", action="store_true", help="マイグレーションの適用状況を表示する")
+    args = parser.parse_args()
+
+    if args.repair_vote_counts:
+        repair()
+    elif args.status:
+        show_status()
+    else:
+        applied = run_migrations(engine)
+        print(f"適用したマイグレーション: {len(applied)}件")
+    print("マイグレーション完了")
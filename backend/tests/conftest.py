@@ -0,0 +1,37 @@
+"""テスト共通の設定
+
+appを読み込む前に、一時ディレクトリのSQLiteとローカルのAIプロバイダーを使うよう環境変数を設定する
+（開発用のohgiri.dbやOpenAIのAPIには触れない）。バックグラウンドの定期処理は無効にする。
+"""
+import os
+import tempfile
+
+_TEST_DIR = tempfile.mkdtemp(prefix="ohgiri-tests-")
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TEST_DIR, 'test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["AI_PROVIDER"] = "local"
+os.environ["TOPIC_SCHEDULER_ENABLED"] = "false"
+os.environ["ARCHIVER_ENABLED"] = "false"
+os.environ["AI_PENDING_SWEEP_INTERVAL"] = "0"
+os.environ["LOG_FORMAT"] = "text"
+
+import pytest  # noqa: E402
+
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app.migrations import run_migrations  # noqa: E402
+
+run_migrations(engine)
+
+
+@pytest.fixture
+def db():
+    """テストごとに空のテーブルを用意する同期セッション"""
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        with engine.begin() as conn:
+            for table in reversed(Base.metadata.sorted_tables):
+                conn.execute(table.delete())
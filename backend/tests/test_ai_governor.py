@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.services.ai_governor import AICircuitOpen, AIGovernor, CircuitBreaker
+
+OPEN_SECONDS = 0.05
+
+
+def test_circuit_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, open_seconds=OPEN_SECONDS)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.on_failure()
+    assert breaker.state == "closed"
+
+    breaker.before_call()
+    breaker.on_failure()
+    assert breaker.state == "open"
+    assert breaker.is_open
+    with pytest.raises(AICircuitOpen) as excinfo:
+        breaker.before_call()
+    assert 0 < excinfo.value.retry_after <= OPEN_SECONDS
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, open_seconds=OPEN_SECONDS)
+    breaker.before_call()
+    breaker.on_failure()
+    breaker.before_call()
+    breaker.on_success()
+    breaker.before_call()
+    breaker.on_failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_probe_closes_circuit():
+    breaker = CircuitBreaker(failure_threshold=1, open_seconds=OPEN_SECONDS)
+    breaker.before_call()
+    breaker.on_failure()
+    assert breaker.state == "open"
+
+    time.sleep(OPEN_SECONDS * 1.5)
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    # 試験呼び出しの結果が出るまで、他の呼び出しは通さない
+    with pytest.raises(AICircuitOpen):
+        breaker.before_call()
+
+    breaker.on_success()
+    assert breaker.state == "closed"
+    assert not breaker.is_open
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_circuit():
+    breaker = CircuitBreaker(failure_threshold=1, open_seconds=OPEN_SECONDS)
+    breaker.before_call()
+    breaker.on_failure()
+    time.sleep(OPEN_SECONDS * 1.5)
+
+    breaker.before_call()
+    breaker.on_failure()
+    assert breaker.state == "open"
+    assert breaker.opened_count == 2
+    with pytest.raises(AICircuitOpen):
+        breaker.before_call()
+
+
+def test_governor_stops_calling_while_open_and_recovers():
+    governor = AIGovernor(
+        rpm_limit=0, tpm_limit=0, concurrency_min=1, concurrency_max=4, concurrency_initial=2,
+        failure_threshold=2, open_seconds=OPEN_SECONDS,
+    )
+    calls = []
+
+    async def failing():
+        calls.append("fail")
+        raise httpx.ConnectError("connection refused")
+
+    async def succeeding():
+        calls.append("ok")
+        return "result"
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                await governor.run(failing, estimated_tokens=10)
+        assert governor.stats()["circuit_state"] == "open"
+
+        # 開いている間は呼び出し自体を行わない
+        with pytest.raises(AICircuitOpen):
+            await governor.run(succeeding, estimated_tokens=10)
+        assert calls == ["fail", "fail"]
+
+        await asyncio.sleep(OPEN_SECONDS * 1.5)
+        assert await governor.run(succeeding, estimated_tokens=10) == "result"
+        assert governor.stats()["circuit_state"] == "closed"
+        assert governor.stats()["rejected"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_parse_errors_do_not_open_circuit():
+    governor = AIGovernor(rpm_limit=0, tpm_limit=0, failure_threshold=1, open_seconds=OPEN_SECONDS)
+
+    async def invalid_json():
+        raise ValueError("invalid JSON")
+
+    async def scenario():
+        for _ in range(3):
+            with pytest.raises(ValueError):
+                await governor.run(invalid_json, estimated_tokens=10)
+
+    asyncio.run(scenario())
+    assert governor.stats()["circuit_state"] == "closed"
@@ -0,0 +1,133 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from app.main import app
+from app.models.models import Answer, Topic, Vote
+from app.routers import admin
+from app.services.exporter import export_rows
+
+DAY1 = datetime(2026, 1, 1, 12, 0, 0)
+DAY2 = DAY1 + timedelta(days=1)
+DAY3 = DAY1 + timedelta(days=2)
+
+
+@pytest.fixture
+def votes_data(db):
+    """2つのお題の回答に、3日に分けて投票したデータ"""
+    topics = [Topic(content=f"お題{i}", expires_at=DAY3, is_active=False, created_at=DAY1) for i in range(2)]
+    db.add_all(topics)
+    db.commit()
+    answers = [
+        Answer(topic_id=topics[0].id, content="回答A", user_name="a", user_id="a", created_at=DAY1, vote_count=3),
+        Answer(topic_id=topics[0].id, content="回答B", user_name="b", user_id="b", created_at=DAY1, vote_count=1),
+        Answer(topic_id=topics[1].id, content="回答C", user_name="c", user_id="c", created_at=DAY2, vote_count=2),
+    ]
+    db.add_all(answers)
+    db.commit()
+    a, b, c = answers
+    db.add_all([
+        Vote(answer_id=a.id, user_id="v1", created_at=DAY1),
+        Vote(answer_id=a.id, user_id="v2", created_at=DAY2),
+        Vote(answer_id=a.id, user_id="v3", created_at=DAY2 + timedelta(hours=1)),
+        Vote(answer_id=b.id, user_id="v1", created_at=DAY3),
+        Vote(answer_id=c.id, user_id="v1", created_at=DAY2),
+        Vote(answer_id=c.id, user_id="v2", created_at=DAY3),
+    ])
+    db.commit()
+    return topics, answers
+
+
+def _ndjson(chunks) -> list:
+    return [json.loads(line) for line in b"".join(chunks).decode("utf-8").splitlines()]
+
+
+def test_votes_export_without_filters_includes_every_answer(votes_data):
+    _, (a, b, c) = votes_data
+    rows = {row["answer_id"]: row for row in _ndjson(export_rows("votes"))}
+
+    assert set(rows) == {a.id, b.id, c.id}
+    assert rows[a.id]["recorded_votes"] == 3
+    assert rows[a.id]["unique_voters"] == 3
+    assert rows[a.id]["vote_count"] == 3
+
+
+def test_votes_export_counts_only_votes_in_the_period(votes_data):
+    _, (a, b, c) = votes_data
+    rows = _ndjson(export_rows("votes", since=DAY2, until=DAY3))
+
+    # 期間内（DAY2以上DAY3未満）に投票のない回答Bは含めない
+    assert [row["answer_id"] for row in rows] == [a.id, c.id]
+    by_id = {row["answer_id"]: row for row in rows}
+    assert by_id[a.id]["recorded_votes"] == 2
+    assert by_id[a.id]["first_vote_at"].startswith("2026-01-02T12:00:00")
+    assert by_id[a.id]["last_vote_at"].startswith("2026-01-02T13:00:00")
+    assert by_id[c.id]["recorded_votes"] == 1
+    # answers.vote_countは期間によらない合計のまま
+    assert by_id[a.id]["vote_count"] == 3
+
+
+def test_votes_export_since_only_and_until_only(votes_data):
+    _, (a, b, c) = votes_data
+    since_rows = {row["answer_id"]: row["recorded_votes"] for row in _ndjson(export_rows("votes", since=DAY3))}
+    until_rows = {row["answer_id"]: row["recorded_votes"] for row in _ndjson(export_rows("votes", until=DAY2))}
+
+    assert since_rows == {b.id: 1, c.id: 1}
+    assert until_rows == {a.id: 1}
+
+
+def test_votes_export_combines_period_and_topic_filters(votes_data):
+    (first, _), (a, b, c) = votes_data
+    rows = _ndjson(export_rows("votes", since=DAY2, topic_ids=[first.id]))
+    assert {row["answer_id"]: row["recorded_votes"] for row in rows} == {a.id: 2, b.id: 1}
+
+
+def test_votes_export_as_csv(votes_data):
+    _, (a, _, c) = votes_data
+    text = b"".join(export_rows("votes", export_format="csv", since=DAY2, until=DAY3)).decode("utf-8")
+    rows = list(csv.DictReader(io.StringIO(text)))
+
+    assert [int(row["answer_id"]) for row in rows] == [a.id, c.id]
+    assert rows[0]["recorded_votes"] == "2"
+
+
+def test_export_api_requires_token_and_streams_gzip(votes_data, monkeypatch):
+    _, (a, _, c) = votes_data
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+    with TestClient(app) as client:
+        params = {"since": "2026-01-02T00:00:00", "until": "2026-01-03T12:00:00", "gzip": "true"}
+        assert client.get("/api/admin/export/votes", params=params).status_code == 403
+
+        response = client.get("/api/admin/export/votes", params=params, headers={"X-Admin-Token": "secret"})
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/gzip"
+        rows = [json.loads(line) for line in gzip.decompress(response.content).decode("utf-8").splitlines()]
+        assert [row["answer_id"] for row in rows] == [a.id, c.id]
+
+
+def test_votes_export_period_boundary_with_server_default_created_at(db):
+    topic = Topic(content="お題", expires_at=DAY3, is_active=False)
+    db.add(topic)
+    db.commit()
+    answer = Answer(topic_id=topic.id, content="回答", user_name="a", user_id="a")
+    db.add(answer)
+    db.commit()
+    # created_atはサーバー側の既定値（CURRENT_TIMESTAMP）に任せる
+    db.execute(text("INSERT INTO votes (answer_id, user_id) VALUES (:answer_id, 'v1')"), {"answer_id": answer.id})
+    db.commit()
+    stored = db.execute(text("SELECT created_at FROM votes")).scalar_one()
+    boundary = datetime.strptime(stored, "%Y-%m-%d %H:%M:%S")
+
+    def recorded(**period):
+        return {row["answer_id"]: row["recorded_votes"] for row in _ndjson(export_rows("votes", **period))}
+
+    # 境界の秒ちょうどの投票はsinceに含まれ、untilには含まれない
+    assert recorded(since=boundary) == {answer.id: 1}
+    assert recorded(until=boundary) == {}
+    assert recorded(since=boundary, until=boundary + timedelta(seconds=1)) == {answer.id: 1}
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from app.models.models import Lease, Topic
+from app.services import topic_scheduler as scheduler_module
+from app.services.leases import LeaseLost, acquire_lease, hold_lease, lease_holder, release_lease
+from app.services.topic_cache import utcnow
+
+LEASE = "test_lease"
+
+
+def _expire(db, name: str) -> None:
+    db.query(Lease).filter(Lease.name == name).update({Lease.expires_at: utcnow() - timedelta(seconds=1)})
+    db.commit()
+
+
+def test_only_one_holder_until_expiry(db):
+    assert acquire_lease(LEASE, 60, holder="a")
+    assert not acquire_lease(LEASE, 60, holder="b")
+    # 保持者自身は延長できる
+    assert acquire_lease(LEASE, 60, holder="a")
+    assert lease_holder(LEASE) == "a"
+
+
+def test_expired_lease_is_taken_over(db):
+    assert acquire_lease(LEASE, 60, holder="a")
+    _expire(db, LEASE)
+    assert lease_holder(LEASE) is None
+
+    assert acquire_lease(LEASE, 60, holder="b")
+    assert lease_holder(LEASE) == "b"
+    assert not acquire_lease(LEASE, 60, holder="a")
+
+
+def test_previous_holder_cannot_use_or_release_a_taken_over_lease(db):
+    assert acquire_lease(LEASE, 60, holder="a")
+    _expire(db, LEASE)
+    assert acquire_lease(LEASE, 60, holder="b")
+
+    with pytest.raises(LeaseLost):
+        hold_lease(db, LEASE, 60, holder="a")
+    db.rollback()
+
+    release_lease(LEASE, holder="a")
+    assert lease_holder(LEASE) == "b"
+
+
+def test_rotation_refuses_to_swap_after_losing_the_lease(db, monkeypatch):
+    """生成中にリースが切れて他のインスタンスに取られた場合、お題を書き換えない"""
+    monkeypatch.setattr(scheduler_module, "TOPIC_LEASE_SECONDS", 60)
+    scheduler = scheduler_module.TopicRotationScheduler(buffer_size=0)
+
+    async def slow_generate(raise_errors=False):
+        _expire(db, scheduler_module.TOPIC_LEASE_NAME)
+        assert acquire_lease(scheduler_module.TOPIC_LEASE_NAME, 60, holder="other")
+        return "奪われたお題"
+
+    monkeypatch.setattr(scheduler_module, "generate_topic", slow_generate)
+    with pytest.raises(LeaseLost):
+        asyncio.run(scheduler.rotate())
+    assert db.query(Topic).count() == 0
+    assert lease_holder(scheduler_module.TOPIC_LEASE_NAME) == "other"
+
+
+def test_heartbeat_keeps_the_lease_during_slow_generation(db, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "TOPIC_LEASE_SECONDS", 0.3)
+    scheduler = scheduler_module.TopicRotationScheduler(buffer_size=0)
+    taken_over = []
+
+    async def slow_generate(raise_errors=False):
+        # リースの有効期限より長く生成に時間がかかっても、他のインスタンスは取得できない
+        for _ in range(4):
+            await asyncio.sleep(0.2)
+            taken_over.append(await asyncio.to_thread(acquire_lease, scheduler_module.TOPIC_LEASE_NAME, 60, "other"))
+        return "時間のかかるお題"
+
+    monkeypatch.setattr(scheduler_module, "generate_topic", slow_generate)
+    topic_id = asyncio.run(scheduler.rotate())
+    assert taken_over == [False] * 4
+    assert db.get(Topic, topic_id).is_active
+    assert lease_holder(scheduler_module.TOPIC_LEASE_NAME) is None
+
+
+def test_waiting_for_a_stuck_holder_is_bounded(db, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "TOPIC_LEASE_WAIT_SECONDS", 0.2)
+    monkeypatch.setattr(scheduler_module, "TOPIC_LEASE_POLL_SECONDS", 0.05)
+    assert acquire_lease(scheduler_module.TOPIC_LEASE_NAME, 60, holder="stuck")
+    scheduler = scheduler_module.TopicRotationScheduler(buffer_size=0)
+
+    with pytest.raises(scheduler_module.TopicRotationBusy):
+        asyncio.run(scheduler.rotate())
+    assert scheduler.stats()["lease_timeouts"] == 1
+
+
+def test_rotation_takes_over_an_expired_lease(db, monkeypatch):
+    monkeypatch.setattr(scheduler_module, "TOPIC_LEASE_POLL_SECONDS", 0.05)
+    assert acquire_lease(scheduler_module.TOPIC_LEASE_NAME, 60, holder="crashed")
+    _expire(db, scheduler_module.TOPIC_LEASE_NAME)
+    scheduler = scheduler_module.TopicRotationScheduler(buffer_size=0)
+
+    topic_id = asyncio.run(scheduler.rotate())
+    assert db.get(Topic, topic_id).is_active
+    assert scheduler.stats()["rotations"] == 1
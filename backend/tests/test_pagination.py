@@ -0,0 +1,112 @@
+import threading
+from datetime import timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.database import SessionLocal
+from app.main import app
+from app.models.models import Answer, Topic
+from app.pagination import NEXT_CURSOR_HEADER
+from app.services.topic_cache import utcnow
+
+
+@pytest.fixture
+def client(db):
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def _add_topics(db, count: int) -> list:
+    topics = [Topic(content=f"お題{i}", expires_at=utcnow() + timedelta(hours=1), is_active=False) for i in range(count)]
+    db.add_all(topics)
+    db.commit()
+    return [topic.id for topic in topics]
+
+
+def _pages(client, path: str, limit: int, between_pages=None, **params) -> list:
+    """X-Next-Cursorをたどって全ページを取得する（ページの間にbetween_pagesを呼ぶ）"""
+    pages = []
+    cursor = None
+    while True:
+        response = client.get(path, params={**params, "limit": limit, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        pages.append([item["id"] for item in response.json()])
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            return pages
+        if between_pages is not None:
+            between_pages(len(pages))
+
+
+def test_topic_pages_do_not_shift_when_new_topics_arrive(client, db):
+    original = sorted(_add_topics(db, 25), reverse=True)
+
+    # 1ページ目を読んだ後に新しいお題が増えても、続きのページはずれない
+    pages = _pages(client, "/api/topics/", limit=10, between_pages=lambda _: _add_topics(db, 5))
+    seen = [topic_id for page in pages for topic_id in page]
+
+    assert pages[0] == original[:10]
+    assert seen == original
+    assert len(seen) == len(set(seen))
+
+
+def test_answer_pages_stay_stable_under_concurrent_inserts(client, db):
+    topic_id = _add_topics(db, 1)[0]
+    db.add_all([Answer(topic_id=topic_id, content=f"回答{i}", user_name="u", user_id=f"u{i}") for i in range(60)])
+    db.commit()
+    original = [answer_id for (answer_id,) in db.query(Answer.id).filter(Answer.topic_id == topic_id).order_by(Answer.id)]
+
+    stop = threading.Event()
+    inserted = []
+
+    def insert_answers():
+        session = SessionLocal()
+        try:
+            while not stop.is_set():
+                answer = Answer(topic_id=topic_id, content="後から届いた回答", user_name="w", user_id="writer")
+                session.add(answer)
+                session.commit()
+                inserted.append(answer.id)
+        finally:
+            session.close()
+
+    writer = threading.Thread(target=insert_answers)
+    writer.start()
+    try:
+        pages = _pages(client, f"/api/answers/topic/{topic_id}", limit=7)
+    finally:
+        stop.set()
+        writer.join()
+
+    seen = [answer_id for page in pages for answer_id in page]
+    assert len(seen) == len(set(seen))
+    # 最初からあった回答は投稿順のまま1回ずつ現れ、後から届いた回答はその後ろにだけ現れる
+    assert seen[:len(original)] == original
+    assert set(seen[len(original):]) <= set(inserted)
+
+
+def test_answer_pages_by_votes_skip_nothing(client, db):
+    topic_id = _add_topics(db, 1)[0]
+    answers = [
+        Answer(topic_id=topic_id, content=f"回答{i}", user_name="u", user_id=f"u{i}", vote_count=i % 4)
+        for i in range(30)
+    ]
+    db.add_all(answers)
+    db.commit()
+    expected = [answer.id for answer in sorted(answers, key=lambda answer: (-answer.vote_count, answer.id))]
+
+    def add_unvoted(_):
+        db.add(Answer(topic_id=topic_id, content="新しい回答", user_name="n", user_id="new"))
+        db.commit()
+
+    pages = _pages(client, f"/api/answers/topic/{topic_id}", limit=8, between_pages=add_unvoted, sort="votes")
+    seen = [answer_id for page in pages for answer_id in page]
+    assert seen[:len(expected)] == expected
+    assert len(seen) == len(set(seen))
+
+
+def test_invalid_cursor_is_rejected(client, db):
+    topic_id = _add_topics(db, 1)[0]
+    response = client.get(f"/api/answers/topic/{topic_id}", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
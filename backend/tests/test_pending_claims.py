@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from app.models.models import Answer, Topic
+from app.services.evaluation_queue import _claim_pending, _renew_claims
+from app.services.topic_cache import utcnow
+
+CLAIM_SECONDS = 180
+
+
+def _add_pending(db, count: int) -> list:
+    topic = Topic(content="お題", expires_at=utcnow() + timedelta(hours=1), is_active=True)
+    db.add(topic)
+    db.commit()
+    answers = [Answer(topic_id=topic.id, content=f"回答{i}", user_name="u", user_id=f"u{i}") for i in range(count)]
+    db.add_all(answers)
+    db.commit()
+    return [answer.id for answer in answers]
+
+
+def _age_claims(db, seconds: float) -> None:
+    db.query(Answer).update({Answer.eval_claimed_at: utcnow() - timedelta(seconds=seconds)})
+    db.commit()
+
+
+def test_new_answers_are_claimed_by_the_posting_process(db):
+    _add_pending(db, 3)
+    assert _claim_pending(CLAIM_SECONDS, 24, 10) == []
+
+
+def test_concurrent_sweeps_claim_each_answer_once(db):
+    answer_ids = _add_pending(db, 40)
+    _age_claims(db, CLAIM_SECONDS * 2)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: _claim_pending(CLAIM_SECONDS, 24, 100), range(4)))
+
+    claimed = [answer_id for result in results for answer_id, _ in result]
+    assert sorted(claimed) == sorted(answer_ids)
+    assert _claim_pending(CLAIM_SECONDS, 24, 100) == []
+
+
+def test_renewed_claims_are_not_swept(db):
+    answer_ids = _add_pending(db, 4)
+    _age_claims(db, CLAIM_SECONDS * 2)
+    _renew_claims(answer_ids[:2])
+
+    assert [answer_id for answer_id, _ in _claim_pending(CLAIM_SECONDS, 24, 10)] == answer_ids[2:]
+
+
+def test_evaluated_answers_are_not_claimed(db):
+    answer_ids = _add_pending(db, 2)
+    db.query(Answer).filter(Answer.id == answer_ids[0]).update({Answer.ai_score: 5, Answer.ai_comment: "評価済み"})
+    db.commit()
+    _age_claims(db, CLAIM_SECONDS * 2)
+
+    assert [answer_id for answer_id, _ in _claim_pending(CLAIM_SECONDS, 24, 10)] == [answer_ids[1]]
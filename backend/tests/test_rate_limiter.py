@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+from app.services.rate_limiter import InMemorySlidingWindowBackend
+
+
+def _hit(backend, key, limit, window):
+    return asyncio.run(backend.hit(key, limit, window))
+
+
+def test_sweep_expires_each_key_by_its_own_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    backend = InMemorySlidingWindowBackend(sweep_seconds=0)
+
+    assert _hit(backend, "answer:1.2.3.4", 1, 300) == 0.0
+    assert _hit(backend, "vote:1.2.3.4", 30, 60) == 0.0
+
+    # 投票のウィンドウを過ぎても回答のクールダウンは残る
+    now[0] += 61
+    assert _hit(backend, "vote:5.6.7.8", 30, 60) == 0.0
+    assert len(backend) == 2
+    assert _hit(backend, "answer:1.2.3.4", 1, 300) > 0
+
+    now[0] += 300
+    _hit(backend, "vote:5.6.7.8", 30, 60)
+    assert len(backend) == 1
+
+
+def test_new_keys_do_not_rescan_live_entries():
+    backend = InMemorySlidingWindowBackend(sweep_seconds=0)
+
+    async def hit_range(start, stop):
+        for i in range(start, stop):
+            await backend.hit(f"vote:{i}", 30, 60)
+
+    asyncio.run(hit_range(0, 20000))
+    start = time.perf_counter()
+    asyncio.run(hit_range(20000, 30000))
+    assert time.perf_counter() - start < 1.0
+    assert len(backend) == 30000
@@ -208,4 +208,24 @@ export const answersApi = {
   }
 };
 
+// お題ごとのリアルタイムイベント（新規回答・AI評価・投票数）を購読
+export const subscribeTopicEvents = (topicId: number, onEvent: (event: any) => void) => {
+  const source = new EventSource(`${getBaseUrl()}/stream/topics/${topicId}`);
+  const eventTypes = ['answer_created', 'answer_evaluated', 'vote_count'];
+  eventTypes.forEach((type) => {
+    source.addEventListener(type, (e) => {
+      try {
+        onEvent(JSON.parse((e as MessageEvent).data));
+      } catch (error) {
+        console.error('イベントの解析に失敗しました', error);
+      }
+    });
+  });
+  source.onerror = (error) => {
+    // EventSourceは自動で再接続する
+    console.error('リアルタイム接続エラー:', error);
+  };
+  return () => source.close();
+};
+
 export default apiClient; 
\ No newline at end of file
@@ -2,7 +2,7 @@
 
 import { useEffect, useState } from 'react';
 import { useRouter } from 'next/navigation';
-import { topicsApi, answersApi } from '../../api/apiClient';
+import { topicsApi, answersApi, subscribeTopicEvents } from '../../api/apiClient';
 import { TopicDetail, Answer, AnswerFormValues } from '../../types';
 import { FiClock, FiSend, FiUser, FiMessageCircle, FiAward, FiArrowLeft } from 'react-icons/fi';
 import { formatDistanceToNow } from 'date-fns';
@@ -72,6 +72,43 @@ export default function TopicDetailClient({ topicId }: TopicDetailClientProps) {
     fetchTopicDetail();
   }, [numericTopicId]);
 
+  // 回答・AI評価・投票数の更新をリアルタイムで反映
+  useEffect(() => {
+    if (isNaN(numericTopicId)) {
+      return;
+    }
+    return subscribeTopicEvents(numericTopicId, (event) => {
+      setTopic(prev => {
+        if (!prev) {
+          return prev;
+        }
+        switch (event.type) {
+          case 'answer_created':
+            if (prev.answers.some(a => a.id === event.answer.id)) {
+              return prev;
+            }
+            return { ...prev, answers: [...prev.answers, event.answer] };
+          case 'answer_evaluated':
+            return {
+              ...prev,
+              answers: prev.answers.map(a => a.id === event.answer_id
+                ? { ...a, ai_score: event.ai_score, ai_comment: event.ai_comment }
+                : a),
+            };
+          case 'vote_count':
+            return {
+              ...prev,
+              answers: prev.answers.map(a => a.id === event.answer_id
+                ? { ...a, vote_count: event.vote_count }
+                : a),
+            };
+          default:
+            return prev;
+        }
+      });
+    });
+  }, [numericTopicId]);
+
   // フォームの入力値を更新
   const handleChange = (e: React.ChangeEvent<HTMLInputElement | HTMLTextAreaElement>) => {
     const { name, value } = e.target;
@@ -91,7 +128,7 @@ export default function TopicDetailClient({ topicId }: TopicDetailClientProps) {
     console.log('🔄 回答送信開始', { ...formValues, topic_id: numericTopicId, user_id: userId });
 
     try {
-      await answersApi.createAnswer({
+      const created: Answer = await answersApi.createAnswer({
         topic_id: numericTopicId,
         content: formValues.content,
         user_name: formValues.user_name,
@@ -101,8 +138,10 @@ export default function TopicDetailClient({ topicId }: TopicDetailClientProps) {
       toast.success('回答を送信しました！AIが評価中です...');
       setFormValues({ content: '', user_name: '' });
       
-      // 回答リストを更新
-      fetchTopicDetail();
+      // 回答リストに追加（以降の評価結果はリアルタイムイベントで反映される）
+      setTopic(prev => prev && !prev.answers.some(a => a.id === created.id)
+        ? { ...prev, answers: [...prev.answers, created] }
+        : prev);
     } catch (err) {
       console.error('回答の送信に失敗しました', err);
       toast.error('回答の送信に失敗しました。後でもう一度お試しください。');